@@ -1,17 +1,73 @@
+"""The todo API, built by ``create_app``
+
+    uvicorn --factory app:create_app
+    uvicorn app:api
+    python -m app serve
+
+Importing the package touches nothing: ``create_app`` reads the settings
+and builds what depends on them, the engines are created and the schema
+is checked by the startup handlers of the app. The schema itself is created and upgraded by
+``python -m app migrate``.
+"""
 import fastapi
+from app.internal.auth import verified_token_cache
+from app.internal.cache import configure_region
 from app.internal.config import Config
+from app.internal.db import dispose_engines, get_engine, init_engines
+from app.internal.migrations import check_schema
 from app.internal.exceptions import http_exception_handler
+from app.internal.hashing import hashing_executor
+from app.internal import config
+from app.internal.log import RequestLogMiddleware, setup_logging, stop_logging
+from app.internal.metrics import MetricsMiddleware, metrics_endpoint
+from app.internal.reaper import refresh_token_reaper
 from .main import main_router
 from .admin import admin_router
 
 
-Config("config.yaml")
+def create_app(config_file: str | None = None) -> fastapi.FastAPI:
+    """Build the app, its startup and shutdown handlers own the resources
+
+    Args:
+        config_file (str | None): settings file to use instead of
+            TODO_CONFIG, see Config
+
+    Returns:
+        fastapi.FastAPI: the app
+    """
+    if config_file:
+        Config(config_file)
+    # the process wide objects follow the settings of the latest app
+    configure_region()
+    hashing_executor.configure()
+    verified_token_cache.configure()
+    refresh_token_reaper.configure()
+    api = fastapi.FastAPI()
+
+    api.include_router(main_router)
+    api.include_router(admin_router)
 
-api = fastapi.FastAPI()
+    api.add_exception_handler(fastapi.exceptions.HTTPException,
+                              http_exception_handler)
+    api.add_middleware(RequestLogMiddleware)
+    if config.metrics_enabled:
+        api.add_middleware(MetricsMiddleware)
+        api.add_api_route("/metrics", metrics_endpoint,
+                          include_in_schema=False)
+    api.add_event_handler("startup", setup_logging)
+    api.add_event_handler("startup", init_engines)
+    api.add_event_handler("startup", lambda: check_schema(get_engine()))
+    api.add_event_handler("startup", refresh_token_reaper.start)
+    api.add_event_handler("shutdown", refresh_token_reaper.stop)
+    api.add_event_handler("shutdown", dispose_engines)
+    api.add_event_handler("shutdown", hashing_executor.shutdown)
+    api.add_event_handler("shutdown", stop_logging)
+    return api
 
-api.include_router(main_router)
-api.include_router(admin_router)
-# api = fastapi.APIRouter(prefix="/api")
 
-api.add_exception_handler(fastapi.exceptions.HTTPException,
-                          http_exception_handler)
+def __getattr__(name: str):
+    # ``app:api``, built on first access
+    if name == 'api':
+        globals()['api'] = create_app()
+        return globals()['api']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
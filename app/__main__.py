@@ -0,0 +1,255 @@
+"""Maintenance commands
+
+    python -m app migrate
+    python -m app migrate-todo-indexes
+    python -m app migrate-todo-versions
+    python -m app migrate-token-families
+    python -m app migrate-permission-masks
+    python -m app migrate-user-names
+    python -m app reap-refresh-tokens
+    python -m app rebuild-todo-search
+    python -m app rebuild-todo-stats [--verify]
+    python -m app provision-users FILE [--format csv]
+    python -m app serve [--workers N] [--host HOST] [--port PORT]
+"""
+import argparse
+import os
+import sys
+from sqlite3 import IntegrityError
+
+
+def migrate_schema(args):
+    from app.internal.db import engine
+    from app.internal.migrations import SCHEMA_VERSION, migrate
+
+    try:
+        for version, description in migrate(engine, args.batch_size):
+            print(f"applied {version}: {description}")
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"schema at version {SCHEMA_VERSION}")
+
+
+def migrate_todo_indexes(args):
+    from app.internal.db import engine
+    from app.internal.migrations import add_todo_indexes
+
+    try:
+        created = add_todo_indexes(engine)
+    except ValueError as e:
+        sys.exit(str(e))
+    print(f"created todos indexes: {', '.join(created) or 'none'}")
+
+
+def migrate_todo_versions(args):
+    from app.internal.db import engine
+    from app.internal.migrations import add_missing_columns
+    from app.internal.migrations import backfill_todo_versions
+    from app.internal.models import Todo
+
+    added = add_missing_columns(engine, Todo.__table__)
+    if added:
+        print(f"added todos columns: {', '.join(added)}")
+    updated = backfill_todo_versions(engine, args.batch_size)
+    print(f"set the version of {updated} todos")
+
+
+def migrate_token_families(args):
+    from app.crud import assign_token_families
+    from app.internal.db import SessionLocal, engine
+    from app.internal.migrations import add_missing_columns
+    from app.internal.models import RefreshToken
+
+    added = add_missing_columns(engine, RefreshToken.__table__)
+    if added:
+        print(f"added refresh_tokens columns: {', '.join(added)}")
+    with SessionLocal() as db:
+        assigned = assign_token_families(db, args.batch_size)
+    print(f"assigned a family to {assigned} refresh tokens")
+
+
+def migrate_permission_masks(args):
+    from app.internal.db import engine
+    from app.internal.migrations import add_missing_columns
+    from app.internal.migrations import backfill_permission_masks
+    from app.internal.models import User
+
+    added = add_missing_columns(engine, User.__table__)
+    if added:
+        print(f"added users columns: {', '.join(added)}")
+    updated = backfill_permission_masks(engine, args.batch_size)
+    print(f"filled permission_mask of {updated} users")
+
+
+def migrate_user_names(args):
+    from app.internal.db import engine
+    from app.internal.migrations import add_missing_columns
+    from app.internal.migrations import backfill_user_names
+    from app.internal.models import User
+
+    added = add_missing_columns(engine, User.__table__)
+    if added:
+        print(f"added users columns: {', '.join(added)}")
+    updated = backfill_user_names(engine, args.batch_size)
+    print(f"filled name_lower of {updated} users")
+
+
+def reap_refresh_tokens(args):
+    from app.internal.reaper import reap_refresh_tokens
+
+    report = reap_refresh_tokens(args.batch_size, args.pause)
+    print(f"deleted {report.deleted} refresh tokens in {report.seconds:.2f}s")
+    print(f"rows: {report.rows_before} -> {report.rows_after}")
+    if report.size_before is not None:
+        print(f"bytes: {report.size_before} -> {report.size_after}")
+
+
+def rebuild_todo_search(args):
+    from app.internal.db import engine
+    from app.internal.migrations import rebuild_todo_search
+
+    indexed = rebuild_todo_search(engine)
+    print(f"indexed {indexed} todos")
+
+
+def rebuild_todo_stats(args):
+    from app.internal.db import engine
+    from app.internal.migrations import rebuild_todo_stats, todo_stats_drift
+
+    if args.verify:
+        drift = todo_stats_drift(engine)
+        for owner, stored, counted in drift:
+            print(f"owner {owner}: stored (total, done) {stored}, "
+                  f"counted {counted}")
+        if drift:
+            sys.exit(f"todo_stats of {len(drift)} owners drifted, rebuild it")
+        print("todo_stats matches the todos")
+        return
+    counted = rebuild_todo_stats(engine)
+    print(f"counted the todos of {counted} owners")
+
+
+def provision_users(args):
+    from app.provisioning import provision_users_from_file
+
+    created = conflicts = invalid = 0
+    with open(args.file, newline='', encoding='utf-8') as file:
+        for line, result in provision_users_from_file(file, args.format,
+                                                      args.chunk_size):
+            if isinstance(result, IntegrityError):
+                conflicts += 1
+                print(f"line {line}: {result}")
+            elif isinstance(result, Exception):
+                invalid += 1
+                print(f"line {line}: invalid row, {result}")
+            else:
+                created += 1
+    print(f"created {created} users, {conflicts} name conflicts, "
+          f"{invalid} invalid rows")
+
+
+def serve(args):
+    from app.server import serve
+
+    sys.exit(serve(args.host, args.port, args.workers, args.backlog,
+                   args.graceful_timeout))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m app',
+                                     description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate = commands.add_parser(
+        'migrate',
+        help="create missing tables and apply the pending schema upgrades, "
+             "run it before starting the app")
+    migrate.add_argument('--batch-size', type=int, default=500)
+    migrate.set_defaults(func=migrate_schema)
+
+    migrate = commands.add_parser(
+        'migrate-todo-indexes',
+        help="create the todos indexes, checks for duplicate names first")
+    migrate.set_defaults(func=migrate_todo_indexes)
+
+    migrate = commands.add_parser(
+        'migrate-todo-versions',
+        help="add todos.version and set it on existing todos")
+    migrate.add_argument('--batch-size', type=int, default=500)
+    migrate.set_defaults(func=migrate_todo_versions)
+
+    migrate = commands.add_parser(
+        'migrate-token-families',
+        help="add refresh_tokens.family_id and fill it for existing chains")
+    migrate.add_argument('--batch-size', type=int, default=500)
+    migrate.set_defaults(func=migrate_token_families)
+
+    migrate = commands.add_parser(
+        'migrate-permission-masks',
+        help="add users.permission_mask and fill it from permissions")
+    migrate.add_argument('--batch-size', type=int, default=500)
+    migrate.set_defaults(func=migrate_permission_masks)
+
+    migrate = commands.add_parser(
+        'migrate-user-names',
+        help="add users.name_lower and its index, fill it from name")
+    migrate.add_argument('--batch-size', type=int, default=500)
+    migrate.set_defaults(func=migrate_user_names)
+
+    reap = commands.add_parser(
+        'reap-refresh-tokens',
+        help="delete refresh token families that are fully expired")
+    reap.add_argument('--batch-size', type=int, default=500)
+    reap.add_argument('--pause', type=float, default=0.05,
+                      help="seconds between batches")
+    reap.set_defaults(func=reap_refresh_tokens)
+
+    rebuild = commands.add_parser(
+        'rebuild-todo-search',
+        help="create the todos full-text index if missing and rebuild it")
+    rebuild.set_defaults(func=rebuild_todo_search)
+
+    rebuild = commands.add_parser(
+        'rebuild-todo-stats',
+        help="count every user's todos into todo_stats again")
+    rebuild.add_argument('--verify', action='store_true',
+                         help="only compare todo_stats with the todos, exit "
+                              "with an error if they differ")
+    rebuild.set_defaults(func=rebuild_todo_stats)
+
+    provision = commands.add_parser(
+        'provision-users',
+        help="create the users of an NDJSON or CSV file, hashing their "
+             "passwords in parallel")
+    provision.add_argument('file', help="rows with name, raw_password and "
+                                        "permissions (space separated in CSV)")
+    provision.add_argument('--format', choices=['ndjson', 'csv'],
+                           default='ndjson')
+    provision.add_argument('--chunk-size', type=int, default=None,
+                           help="users per transaction, default "
+                                "provision_chunk_size")
+    provision.set_defaults(func=provision_users)
+
+    serve_parser = commands.add_parser(
+        'serve',
+        help="serve the app with several worker processes, the app is "
+             "built once before they are forked; SIGHUP reloads the "
+             "settings and replaces the workers gracefully")
+    serve_parser.add_argument('--workers', type=int,
+                              default=os.cpu_count() or 1,
+                              help="worker processes, default the cores")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--backlog', type=int, default=2048,
+                              help="pending connections the socket queues")
+    serve_parser.add_argument('--graceful-timeout', type=float, default=30,
+                              help="seconds a stopped worker may take to "
+                                   "finish its requests")
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Awaitable counterparts of the functions in app.crud
+
+Each function takes the session from ``get_session`` (``Session`` or
+``AsyncSession``) followed by the same arguments as its ``crud`` namesake.
+"""
+import functools
+from app import crud
+from app.internal.db import run_in_session
+
+
+def _awaitable(fn):
+    @functools.wraps(fn)
+    async def wrapper(db, *args, **kwargs):
+        return await run_in_session(db, fn, *args, **kwargs)
+    return wrapper
+
+
+# todos
+
+get_todo_list_version = _awaitable(crud.get_todo_list_version)
+get_todo_stats = _awaitable(crud.get_todo_stats)
+get_all_todo_stats = _awaitable(crud.get_all_todo_stats)
+get_todos = _awaitable(crud.get_todos)
+get_todos_for_user = _awaitable(crud.get_todos_for_user)
+get_todos_for_user_after = _awaitable(crud.get_todos_for_user_after)
+list_todo_rows_for_user = _awaitable(crud.list_todo_rows_for_user)
+list_todos_for_user = _awaitable(crud.list_todos_for_user)
+search_todo_rows = _awaitable(crud.search_todo_rows)
+search_todos = _awaitable(crud.search_todos)
+create_todo = _awaitable(crud.create_todo)
+get_todo_by_id = _awaitable(crud.get_todo_by_id)
+todo_name_exists_for_user = _awaitable(crud.todo_name_exists_for_user)
+get_todo_by_name = _awaitable(crud.get_todo_by_name)
+update_todo_by_id = _awaitable(crud.update_todo_by_id)
+delete_todo_by_id = _awaitable(crud.delete_todo_by_id)
+create_todos = _awaitable(crud.create_todos)
+update_todos = _awaitable(crud.update_todos)
+delete_todos = _awaitable(crud.delete_todos)
+
+# users
+
+get_user_by_username = _awaitable(crud.get_user_by_username)
+get_user_by_id = _awaitable(crud.get_user_by_id)
+list_users = _awaitable(crud.list_users)
+list_users_after = _awaitable(crud.list_users_after)
+search_users = _awaitable(crud.search_users)
+insert_user = _awaitable(crud.insert_user)
+taken_user_names = _awaitable(crud.taken_user_names)
+create_users = _awaitable(crud.create_users)
+update_user = _awaitable(crud.update_user)
+delete_user = _awaitable(crud.delete_user)
+
+# refresh tokens
+
+refresh_token_used = _awaitable(crud.refresh_token_used)
+save_refresh_token = _awaitable(crud.save_refresh_token)
+get_refresh_token = _awaitable(crud.get_refresh_token)
+add_child_refresh_token = _awaitable(crud.add_child_refresh_token)
+disable_token = _awaitable(crud.disable_token)
+deactivate_token_family = _awaitable(crud.deactivate_token_family)
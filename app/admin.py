@@ -1,91 +1,160 @@
-from fastapi import Depends, APIRouter
+from operator import attrgetter
+from sqlite3 import IntegrityError
+import sqlalchemy.exc
+from fastapi import Depends, APIRouter, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.exceptions import HTTPException
-from sqlalchemy.orm import Session
-from app import crud
-from app.main import get_db
-from app.internal.auth import verify_auth_token, register_user, bcrypt_password
+from starlette.concurrency import run_in_threadpool
+from app import acrud
+from app.export import todo_export_response
+from app.provisioning import ConcurrentNameError, provision_users
+from app.internal.db import AnySession, get_session, run_in_session
+from app.internal import config
+from app.internal.pagination import decode_id_cursor, decode_name_cursor
+from app.internal.pagination import paginate_by_id, paginate_by_key
+from app.internal.auth import require_permissions, register_user, bcrypt_password
 from app.internal.schemas import UserDTOSchemaAdmin, UserFullSchema
 from app.internal.schemas import UserPermissionsEnum, UserInsertSchema
+from app.internal.schemas import TodoStatsSchema, UserBatchResultSchema
 
 
 admin_router = APIRouter(prefix="/api/admin")
 
 
-def check_is_admin(token: dict[str, any], admin_permission: int) -> bool:
-    """Check if token has admin permission
-
-    Args:
-        token (dict[str, any]): JWT decoded, verified token
-        admin_permission (int): integer value that represents admin
-            permissions in a token
-
-    Returns:
-        bool: _description_
-    """
-    permissions = token['permissions']
-    if admin_permission not in permissions:
-        return False
-    return True
+is_admin = require_permissions(UserPermissionsEnum.admin)
 
 
 @admin_router.get('/users', response_model=list[UserFullSchema])
-def admin_list_users(offset: int = 0,
-                     limit: int = 100,
-                     username_filter: str = "",
-                     db: Session = Depends(get_db),
-                     token: dict[str, any] = Depends(verify_auth_token)):
-    if not check_is_admin(token, UserPermissionsEnum.admin):
-        raise HTTPException(status_code=403, detail="Not authorized")
+async def admin_list_users(response: Response,
+                           offset: int = 0,
+                           limit: int = 100,
+                           cursor: str | None = None,
+                           username_filter: str = "",
+                           db: AnySession = Depends(get_session),
+                           token: dict[str, any] = Depends(is_admin)):
+    """List users by id, or those whose name starts with ``username_filter``
+
+    The filter ignores case, its matches are ordered by name. Pass the
+    X-Next-Cursor header of a page as ``cursor``, along with the same
+    filter, to get the next one. ``limit`` is capped at
+    ``admin_users_max_limit``.
+    """
+    limit = min(limit, config.admin_users_max_limit)
     if username_filter:
-        user = crud.get_user_by_username(db, username_filter)
-        return list(user)
-    users = crud.list_users(db, offset, limit)
-    return users
+        after = decode_name_cursor(cursor) if cursor else None
+        users = await acrud.search_users(db, username_filter, limit + 1,
+                                         offset=0 if cursor else offset,
+                                         after=after)
+        return paginate_by_key(users, limit, response,
+                               attrgetter('name_lower', 'id'))
+    if cursor:
+        users = await acrud.list_users_after(db, decode_id_cursor(cursor),
+                                             limit + 1)
+    else:
+        users = await acrud.list_users(db, offset, limit + 1)
+    return paginate_by_id(users, limit, response)
 
 
 @admin_router.post('/users', response_model=UserFullSchema)
-def admin_insert_new_user(user: UserDTOSchemaAdmin,
-                          db: Session = Depends(get_db),
-                          token: dict[str, any] = Depends(verify_auth_token)):
-    if not check_is_admin(token, UserPermissionsEnum.admin):
-        raise HTTPException(status_code=403, detail="Not authorized")
-    user = register_user(db, **user.dict())
+async def admin_insert_new_user(
+    user: UserDTOSchemaAdmin,
+    db: AnySession = Depends(get_session),
+    token: dict[str, any] = Depends(is_admin)
+):
+    try:
+        user = await run_in_session(db, register_user, user.name,
+                                    user.raw_password,
+                                    permissions=user.permissions)
+    except sqlalchemy.exc.IntegrityError:
+        raise HTTPException(status_code=400, detail="Username already in use")
     return user
 
 
+def provision_result(result) -> UserBatchResultSchema:
+    """Map a provision_users result to its response entry"""
+    if isinstance(result, ConcurrentNameError):
+        return UserBatchResultSchema(status=409, error=str(result))
+    if isinstance(result, IntegrityError):
+        return UserBatchResultSchema(status=400,
+                                     error="Username already in use")
+    return UserBatchResultSchema(status=201, user=result)
+
+
+@admin_router.post('/users/bulk', response_model=list[UserBatchResultSchema])
+async def admin_provision_users(users: list[UserDTOSchemaAdmin],
+                                token: dict[str, any] = Depends(is_admin)):
+    """Create many users, with a result per user in request order
+
+    Passwords are hashed in parallel by the hashing pool. Users whose name
+    is taken, or came earlier in the request, get a 400 result, the others
+    are created ``provision_chunk_size`` per transaction. A chunk that
+    lost a name to a concurrent write isn't created, its users get a 409
+    result; the other chunks are.
+    """
+    if len(users) > config.provision_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request exceeds {config.provision_max_items} users")
+    results = await run_in_threadpool(
+        lambda: list(provision_users(enumerate(users))))
+    return [provision_result(result) for _, result in results]
+
+
 @admin_router.get('/users/{user_id}')
-def admin_get_user(user_id: int,
-                   db: Session = Depends(get_db),
-                   token: dict[str, any] = Depends(verify_auth_token)):
-    if not check_is_admin(token, UserPermissionsEnum.admin):
-        raise HTTPException(status_code=403, detail="Not authorized")
-    user = crud.get_user_by_id(db, user_id)
+async def admin_get_user(user_id: int,
+                         db: AnySession = Depends(get_session),
+                         token: dict[str, any] = Depends(is_admin)):
+    user = await acrud.get_user_by_id(db, user_id)
     return user
 
 
 @admin_router.put('/users/{user_id}', response_model=UserFullSchema)
-def admin_update_user(user_id: int,
-                      user_update: UserDTOSchemaAdmin,
-                      db: Session = Depends(get_db),
-                      token: dict[str, any] = Depends(verify_auth_token)):
-    if not check_is_admin(token, UserPermissionsEnum.admin):
-        raise HTTPException(status_code=403, detail="Not authorized")
+async def admin_update_user(user_id: int,
+                            user_update: UserDTOSchemaAdmin,
+                            db: AnySession = Depends(get_session),
+                            token: dict[str, any] = Depends(is_admin)):
+    # update_user leaves empty fields as they are
+    password = ''
     if user_update.raw_password:
-        user_update.password = bcrypt_password(user_update.raw_password)
-        delattr(user_update, 'raw_password')
-
-    update = UserInsertSchema(**user_update.dict())
-    updated = crud.update_user(db, user_id, update)
+        password = await run_in_threadpool(bcrypt_password,
+                                           user_update.raw_password)
+
+    update = UserInsertSchema(name=user_update.name, password=password,
+                              permissions=user_update.permissions)
+    try:
+        updated = await acrud.update_user(db, user_id, update)
+    except sqlalchemy.exc.IntegrityError:
+        raise HTTPException(status_code=400, detail="Username already in use")
+    if not updated:
+        raise HTTPException(404, 'Not Found')
     return updated
 
 
 @admin_router.delete('/users/{user_id}')
-def admin_delete_user(user_id: int,
-                      db: Session = Depends(get_db),
-                      token: dict[str, any] = Depends(verify_auth_token)):
-    if not check_is_admin(token, UserPermissionsEnum.admin):
-        raise HTTPException(status_code=403, detail="Not authorized")
-    removed = crud.delete_todo_by_id(db, user_id)
+async def admin_delete_user(user_id: int,
+                            db: AnySession = Depends(get_session),
+                            token: dict[str, any] = Depends(is_admin)):
+    removed = await acrud.delete_user(db, user_id)
     if removed <= 0:
         raise HTTPException(status_code=400, detail="No user deleted")
     return
+
+
+@admin_router.get('/todos/stats', response_model=TodoStatsSchema)
+async def admin_todo_stats(user_id: int | None = None,
+                           db: AnySession = Depends(get_session),
+                           token: dict[str, any] = Depends(is_admin)):
+    """Amount of todos of every user together, or of ``user_id``"""
+    if user_id is None:
+        return await acrud.get_all_todo_stats(db)
+    return await acrud.get_todo_stats(db, user_id)
+
+
+@admin_router.get('/todos/export', response_class=StreamingResponse)
+async def admin_export_todos(request: Request,
+                             user_id: int | None = None,
+                             token: dict[str, any] = Depends(is_admin)):
+    """Stream the todos of every user, or of ``user_id``, as NDJSON"""
+    filename = 'todos.ndjson' if user_id is None \
+        else f'todos-{user_id}.ndjson'
+    return todo_export_response(request, user_id, filename)
@@ -1,38 +1,330 @@
+import functools
+import hashlib
+import json
+import uuid
 from datetime import datetime, timedelta
-from pprint import pprint
 from sqlite3 import IntegrityError
-from typing import List
+from typing import Iterator, List
+import sqlalchemy.exc
+from sqlalchemy import bindparam, delete, func, insert, or_, select, text
+from sqlalchemy import update
 from sqlalchemy.orm import Session
-from app.internal.models import RefreshToken, Todo, User
+from sqlalchemy.sql.elements import TextClause
+from app.internal import cache
+from app.internal.cache import todo_scope, user_scope
+from app.internal.models import ALL_USERS, RefreshToken, Todo, TodoListVersion
+from app.internal.models import TodoStats, User
 from app.internal.schemas import TodoCreateSchema, TodoUpdateSchema, UserInsertSchema
-from app.internal.schemas import UserFullSchema
+from app.internal.schemas import UserFullSchema, TodoSchema
+from app.internal.schemas import TodoBatchUpdateSchema, TodoStatsSchema
+from app.internal.schemas import SortOrder, TODO_FIELDS, TodoSortField
+from app.internal.schemas import UserSchema, normalize_username
+from app.internal.schemas import permissions_to_mask
+
+
+# keeps IN (...) lists under the sqlite bound parameter limit
+IN_CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = IN_CHUNK_SIZE) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 
 # todos
+#
+# Todo reads go through the cache, so they return TodoSchema values rather
+# than session bound rows. Every write invalidates the owner's scope and the
+# scopes of the todos it changed, after commit.
+
+class StaleVersionError(Exception):
+    """The todo changed since the version the client has"""
+
+
+# RETURNING needs sqlite 3.35
+_BUMP_TODO_LIST_VERSION = text("""
+    INSERT INTO todo_list_versions (owner, version) VALUES (:owner, 1)
+    ON CONFLICT (owner) DO UPDATE SET version = version + 1
+    RETURNING version
+""")
+
+
+def _bump_todo_list_version(db: Session, user_id: int) -> int:
+    """Bump the user's todo list version in the current transaction
+
+    Returns:
+        int: the new version, to store on the written todos
+    """
+    return db.execute(_BUMP_TODO_LIST_VERSION, {'owner': user_id}).scalar()
+
+
+def get_todo_list_version(db: Session, user_id: int) -> int:
+    """Version of the user's todos, changes with every write to them
+
+    Reads todo_list_versions, not todos. Read it before the data it
+    validates: a write in between then only costs a full response later.
+    """
+    def query():
+        version = db.execute(select(TodoListVersion.version)
+                             .where(TodoListVersion.owner == user_id)).scalar()
+        return version or 0
+    return cache.cached(user_scope(user_id), 'version', query)
+
+
+_ADD_TO_TODO_STATS = text(f"""
+    INSERT INTO todo_stats (owner, total, done)
+    VALUES (:owner, :total, :done), ({ALL_USERS}, :total, :done)
+    ON CONFLICT (owner) DO UPDATE SET total = total + excluded.total,
+                                      done = done + excluded.done
+""")
+
+
+def _add_to_todo_stats(db: Session, user_id: int, total: int, done: int):
+    """Add to the todo counts of the user and of all users
+
+    Call it in the transaction of the write, after the write started it:
+    sqlite holds the write lock from then on, so counts read to compute
+    the difference can't change until commit.
+    """
+    if total or done:
+        db.execute(_ADD_TO_TODO_STATS,
+                   {'owner': user_id, 'total': total, 'done': done})
+
+
+def _todo_stats(db: Session, owner: int) -> TodoStatsSchema:
+    row = db.execute(select(TodoStats.total, TodoStats.done)
+                     .where(TodoStats.owner == owner)).first()
+    total, done = row or (0, 0)
+    return TodoStatsSchema(total=total, done=done, open=total - done)
+
+
+def get_todo_stats(db: Session, user_id: int) -> TodoStatsSchema:
+    """Amount of the user's todos, done and open, read from todo_stats"""
+    return cache.cached(user_scope(user_id), 'stats',
+                        lambda: _todo_stats(db, user_id))
+
+
+def get_all_todo_stats(db: Session) -> TodoStatsSchema:
+    """Amount of todos of all users, done and open, read from todo_stats"""
+    return _todo_stats(db, ALL_USERS)
+
 
 def get_todos(db: Session, offset: int, limit: int) -> List[Todo]:
     result = db.query(Todo).offset(offset).limit(limit).all()
     return result
 
 
-def get_todos_for_user(db: Session, offset: int, limit: int, user_id: int) -> List[Todo]:
-    result = db.query(Todo).filter(Todo.owner == user_id).offset(offset).limit(limit).all()
-    return result
+def get_todos_for_user(db: Session, offset: int, limit: int,
+                       user_id: int) -> List[TodoSchema]:
+    return list_todos_for_user(db, user_id, limit, offset=offset)
+
+
+def get_todos_for_user_after(db: Session, after_id: int, limit: int,
+                             user_id: int) -> List[TodoSchema]:
+    """Keyset page of the user's todos, seeks on the (owner, id) index"""
+    return list_todos_for_user(db, user_id, limit, after=after_id)
+
+
+def _prefix_upper_bound(prefix: str) -> str | None:
+    # smallest string greater than every string starting with prefix, in
+    # sqlite's BINARY collation (code point order)
+    for i in reversed(range(len(prefix))):
+        if ord(prefix[i]) < 0x10FFFF:
+            return prefix[:i] + chr(ord(prefix[i]) + 1)
+    return None
+
+
+# todo columns in the order of the TodoSchema fields
+_TODO_COLUMNS = tuple(Todo.__table__.c[field] for field in TODO_FIELDS)
+
+
+def list_todo_rows_for_user(db: Session, user_id: int, limit: int,
+                            offset: int = 0,
+                            after: int | str | None = None,
+                            done: bool | None = None,
+                            name_prefix: str | None = None,
+                            sort: TodoSortField = TodoSortField.id,
+                            order: SortOrder = SortOrder.asc) -> list[dict]:
+    """Page of the user's todos, filtered and sorted in the database
+
+    Every combination is served by one of the todos indexes: (owner, id)
+    and (owner, name) without ``done``, (owner, done, id) and
+    (owner, done, name) with it. The name prefix is a range on name, so it
+    uses the name indexes as well.
+
+    Args:
+        db (Session): sqlalchemy session
+        user_id (int): owner of the todos
+        limit (int): page size
+        offset (int): rows to skip
+        after (int | str | None): sort key (id or name) of the last todo of
+            the previous page
+        done (bool | None): only done or only open todos
+        name_prefix (str | None): only todos whose name starts with it
+        sort (TodoSortField): column to sort by, ties can't happen, names
+            are unique per user
+        order (SortOrder): ascending or descending
+
+    Returns:
+        list[dict]: the page, todos with the TODO_FIELDS keys in order
+    """
+    column = Todo.name if sort == TodoSortField.name else Todo.id
+    descending = order == SortOrder.desc
 
+    def query():
+        stmt = select(*_TODO_COLUMNS).where(Todo.owner == user_id)
+        if done is not None:
+            stmt = stmt.where(Todo.done == done)
+        if name_prefix:
+            stmt = stmt.where(Todo.name >= name_prefix)
+            upper = _prefix_upper_bound(name_prefix)
+            if upper is not None:
+                stmt = stmt.where(Todo.name < upper)
+        if after is not None:
+            stmt = stmt.where(column < after if descending else column > after)
+        stmt = stmt.order_by(column.desc() if descending else column)\
+            .offset(offset).limit(limit)
+        return [dict(row) for row in db.execute(stmt).mappings()]
+    key = hashlib.sha1(json.dumps(
+        [done, name_prefix, sort, order, offset, after, limit]).encode())
+    return cache.cached(user_scope(user_id), f'list:{key.hexdigest()}', query)
 
-def create_todo(db: Session, todo: TodoCreateSchema, user_id: int) -> Todo:
-    todo_orm = Todo(**todo.dict(), done=False, owner=user_id)
-    if todo_name_exists_for_user(db, todo.name, user_id):
+
+def list_todos_for_user(db: Session, user_id: int, limit: int,
+                        **filters) -> List[TodoSchema]:
+    """``list_todo_rows_for_user`` as TodoSchema, same arguments"""
+    return [TodoSchema.construct(**row) for row in list_todo_rows_for_user(
+        db, user_id, limit, **filters)]
+
+
+def todo_search_expression(query: str) -> str:
+    """FTS5 expression matching all words of ``query``
+
+    Words are quoted, so FTS5 operators in user input are plain text. A
+    trailing ``*`` makes a word a prefix.
+
+    Returns:
+        str: expression, empty if the query has no words
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + '*' * prefix)
+    return ' '.join(terms)
+
+
+_SEARCH_TODOS = text("""
+    SELECT todos.id, todos.name, todos.description, todos.owner, todos.done,
+           todos.version, page.rank
+    FROM (SELECT rowid, rank FROM todos_fts
+          WHERE todos_fts MATCH :match
+          ORDER BY rank, rowid
+          LIMIT :limit OFFSET :offset) AS page
+    JOIN todos ON todos.id = page.rowid
+    ORDER BY page.rank, page.rowid
+""").columns(*_TODO_COLUMNS, sqlalchemy.column('rank', sqlalchemy.Float))
+
+
+def search_todo_rows(db: Session, query: str, limit: int, user_id: int,
+                     offset: int = 0) -> list[tuple[float, dict]]:
+    """Rank the user's todos against the words of ``query``, best first
+
+    Uses the todos_fts index (bm25, name matches weigh more than
+    description matches). Every match of the user is ranked, so words in
+    most of the user's todos are the slow case; only the page is joined
+    with todos.
+
+    Ranks drift: bm25 weighs words by their frequency in the whole index,
+    so any user's writes change every rank. Pages are therefore offsets
+    into the (rank, id) order rather than keyset pages on a rank, which
+    would skip or repeat todos once the ranks move. Cached pages keep
+    their ranks until the owner writes or they expire.
+
+    Args:
+        db (Session): sqlalchemy session
+        query (str): words to look for, see ``todo_search_expression``
+        limit (int): page size
+        user_id (int): owner of the todos
+        offset (int): matches to skip
+
+    Returns:
+        list[tuple[float, dict]]: rank and todo with the TODO_FIELDS keys
+    """
+    expression = todo_search_expression(query)
+    if not expression:
+        return []
+
+    def search():
+        rows = db.execute(_SEARCH_TODOS, {
+            'match': f'owner:"{int(user_id)}" AND '
+                     f'{{name description}}: ({expression})',
+            'limit': limit, 'offset': offset,
+        })
+        return [(row.rank, dict(zip(TODO_FIELDS, row))) for row in rows]
+    key = hashlib.sha1(expression.encode()).hexdigest()
+    return cache.cached(user_scope(user_id),
+                        f'search:{key}:{offset}:{limit}', search)
+
+
+def search_todos(db: Session, query: str, limit: int, user_id: int,
+                 offset: int = 0) -> list[tuple[float, TodoSchema]]:
+    """``search_todo_rows`` with TodoSchema todos, same arguments"""
+    return [(rank, TodoSchema.construct(**row)) for rank, row in
+            search_todo_rows(db, query, limit, user_id, offset)]
+
+
+def iter_todos(db: Session, user_id: int | None,
+               batch_size: int) -> Iterator[list]:
+    """Todos in id order as row mappings, ``batch_size`` rows at a time
+
+    Rows are read from the cursor as the batches are consumed (yield_per),
+    memory use doesn't grow with the amount of todos. Bypasses the cache.
+
+    Args:
+        db (Session): sqlalchemy session, stays busy until the iterator is
+            exhausted or closed
+        user_id (int | None): owner of the todos, None for all todos
+        batch_size (int): rows per batch
+    """
+    stmt = select(Todo.__table__).order_by(Todo.id)
+    if user_id is not None:
+        stmt = stmt.where(Todo.owner == user_id)
+    result = db.execute(stmt.execution_options(stream_results=True))
+    yield from result.yield_per(batch_size).mappings().partitions()
+
+
+def create_todo(db: Session, todo: TodoCreateSchema, user_id: int) -> TodoSchema:
+    """Create todo, one INSERT next to the version bump and todo_stats
+
+    Name uniqueness in the user scope is enforced by the
+    uq_todos_owner_name index. The id comes from the INSERT itself
+    (inserted_primary_key), there is no SELECT.
+
+    Raises:
+        IntegrityError: todo name exists in the user scope
+    """
+    values = {**todo.dict(), 'done': False, 'owner': user_id}
+    try:
+        values['version'] = _bump_todo_list_version(db, user_id)
+        result = db.execute(insert(Todo).values(**values))
+        _add_to_todo_stats(db, user_id, 1, int(values['done']))
+        db.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
         raise IntegrityError("Todo name exists in the user scope")
-    db.add(todo_orm)
-    db.commit()
-    db.refresh(todo_orm)
-    return todo_orm
+    cache.invalidate(user_scope(user_id))
+    return TodoSchema(id=result.inserted_primary_key[0], **values)
 
 
-def get_todo_by_id(db: Session, id: int) -> Todo:
-    result = db.query(Todo).filter(Todo.id == id).first()
-    return result
+def get_todo_by_id(db: Session, id: int, user_id: int) -> TodoSchema | None:
+    """The user's todo with this id, None for other users' todos"""
+    def query():
+        row = db.query(Todo).filter(Todo.id == id, Todo.owner == user_id)\
+            .first()
+        return TodoSchema.from_orm(row) if row else None
+    return cache.cached(todo_scope(id), f'todo:{user_id}', query)
 
 
 def todo_name_exists_for_user(db: Session, name: str, user_id: int) -> bool:
@@ -48,21 +340,360 @@ def get_todo_by_name(db: Session, name: str, user_id: int) -> Todo:
     return result
 
 
-def update_todo_by_id(db: Session, id: int, update: TodoUpdateSchema) -> Todo:
-    todo = db.query(Todo).filter(Todo.id == id).first()
-    if not todo:
+# SQLAlchemy 1.4 compiles no RETURNING for sqlite, these are written out;
+# RETURNING needs sqlite 3.35
+_UPDATE_TODO = """
+    UPDATE todos SET {assignments}, version = :version
+    WHERE id = :id AND owner = :owner{version_check}
+    RETURNING {columns}
+"""
+_DELETE_TODO = """
+    DELETE FROM todos WHERE id = :id AND owner = :owner{version_check}
+    RETURNING done
+"""
+_VERSION_CHECK = ' AND version IN :versions'
+# the todo's change of done, read by the upsert itself: no SELECT before
+# the UPDATE
+_ADD_DONE_CHANGE_TO_TODO_STATS = text(f"""
+    INSERT INTO todo_stats (owner, total, done)
+    SELECT stats.owner, 0, :change
+    FROM todos, (SELECT :owner AS owner UNION ALL SELECT {ALL_USERS}) AS stats
+    WHERE todos.id = :id AND todos.owner = :owner
+      AND coalesce(todos.done, 0) != :done
+    ON CONFLICT (owner) DO UPDATE SET done = done + excluded.done
+""")
+
+
+@functools.lru_cache
+def _todo_write_statement(template: str, fields: tuple[str, ...] = (),
+                          check_version: bool = False) -> TextClause:
+    stmt = text(template.format(
+        assignments=', '.join(f'{field} = :{field}' for field in fields),
+        version_check=_VERSION_CHECK if check_version else '',
+        columns=', '.join(TODO_FIELDS)))
+    if check_version:
+        stmt = stmt.bindparams(bindparam('versions', expanding=True))
+    return stmt
+
+
+def update_todo_by_id(db: Session, id: int, update: TodoUpdateSchema,
+                      user_id: int,
+                      versions: list[int] | None = None) -> TodoSchema | None:
+    """Update todo with a single UPDATE ... RETURNING
+
+    The owner's todo list version is bumped first, the todo takes it over
+    as its version. A change of ``done`` is added to todo_stats by an
+    upsert that reads the todo's current ``done`` itself. Up to three
+    statements, one transaction; reading the todo back needs none.
+
+    Args:
+        db (Session): sqlalchemy session
+        id (int): todo id
+        update (TodoUpdateSchema): fields to change
+        user_id (int): owner of the todo, other users' todos aren't found
+        versions (list[int] | None): only update the todo while its version
+            is one of these (If-Match)
+
+    Raises:
+        IntegrityError: new name exists in the user scope
+        StaleVersionError: the todo's version isn't one of ``versions``
+
+    Returns:
+        TodoSchema | None: updated todo, None if the user has no such todo
+    """
+    values = update.dict(exclude_none=True)
+    if not values:
+        todo = get_todo_by_id(db, id, user_id)
+        if todo and versions is not None and todo.version not in versions:
+            raise StaleVersionError(id)
         return todo
-    for var, value in vars(update).items():
-        setattr(todo, var, value) if value else None
+
+    stmt = _todo_write_statement(_UPDATE_TODO, tuple(values),
+                                 versions is not None)\
+        .columns(*_TODO_COLUMNS)
+    params = {**values, 'id': id, 'owner': user_id}
+    if versions is not None:
+        params['versions'] = versions
+    try:
+        params['version'] = _bump_todo_list_version(db, user_id)
+        if 'done' in values:
+            db.execute(_ADD_DONE_CHANGE_TO_TODO_STATS, {
+                'id': id, 'owner': user_id, 'done': values['done'],
+                'change': 1 if values['done'] else -1})
+        row = db.execute(stmt, params).mappings().first()
+        if not row:
+            db.rollback()
+            if versions is not None and get_todo_by_id(db, id, user_id):
+                raise StaleVersionError(id)
+            return None
+        db.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
+        raise IntegrityError("Todo name exists in the user scope")
+    cache.invalidate(user_scope(user_id), todo_scope(id))
+    return TodoSchema(**row)
+
+
+def delete_todo_by_id(db: Session, id: int, user_id: int,
+                      versions: list[int] | None = None) -> int:
+    """Delete todo with a single DELETE ... RETURNING
+
+    Bumps the owner's todo list version before and updates todo_stats
+    after it, in the same transaction.
+
+    Args:
+        db (Session): sqlalchemy session
+        id (int): todo id
+        user_id (int): owner of the todo, other users' todos aren't found
+        versions (list[int] | None): only delete the todo while its version
+            is one of these (If-Match)
+
+    Raises:
+        StaleVersionError: the todo's version isn't one of ``versions``
+
+    Returns:
+        int: 1 if the todo was deleted, 0 if the user has no such todo
+    """
+    stmt = _todo_write_statement(_DELETE_TODO,
+                                 check_version=versions is not None)
+    params = {'id': id, 'owner': user_id}
+    if versions is not None:
+        params['versions'] = versions
+    _bump_todo_list_version(db, user_id)
+    deleted = db.execute(stmt, params).first()
+    if not deleted:
+        db.rollback()
+        if versions is not None and get_todo_by_id(db, id, user_id):
+            raise StaleVersionError(id)
+        return 0
+    _add_to_todo_stats(db, user_id, -1, -bool(deleted.done))
     db.commit()
-    db.refresh(todo)
-    return todo
+    cache.invalidate(user_scope(user_id), todo_scope(id))
+    return 1
+
+
+# todo batches
+#
+# Batch functions run in a single transaction and return one result per
+# input item, in order: the resulting todo, or the exception the single
+# item function would have raised (IntegrityError for a name taken in the
+# user scope, LookupError for a todo the user doesn't have).
+
+
+def _todo_ids_by_name(db: Session, names: list[str],
+                      user_id: int) -> dict[str, int]:
+    ids = {}
+    for chunk in _chunks(names):
+        # no ORDER BY: sqlite would walk all of the user's todos on
+        # (owner, id) instead of seeking (owner, name)
+        rows = db.execute(
+            select(Todo.name, Todo.id)
+            .where(Todo.owner == user_id, Todo.name.in_(chunk))
+        )
+        ids.update((name, id) for name, id in rows)
+    return ids
+
+
+_TODO_INSERT_COLUMNS = ('name', 'description', 'done', 'owner', 'version')
+
+
+def _insert_todo_rows(db: Session, rows: list[dict]):
+    # multi-row VALUES written out directly, compiling a 500 row insert()
+    # costs more than executing it
+    for chunk in _chunks(rows):
+        values = ', '.join(['(?, ?, ?, ?, ?)'] * len(chunk))
+        db.connection().exec_driver_sql(
+            f"INSERT INTO todos ({', '.join(_TODO_INSERT_COLUMNS)}) "
+            f"VALUES {values}",
+            tuple(row[c] for row in chunk for c in _TODO_INSERT_COLUMNS))
+
+
+def create_todos(db: Session, todos: list[TodoCreateSchema], user_id: int,
+                 retry: bool = True) -> list[TodoSchema | IntegrityError]:
+    """Create todos with multi-row INSERTs
+
+    One statement per chunk rather than an executemany: the full-text index
+    triggers flush the index once per statement, not once per row.
+
+    Args:
+        db (Session): sqlalchemy session
+        todos (list[TodoCreateSchema]): todos to create
+        user_id (int): owner of the todos
+        retry (bool): check the names again once, if a concurrent write
+            took one of them after the check
+
+    Raises:
+        IntegrityError: names were taken concurrently on retry as well
 
+    Returns:
+        list[TodoSchema | IntegrityError]: created todo or name conflict per
+            item
+    """
+    taken = set(_todo_ids_by_name(db, list({t.name for t in todos}), user_id))
+    results = []
+    rows = []
+    for todo in todos:
+        if todo.name in taken:
+            results.append(IntegrityError("Todo name exists in the user scope"))
+            continue
+        taken.add(todo.name)
+        row = {**todo.dict(), 'done': False, 'owner': user_id}
+        rows.append(row)
+        results.append(row)
 
-def delete_todo_by_id(db: Session, id: int) -> int:
-    deleted = db.query(Todo).filter(Todo.id == id).delete()
+    try:
+        if rows:
+            version = _bump_todo_list_version(db, user_id)
+            for row in rows:
+                row['version'] = version
+            _insert_todo_rows(db, rows)
+            _add_to_todo_stats(db, user_id, len(rows),
+                               sum(row['done'] for row in rows))
+            ids = _todo_ids_by_name(db, [row['name'] for row in rows], user_id)
+        db.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
+        if retry:
+            return create_todos(db, todos, user_id, retry=False)
+        raise IntegrityError("Todo name exists in the user scope")
+    if rows:
+        cache.invalidate(user_scope(user_id))
+    return [r if isinstance(r, IntegrityError)
+            else TodoSchema(id=ids[r['name']], **r) for r in results]
+
+
+def update_todos(db: Session, updates: list[TodoBatchUpdateSchema],
+                 user_id: int) -> list[TodoSchema | Exception]:
+    """Update todos with a single executemany UPDATE
+
+    Items are applied in order, renames are checked against the user's
+    other todos and against earlier items of the batch.
+
+    Raises:
+        IntegrityError: a name was taken by a concurrent write
+
+    Args:
+        db (Session): sqlalchemy session
+        updates (list[TodoBatchUpdateSchema]): updates with todo ids
+        user_id (int): owner of the todos
+
+    Returns:
+        list[TodoSchema | Exception]: updated todo, LookupError or
+            IntegrityError per item
+    """
+    current = {}
+    for chunk in _chunks(list({u.id for u in updates})):
+        rows = db.execute(
+            select(Todo.__table__)
+            .where(Todo.owner == user_id, Todo.id.in_(chunk))
+        )
+        current.update((row['id'], dict(row)) for row in rows.mappings())
+
+    new_names = list({u.name for u in updates if u.name is not None})
+    taken = _todo_ids_by_name(db, new_names, user_id)
+    taken.update((todo['name'], id) for id, todo in current.items())
+
+    results = []
+    for item in updates:
+        todo = current.get(item.id)
+        if todo is None:
+            results.append(LookupError("Todo not found"))
+            continue
+        values = item.dict(exclude={'id'}, exclude_none=True)
+        name = values.get('name', todo['name'])
+        if taken.get(name, item.id) != item.id:
+            results.append(IntegrityError("Todo name exists in the user scope"))
+            continue
+        if taken.get(todo['name']) == item.id:
+            del taken[todo['name']]
+        taken[name] = item.id
+        todo.update(values)
+        results.append(dict(todo))
+
+    # one parameter set per applied item, in item order, so renames within
+    # the batch never collide on uq_todos_owner_name halfway through
+    applied = [r for r in results if isinstance(r, dict)]
+    try:
+        if applied:
+            version = _bump_todo_list_version(db, user_id)
+            # final done per todo against done as of the write lock, the
+            # reads above ran before it
+            done = {todo['id']: bool(todo['done']) for todo in applied}
+            was_done = {}
+            for chunk in _chunks(list(done)):
+                was_done.update(db.execute(
+                    select(Todo.id, Todo.done).where(Todo.id.in_(chunk))).all())
+            params = []
+            for todo in applied:
+                todo['version'] = version
+                params.append({'_id': todo['id'], '_name': todo['name'],
+                               '_description': todo['description'],
+                               '_done': todo['done'], '_version': version})
+            db.execute(
+                update(Todo.__table__)
+                .where(Todo.id == bindparam('_id'))
+                .values(name=bindparam('_name'),
+                        description=bindparam('_description'),
+                        done=bindparam('_done'),
+                        version=bindparam('_version')),
+                params
+            )
+            _add_to_todo_stats(db, user_id, 0, sum(
+                done[id] - bool(was_done[id]) for id in was_done))
+        db.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
+        raise IntegrityError("Todo name exists in the user scope")
+    if applied:
+        cache.invalidate(user_scope(user_id),
+                         *(todo_scope(todo['id']) for todo in applied))
+    return [TodoSchema(**r) if isinstance(r, dict) else r for r in results]
+
+
+def delete_todos(db: Session, ids: list[int],
+                 user_id: int) -> list[int | LookupError]:
+    """Delete todos with a single DELETE
+
+    Args:
+        db (Session): sqlalchemy session
+        ids (list[int]): todo ids
+        user_id (int): owner of the todos
+
+    Returns:
+        list[int | LookupError]: deleted id or LookupError per item
+    """
+    existing = set()
+    for chunk in _chunks(list(set(ids))):
+        rows = db.execute(
+            select(Todo.id).where(Todo.owner == user_id, Todo.id.in_(chunk))
+        )
+        existing.update(rows.scalars())
+
+    results = []
+    for id in ids:
+        if id in existing:
+            existing.discard(id)
+            results.append(id)
+        else:
+            results.append(LookupError("Todo not found"))
+
+    deleted = [r for r in results if isinstance(r, int)]
+    if deleted:
+        _bump_todo_list_version(db, user_id)
+    total = done = 0
+    for chunk in _chunks(deleted):
+        where = (Todo.owner == user_id, Todo.id.in_(chunk))
+        done += db.execute(select(func.count()).where(
+            *where, Todo.done.is_(True))).scalar()
+        total += db.execute(
+            delete(Todo).where(*where)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    _add_to_todo_stats(db, user_id, -total, -done)
     db.commit()
-    return deleted
+    if deleted:
+        cache.invalidate(user_scope(user_id), *map(todo_scope, deleted))
+    return results
 
 
 # users
@@ -79,10 +710,50 @@ def get_user_by_id(db: Session, id: int) -> User:
 
 
 def list_users(db: Session, offset: int, limit: int) -> list[UserFullSchema]:
-    users = db.query(User).offset(offset).limit(limit).all()
+    users = db.query(User).order_by(User.id).offset(offset).limit(limit).all()
     return users
 
 
+def list_users_after(db: Session, after_id: int, limit: int) -> list[User]:
+    users = db.query(User).filter(User.id > after_id).order_by(User.id)\
+        .limit(limit).all()
+    return users
+
+
+def search_users(db: Session, name_prefix: str, limit: int, offset: int = 0,
+                 after: tuple[str, int] | None = None) -> list[User]:
+    """Users whose name starts with ``name_prefix``, ignoring case
+
+    Ordered by (name_lower, id), a range scan of ix_users_name_lower_id
+    that stops after the page however many users match.
+
+    Args:
+        db (Session): sqlalchemy session
+        name_prefix (str): start of the names, any case
+        limit (int): page size
+        offset (int): rows to skip
+        after (tuple[str, int] | None): name_lower and id of the last user
+            of the previous page
+
+    Returns:
+        list[User]: the page
+    """
+    prefix = normalize_username(name_prefix)
+    lower = prefix
+    query = db.query(User)
+    if after is not None:
+        # the range starts at the cursor, sqlite seeks on name_lower only
+        lower = max(prefix, after[0])
+        query = query.filter(or_(User.name_lower > after[0],
+                                 User.id > after[1]))
+    query = query.filter(User.name_lower >= lower)
+    upper = _prefix_upper_bound(prefix)
+    if upper is not None:
+        query = query.filter(User.name_lower < upper)
+    return query.order_by(User.name_lower, User.id).offset(offset)\
+        .limit(limit).all()
+
+
 def insert_user(db: Session, user: UserInsertSchema) -> User:
     user_orm = User(**user.dict())
     user_orm.permissions = [int(i) for i in user.permissions]
@@ -92,6 +763,62 @@ def insert_user(db: Session, user: UserInsertSchema) -> User:
     return user_orm
 
 
+def taken_user_names(db: Session, names: list[str]) -> dict[str, int]:
+    """Ids of the users with one of the names"""
+    ids = {}
+    for chunk in _chunks(names):
+        ids.update(db.execute(
+            select(User.name, User.id).where(User.name.in_(chunk))).all())
+    return ids
+
+
+def create_users(db: Session, users: list[UserInsertSchema],
+                 retry: bool = True) -> list[UserSchema | IntegrityError]:
+    """Create users with one executemany INSERT, in one transaction
+
+    Args:
+        db (Session): sqlalchemy session
+        users (list[UserInsertSchema]): users with hashed passwords
+        retry (bool): check the names again once, if a concurrent write
+            took one of them after the check
+
+    Raises:
+        IntegrityError: names were taken concurrently on retry as well
+
+    Returns:
+        list[UserSchema | IntegrityError]: created user or name conflict
+            per item
+    """
+    taken = set(taken_user_names(db, list({u.name for u in users})))
+    results = []
+    rows = []
+    for user in users:
+        if user.name in taken:
+            results.append(IntegrityError("Username already in use"))
+            continue
+        taken.add(user.name)
+        permissions = [int(p) for p in user.permissions]
+        row = {'name': user.name, 'name_lower': normalize_username(user.name),
+               'password': user.password,
+               'permissions': ','.join(map(str, permissions)),
+               'permission_mask': permissions_to_mask(permissions)}
+        rows.append(row)
+        results.append(row)
+
+    try:
+        if rows:
+            db.execute(insert(User.__table__), rows)
+            ids = taken_user_names(db, [row['name'] for row in rows])
+        db.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
+        if retry:
+            return create_users(db, users, retry=False)
+        raise IntegrityError("Username already in use")
+    return [r if isinstance(r, IntegrityError)
+            else UserSchema(id=ids[r['name']], name=r['name']) for r in results]
+
+
 def update_user(db: Session, user_id: int, update: UserInsertSchema) -> User:
     user = get_user_by_id(db, user_id)
     if not user:
@@ -121,13 +848,19 @@ def refresh_token_used(db: Session, token: str) -> bool:
     return False
 
 
-def save_refresh_token(db: Session, token: str, user_id: int) -> RefreshToken:
+def new_token_family_id() -> str:
+    return uuid.uuid4().hex
+
+
+def save_refresh_token(db: Session, token: str, user_id: int,
+                       family_id: str | None) -> RefreshToken:
     refresh_token = RefreshToken(
         token=token,
         user_id=user_id,
         active=True,
         token_child=None,
-        not_after=datetime.now() + timedelta(days=1)
+        not_after=datetime.now() + timedelta(days=1),
+        family_id=family_id,
     )
     db.add(refresh_token)
     db.commit()
@@ -158,15 +891,150 @@ def disable_token(db: Session, token: str) -> RefreshToken:
         return token_orm
     token_orm.active = False
     db.commit()
-    db.refresh(token)
+    db.refresh(token_orm)
     return token_orm
 
 
-def deactivate_token_family(db: Session, root_token: RefreshToken) -> int:
-    invalidated_count = 0
-    while root_token.token_child:
-        pprint(root_token)
-        root_token = disable_token(db, root_token.token_child)
-        invalidated_count += 1
+def _token_chain(db: Session, token: str) -> list[str]:
+    """The token and its descendants over token_child, in one recursive query"""
+    chain = select(RefreshToken.token).where(RefreshToken.token == token)\
+        .cte('chain', recursive=True)
+    parent = RefreshToken.__table__.alias('parent')
+    chain = chain.union_all(
+        select(parent.c.token_child)
+        .join(chain, parent.c.token == chain.c.token)
+        .where(parent.c.token_child.isnot(None))
+    )
+    return db.execute(select(chain.c.token)).scalars().all()
+
+
+def deactivate_token_family(db: Session, token: RefreshToken) -> int:
+    """Deactivate the token's family with a single UPDATE
+
+    Tokens saved before families existed (family_id is NULL, see
+    ``assign_token_families``) deactivate the token and its descendants.
+
+    Returns:
+        int: amount of tokens deactivated
+    """
+    deactivate = update(RefreshToken).where(RefreshToken.active.is_(True))\
+        .values(active=False)\
+        .execution_options(synchronize_session=False)
+    if token.family_id is not None:
+        deactivated = db.execute(
+            deactivate.where(RefreshToken.family_id == token.family_id)
+        ).rowcount
+    else:
+        deactivated = 0
+        for chunk in _chunks(_token_chain(db, token.token)):
+            deactivated += db.execute(
+                deactivate.where(RefreshToken.token.in_(chunk))).rowcount
+    db.commit()
+    return deactivated
+
+
+def assign_token_families(db: Session, batch_size: int = 500) -> int:
+    """Give tokens saved before families existed the family of their chain
+
+    Every chain root without a family gets a new family id for its whole
+    chain, committed per batch of roots. Tokens rotated from a legacy token
+    while the migration ran inherit the family of their parent afterwards.
 
-    return invalidated_count
+    Raises:
+        RuntimeError: a batch of roots assigned no tokens
+
+    Returns:
+        int: amount of tokens assigned a family
+    """
+    assigned = 0
+    children = select(RefreshToken.token_child)\
+        .where(RefreshToken.token_child.isnot(None))
+    while True:
+        roots = db.execute(
+            select(RefreshToken.token)
+            .where(RefreshToken.family_id.is_(None))
+            .except_(children)
+            .limit(batch_size)
+        ).scalars().all()
+        if not roots:
+            break
+        batch_assigned = 0
+        for root in roots:
+            family_id = new_token_family_id()
+            for chunk in _chunks(_token_chain(db, root)):
+                batch_assigned += db.execute(
+                    update(RefreshToken)
+                    .where(RefreshToken.token.in_(chunk))
+                    .values(family_id=family_id)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+        db.commit()
+        if not batch_assigned:
+            raise RuntimeError("Refresh token chain roots were not assigned")
+        assigned += batch_assigned
+
+    parent = RefreshToken.__table__.alias('parent')
+    parent_family = select(parent.c.family_id)\
+        .where(parent.c.token_child == RefreshToken.token)\
+        .scalar_subquery()
+    while True:
+        result = db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.family_id.is_(None), parent_family.isnot(None))
+            .values(family_id=parent_family)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if not result.rowcount:
+            break
+        assigned += result.rowcount
+    return assigned
+
+
+def delete_expired_refresh_tokens(db: Session, now: datetime, batch_size: int,
+                                  after: str = '') -> tuple[int, str | None]:
+    """Delete one batch of tokens whose whole family is past not_after
+
+    Scans expired tokens in primary key order, starting after ``after``, so
+    a run over the table visits every token once. Tokens without a family
+    (see ``assign_token_families``) are kept.
+
+    Args:
+        db (Session): sqlalchemy session
+        now (datetime): tokens with not_after before it are expired
+        batch_size (int): amount of expired tokens looked at
+        after (str): last token of the previous batch
+
+    Returns:
+        tuple[int, str | None]: amount of deleted tokens and the last token
+            of the batch, None once the scan is done
+    """
+    rows = db.execute(
+        select(RefreshToken.token, RefreshToken.family_id)
+        .where(RefreshToken.token > after,
+               RefreshToken.not_after < now,
+               RefreshToken.family_id.isnot(None))
+        .order_by(RefreshToken.token)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        db.rollback()
+        return 0, None
+
+    live = set()
+    for chunk in _chunks(list({family_id for _, family_id in rows})):
+        live.update(db.execute(
+            select(RefreshToken.family_id).distinct()
+            .where(RefreshToken.family_id.in_(chunk),
+                   RefreshToken.not_after >= now)
+        ).scalars())
+    deleted = 0
+    for chunk in _chunks([token for token, family_id in rows
+                          if family_id not in live]):
+        deleted += db.execute(
+            delete(RefreshToken)
+            .where(RefreshToken.token.in_(chunk))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    db.commit()
+    return deleted, rows[-1][0]
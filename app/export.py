@@ -0,0 +1,64 @@
+"""Streaming NDJSON export of todos
+
+The rows come from ``crud.iter_todos``, one response chunk per batch, so
+an export never holds more than ``export_batch_size`` todos in memory. It
+always reads through the sync engine, StreamingResponse pulls the chunks
+in the threadpool.
+"""
+import json
+import zlib
+from typing import Iterator
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from app import crud
+from app.internal import config
+from app.internal.db import SessionLocal
+from app.internal.schemas import TODO_FIELDS
+
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def ndjson_lines(rows) -> bytes:
+    """One JSON object per todo row, newline terminated"""
+    return ''.join(
+        json.dumps({field: row[field] for field in TODO_FIELDS},
+                   separators=(',', ':')) + '\n'
+        for row in rows).encode()
+
+
+def todo_export_chunks(user_id: int | None, gzip: bool = False,
+                       batch_size: int | None = None) -> Iterator[bytes]:
+    """NDJSON of the user's todos (all todos if None), chunk by chunk"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if gzip else None
+    with SessionLocal() as db:
+        for rows in crud.iter_todos(db, user_id,
+                                    batch_size or config.export_batch_size):
+            chunk = ndjson_lines(rows)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def accepts_gzip(request: Request) -> bool:
+    for coding in request.headers.get('accept-encoding', '').split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00',
+                                                   'q=0.000')
+    return False
+
+
+def todo_export_response(request: Request, user_id: int | None,
+                         filename: str) -> StreamingResponse:
+    """Stream the export, gzip encoded if the client accepts it"""
+    gzip = accepts_gzip(request)
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"',
+               'Vary': 'Accept-Encoding'}
+    if gzip:
+        headers['Content-Encoding'] = 'gzip'
+    return StreamingResponse(todo_export_chunks(user_id, gzip),
+                             media_type=NDJSON_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,199 @@
+"""Streaming import of todos from NDJSON or CSV
+
+The request body is read incrementally in the threadpool through
+``RequestBodyReader``, rows are validated with ``TodoCreateSchema`` and
+created ``import_chunk_size`` at a time with ``crud.create_todos``, one
+transaction per chunk. Only the current chunk and the first
+``import_max_error_details`` errors are held in memory. Like the export,
+the import always writes through the sync engine.
+"""
+import csv
+import io
+import json
+import zlib
+from sqlite3 import IntegrityError
+from typing import Iterator
+import anyio.from_thread
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from app import crud
+from app.internal import config
+from app.internal.db import SessionLocal
+from app.internal.schemas import TodoCreateSchema, TodoImportErrorSchema
+from app.internal.schemas import TodoImportResultSchema
+
+
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/jsonl',
+                      'application/json')
+CSV_MEDIA_TYPE = 'text/csv'
+
+# decompressed bytes produced per gzip input step, bounds what a small
+# compressed body can expand to in memory at once
+_INFLATE_STEP = 1 << 16
+
+
+class RequestBodyReader(io.RawIOBase):
+    """Blocking file over a request body, only usable in the threadpool
+
+    Chunks are pulled from ``request.stream()`` on the event loop as they
+    are read, gzip bodies are inflated on the way.
+    """
+
+    def __init__(self, request: Request, gzip: bool = False):
+        self._chunks = request.stream()
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+            if gzip else None
+        self._pending = b''
+        self._buffer = b''
+        self._done = False
+
+    def readable(self) -> bool:
+        return True
+
+    async def _next_chunk(self) -> bytes:
+        return await self._chunks.__anext__()
+
+    def _fill(self):
+        while not self._buffer and not self._done:
+            if self._decompressor is not None and self._pending:
+                self._buffer = self._decompressor.decompress(self._pending,
+                                                             _INFLATE_STEP)
+                self._pending = self._decompressor.unconsumed_tail
+                continue
+            try:
+                chunk = anyio.from_thread.run(self._next_chunk)
+            except StopAsyncIteration:
+                self._done = True
+                if self._decompressor is not None:
+                    self._buffer = self._decompressor.flush()
+                break
+            if self._decompressor is not None:
+                self._pending = chunk
+            else:
+                self._buffer = chunk
+
+    def readinto(self, buffer) -> int:
+        self._fill()
+        n = min(len(buffer), len(self._buffer))
+        buffer[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def body_format(request: Request) -> str:
+    """"csv" or "ndjson" from the Content-Type, raises 415 otherwise"""
+    media_type = request.headers.get('content-type', NDJSON_MEDIA_TYPES[0])\
+        .split(';')[0].strip().lower()
+    if media_type == CSV_MEDIA_TYPE:
+        return 'csv'
+    if media_type in NDJSON_MEDIA_TYPES:
+        return 'ndjson'
+    raise HTTPException(status_code=415, detail="Unsupported Media Type")
+
+
+def ndjson_rows(text) -> Iterator[tuple[int, object]]:
+    """(line number, decoded object or the decoding error), blank lines
+    are skipped"""
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+
+def csv_rows(text) -> Iterator[tuple[int, object]]:
+    """(line number, row dict) of a CSV file with a header row"""
+    reader = csv.DictReader(text)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return '; '.join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}"
+                         for e in error.errors())
+    if isinstance(error, ValueError):
+        return f"invalid JSON: {error}"
+    return str(error)
+
+
+class _Import:
+    def __init__(self, user_id: int, chunk_size: int):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.result = TodoImportResultSchema()
+        self.chunk: list[TodoCreateSchema] = []
+
+    def error(self, line: int, message: str, count: int = 1):
+        self.result.errors += count
+        if len(self.result.error_details) < config.import_max_error_details:
+            self.result.error_details.append(
+                TodoImportErrorSchema(line=line, error=message))
+
+    def add(self, db, line: int, row):
+        if isinstance(row, Exception):
+            return self.error(line, _describe(row))
+        try:
+            self.chunk.append(TodoCreateSchema.parse_obj(row))
+        except ValidationError as e:
+            return self.error(line, _describe(e))
+        if len(self.chunk) >= self.chunk_size:
+            self.flush(db, line)
+
+    def flush(self, db, line: int):
+        if not self.chunk:
+            return
+        try:
+            results = crud.create_todos(db, self.chunk, self.user_id)
+        except IntegrityError:
+            self.error(line, "names of the chunk were taken concurrently",
+                       len(self.chunk))
+        else:
+            duplicates = sum(isinstance(r, IntegrityError) for r in results)
+            self.result.duplicates += duplicates
+            self.result.inserted += len(results) - duplicates
+        self.chunk = []
+
+
+def import_todos(body: io.RawIOBase, body_format: str, user_id: int,
+                 chunk_size: int | None = None) -> TodoImportResultSchema:
+    """Create the todos of an NDJSON or CSV body for the user
+
+    Names the user already has, or that came earlier in the body, are
+    skipped as duplicates. Invalid rows are counted as errors, the rest of
+    the body is still imported. An undecodable body stops the import, the
+    chunks committed so far stay.
+
+    Args:
+        body (io.RawIOBase): binary file with the body
+        body_format (str): "ndjson" or "csv"
+        user_id (int): owner of the todos
+        chunk_size (int | None): todos per transaction, default
+            import_chunk_size
+
+    Returns:
+        TodoImportResultSchema: summary of the import
+    """
+    job = _Import(user_id, chunk_size or config.import_chunk_size)
+    text = io.TextIOWrapper(io.BufferedReader(body), encoding='utf-8',
+                            newline='' if body_format == 'csv' else None)
+    rows = csv_rows(text) if body_format == 'csv' else ndjson_rows(text)
+    line = 0
+    with SessionLocal() as db:
+        try:
+            for line, row in rows:
+                job.add(db, line, row)
+        except (UnicodeDecodeError, csv.Error, zlib.error) as e:
+            job.error(line + 1, f"unreadable body, import stopped: {e}")
+        job.flush(db, line)
+    return job.result
+
+
+def import_todos_from_request(request: Request,
+                              user_id: int) -> TodoImportResultSchema:
+    """``import_todos`` of the request body, call it in the threadpool"""
+    gzip = request.headers.get('content-encoding', '').lower() == 'gzip'
+    return import_todos(RequestBodyReader(request, gzip),
+                        body_format(request), user_id)
@@ -1,4 +1,5 @@
-from .config import Config
+from .config import Settings
 
 
-config = Config("config.yaml").config
+# settings of the process, read on first use, see Config
+config = Settings()
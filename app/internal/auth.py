@@ -1,19 +1,27 @@
+import copy
 import datetime
 import secrets
-import bcrypt
+import threading
+import time
+from collections import OrderedDict
+import logging
 import jwt
-from fastapi import HTTPException, Request
+from fastapi import Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from .schemas import TokenPair, UserInsertSchema, UserPermissionsEnum
-from .schemas import TokenRefreshRequest
+from .schemas import TokenRefreshRequest, permissions_to_mask
 from .models import User
+from .hashing import check_password, hash_password
 from ..crud import get_user_by_username, insert_user, refresh_token_used
 from ..crud import save_refresh_token, get_refresh_token
-from ..crud import deactivate_token_family
+from ..crud import deactivate_token_family, new_token_family_id
 from ..crud import get_user_by_id, add_child_refresh_token
 from . import config
 
 
+logger = logging.getLogger(__name__)
+
+
 def authenticate_user_password(db: Session,
                                username: str,
                                password: str) -> TokenPair:
@@ -28,14 +36,15 @@ def authenticate_user_password(db: Session,
     """
     user = get_user_by_username(db, username)
     if user:
-        if bcrypt.checkpw(password.encode(), user.password.encode()):
+        if check_password(password, user.password):
             # Password match && user found
             refresh_token = generate_refresh_token()
 
             while refresh_token_used(db, refresh_token):
                 refresh_token = generate_refresh_token()
 
-            save_refresh_token(db, refresh_token, user.id)
+            save_refresh_token(db, refresh_token, user.id,
+                               new_token_family_id())
 
             token_pair = TokenPair(
                 auth_token=generate_auth_token(user),
@@ -62,11 +71,9 @@ def register_user(db: Session,
     Returns:
         User: created user
     """
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(raw_password.encode(), salt)
     insert_user_data = UserInsertSchema(
         name=username,
-        password=hashed_password.decode(),
+        password=hash_password(raw_password),
         permissions=permissions
     )
     user = insert_user(db, insert_user_data)
@@ -75,14 +82,13 @@ def register_user(db: Session,
 
 def generate_auth_token(user: User) -> str:
     now = datetime.datetime.now()
-    print(f"jwt encode key{ config.jwt_encode_key }")
     token = jwt.encode(
         payload={
             "sub": user.id,
             "name": user.name,
             "iat": now,
             "exp": now + datetime.timedelta(minutes=3),
-            "permissions": [int(p) for p in user.permissions],
+            "perm": permissions_to_mask(user.permissions),
         }, algorithm=config.jwt_algorithm, key=config.jwt_encode_key
     )
 
@@ -99,8 +105,8 @@ def generate_new_token_pair(db: Session, token_refresh_request: TokenRefreshRequ
 
     Generate new auth/refresh tokens pair, and invalidates token specified in
     the request, adds new generated token as it's child. If token was already
-    invalidated, invalidate the whole token family. Checks if the token is
-    expired
+    invalidated, invalidate the whole token family. The new token inherits
+    the family of the request token. Checks if the token is expired
 
 
     Args:
@@ -122,6 +128,10 @@ def generate_new_token_pair(db: Session, token_refresh_request: TokenRefreshRequ
                             detail="Refresh token can not be accepted")
     if not token.active:
         n = deactivate_token_family(db, token)
+        logger.warning("Refresh token reused, family deactivated",
+                       extra={'user_id': token.user_id,
+                              'family_id': token.family_id,
+                              'deactivated': n})
         raise HTTPException(status_code=403,
                             detail=f"Refresh token invalid. {n}")
     if token.not_after < datetime.datetime.now():
@@ -135,11 +145,79 @@ def generate_new_token_pair(db: Session, token_refresh_request: TokenRefreshRequ
     auth_token = generate_auth_token(user)
     refresh_token = generate_refresh_token()
 
-    refresh_token_orm = save_refresh_token(db, refresh_token, user.id)
+    refresh_token_orm = save_refresh_token(db, refresh_token, user.id,
+                                           token.family_id)
     add_child_refresh_token(db, token, refresh_token_orm)
     return TokenPair(auth_token=auth_token, refresh_token=refresh_token)
 
 
+class VerifiedTokenCache:
+    """Bounded LRU cache of decoded access token claims
+
+    Keyed by the raw token string. An entry is dropped once the token's
+    ``exp`` has passed, so an expired token always goes back through
+    ``jwt.decode`` and fails there the same way as without the cache.
+    Tokens without ``exp`` are not cached. Claims are copied in and out,
+    a route changing its ``token`` dict doesn't change later requests'.
+    Without a size it is read by ``configure`` on the first put.
+    """
+
+    def __init__(self, maxsize: int | None = None):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize: int | None = None):
+        """Resize, by default to auth_token_cache_size, and empty"""
+        self.maxsize = maxsize if maxsize is not None \
+            else config.auth_token_cache_size
+        self.clear()
+
+    def get(self, token: str) -> dict | None:
+        with self._lock:
+            claims = self._entries.get(token)
+            if claims is None:
+                self.misses += 1
+                return None
+            if claims['exp'] <= time.time():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+        return copy.deepcopy(claims)
+
+    def put(self, token: str, claims: dict):
+        if self.maxsize is None:
+            self.configure()
+        if self.maxsize <= 0 or not isinstance(claims.get('exp'), int):
+            return
+        claims = copy.deepcopy(claims)
+        with self._lock:
+            self._entries[token] = claims
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+
+# sized by create_app, or on the first put
+verified_token_cache = VerifiedTokenCache()
+
+
 def verify_auth_token(request: Request):
     """Checks and verifies application access token
 
@@ -150,15 +228,21 @@ def verify_auth_token(request: Request):
     if not token:
         raise HTTPException(status_code=401, detail="No Token")
     stoken = token.split()
-    print(stoken)
-    print(token)
     try:
         if stoken[0].lower() == "token":
+            token_decoded = verified_token_cache.get(stoken[1])
+            if token_decoded is not None:
+                return token_decoded
             token_decoded = jwt.decode(
                 stoken[1],
                 key=config.jwt_decode_key,
                 algorithms=config.jwt_accept_algorithms
             )
+            if 'perm' not in token_decoded:
+                # issued before the bitmask claim, normalized once here
+                token_decoded['perm'] = permissions_to_mask(
+                    token_decoded.get('permissions', ()))
+            verified_token_cache.put(stoken[1], token_decoded)
             return token_decoded
         raise HTTPException(status_code=401, detail="No Token")
 
@@ -170,6 +254,28 @@ def verify_auth_token(request: Request):
         raise HTTPException(status_code=403, detail="Invalid Token")
 
 
+def require_permissions(*permissions: UserPermissionsEnum):
+    """Dependency verifying the access token and the permissions it carries
+
+    The required permissions become one bitmask when the route is declared,
+    each request costs a single bit test against the token's "perm" claim.
+
+    Args:
+        *permissions (UserPermissionsEnum): permissions the token must have
+
+    Returns:
+        dependency that returns the decoded token, raises 403 if a
+        permission is missing
+    """
+    required = permissions_to_mask(permissions)
+
+    def dependency(token: dict[str, any] = Depends(verify_auth_token)):
+        if token['perm'] & required != required:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        return token
+    return dependency
+
+
 def bcrypt_password(password: str) -> str:
     """returns bcrypt hash of specified password
 
@@ -179,5 +285,4 @@ def bcrypt_password(password: str) -> str:
     Returns:
         str: hash value
     """
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode(), salt).decode()
+    return hash_password(password)
@@ -0,0 +1,204 @@
+import asyncio
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
+from . import config
+
+
+class LRUDict(OrderedDict):
+    """Bounded ``cache_dict`` for the memory backend
+
+    The plain memory backend never evicts, every invalidation would leave
+    the orphaned entries in memory for good. The least recently used key is
+    dropped once ``maxsize`` is reached instead.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return super().pop(key, default)
+
+
+def _backend_arguments() -> dict:
+    arguments = dict(config.cache_arguments or {})
+    if config.cache_backend == 'dogpile.cache.memory':
+        arguments.setdefault('cache_dict', LRUDict(config.cache_max_entries))
+    return arguments
+
+
+# configured by create_app, or on first use
+region = make_region(key_mangler=lambda key: 'todo-python:' + key)
+
+
+def configure_region():
+    """(Re)configure ``region`` from the cache_* settings, drops its entries"""
+    region.configure(
+        config.cache_backend,
+        expiration_time=config.cache_expiration_time,
+        arguments=_backend_arguments(),
+        replace_existing_backend=True,
+    )
+
+
+def get_region():
+    """``region``, configured from the settings on first use"""
+    if not region.is_configured:
+        configure_region()
+    return region
+
+
+class CacheStats:
+    """Lookup counters of the read-through cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.hit_seconds = 0.0
+            self.miss_seconds = 0.0
+
+    def record(self, hit: bool, seconds: float):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.misses += 1
+                self.miss_seconds += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'avg_hit_ms':
+                    self.hit_seconds / self.hits * 1000 if self.hits else 0.0,
+                'avg_miss_ms':
+                    self.miss_seconds / self.misses * 1000 if self.misses else 0.0,
+            }
+
+
+cache_stats = CacheStats()
+
+
+# Generation keys
+#
+# Cached reads are stored under a key that contains the current generation
+# of their scope ("user:<id>" for todo lists, "todo:<id>" for single todos).
+# Writers replace the generation after commit, which orphans every entry of
+# the scope at once. Orphans are never read again, the memory backend's LRU
+# bound drops them; other backends need a bound of their own (e.g. the redis
+# backend's redis_expiration_time). Readers look the
+# generation up before querying the database, so a read that raced a write
+# can only ever be stored under the generation the write replaced.
+# Generations are random rather than counters, an evicted generation key
+# never comes back with a value that old entries were stored under.
+
+
+def _new_generation() -> str:
+    return secrets.token_hex(8)
+
+
+def generation(scope: str) -> str:
+    key = 'gen:' + scope
+    value = get_region().get(key)
+    if value is NO_VALUE:
+        value = _new_generation()
+        region.set(key, value)
+    return value
+
+
+def invalidate(*scopes: str):
+    """Drop every cached read of the scopes"""
+    get_region().set_multi({'gen:' + scope: _new_generation() for scope in scopes})
+
+
+def invalidate_all():
+    get_region().invalidate()
+
+
+def user_scope(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def todo_scope(todo_id: int) -> str:
+    return f'todo:{todo_id}'
+
+
+def cached(scope: str, key: str, creator: Callable):
+    """Read-through lookup of ``key`` in the current generation of ``scope``
+
+    Args:
+        scope (str): invalidation scope of the value
+        key (str): key of the value inside the scope
+        creator (Callable): produces the value on a miss
+
+    Returns:
+        value from the cache or from ``creator``, None results are not
+        stored (sqlite may reuse the id of a deleted todo)
+    """
+    started = time.perf_counter()
+    created = False
+
+    def create():
+        nonlocal created
+        created = True
+        return creator()
+
+    full_key = f'{scope}:{generation(scope)}:{key}'
+    if _on_event_loop():
+        # inside AsyncSession.run_sync the query yields to the event loop, a
+        # second reader waiting on dogpile's per key lock would block the
+        # loop thread and the lock holder with it
+        value = region.get(full_key)
+        if value is NO_VALUE:
+            value = create()
+            if _not_none(value):
+                region.set(full_key, value)
+    else:
+        # get_or_create lets one caller per key run the query on a miss, the
+        # others wait for its value instead of querying too
+        value = region.get_or_create(full_key, create,
+                                     should_cache_fn=_not_none)
+    cache_stats.record(not created, time.perf_counter() - started)
+    return value
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _not_none(value) -> bool:
+    return value is not None
@@ -0,0 +1,64 @@
+"""ETags and conditional requests of todo resources
+
+Listings are tagged with the owner's todo list version, single todos with
+their own version. Both only change when the data does, so clients polling
+with ``If-None-Match`` get a 304 without a body, and writes with
+``If-Match`` fail with 412 when the todo changed in the meantime.
+"""
+import re
+from fastapi import Request, Response
+
+
+ETAG_HEADER = 'ETag'
+_TODO_ETAG = re.compile(r'"todo-(\d+)-(\d+)-(\d+)"')
+
+
+def todo_list_etag(user_id: int, version: int) -> str:
+    """ETag of every listing of the user's todos"""
+    return f'"todos-{user_id}-{version}"'
+
+
+def todo_etag(todo) -> str:
+    """ETag of a single todo, usable in ``If-Match``"""
+    return f'"todo-{todo.owner}-{todo.id}-{todo.version}"'
+
+
+def _entity_tags(header: str) -> list[str]:
+    return [tag.strip() for tag in header.split(',') if tag.strip()]
+
+
+def not_modified(request: Request, etag: str) -> Response | None:
+    """304 response if ``If-None-Match`` matches ``etag``, else None
+
+    If-None-Match uses the weak comparison, W/ prefixes are ignored.
+    """
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return None
+    tags = [tag.removeprefix('W/') for tag in _entity_tags(header)]
+    if '*' in tags or etag in tags:
+        return Response(status_code=304, headers={ETAG_HEADER: etag})
+    return None
+
+
+def if_match_versions(request: Request, owner: int,
+                      todo_id: int) -> list[int] | None:
+    """Todo versions ``If-Match`` accepts for the todo
+
+    Returns:
+        list[int] | None: None without the header or for ``*``, otherwise
+            the versions of the strong todo ETags of this todo, possibly
+            none, then no version matches
+    """
+    header = request.headers.get('if-match')
+    if header is None:
+        return None
+    tags = _entity_tags(header)
+    if '*' in tags:
+        return None
+    versions = []
+    for tag in tags:
+        match = _TODO_ETAG.fullmatch(tag)
+        if match and int(match[1]) == owner and int(match[2]) == todo_id:
+            versions.append(int(match[3]))
+    return versions
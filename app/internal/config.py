@@ -1,13 +1,32 @@
+import os
 from dataclasses import dataclass
 from yamldataclassconfig import YamlDataClassConfig
 
 
 class Config:
+    """Settings of the app, one instance holding one ConfigData
+
+    ``app.internal.config`` stands for its ConfigData, see Settings. The
+    file is read on first use, from ``TODO_CONFIG`` (default
+    ``config.yaml``) unless ``create_app`` was given another one. Another
+    call with the same file doesn't read it again, another file replaces
+    the settings in place. Nothing reads them at import: ``create_app``
+    builds the cache region, hashing pool, token cache and reaper from the
+    settings in use at that point, the engines and the session dependency
+    follow them at startup.
+    """
     def __new__(cls, yaml_config_file: str, *args, **kwargs):
         if not hasattr(cls, 'instance'):
             cls.instance = super(Config, cls).__new__(cls, *args, **kwargs)
         return cls.instance
 
+    @classmethod
+    def current(cls) -> 'Config.ConfigData':
+        """Settings of the process, read from TODO_CONFIG if none were"""
+        if not hasattr(cls, 'instance'):
+            cls(os.environ.get('TODO_CONFIG', 'config.yaml'))
+        return cls.instance.config
+
     @dataclass
     class ConfigData(YamlDataClassConfig):
         jwt_encode_key_file: str | None = None
@@ -16,13 +35,97 @@ class Config:
         jwt_decode_key: str | None = None
         jwt_algorithm: str | None = None
         jwt_accept_algorithms: list[str] | None = None
+        # decoded access tokens kept in memory, 0 disables the cache
+        auth_token_cache_size: int = 10000
+
+        bcrypt_rounds: int = 12
+        # password hashing process pool, workers defaults to the cpu count,
+        # 0 hashes inline
+        hashing_workers: int | None = None
+        hashing_queue_size: int = 16
 
         database_url: str | None = None
+        database_async: bool = False
+        database_async_url: str | None = None
+        database_echo: bool = False
+        # 0 opens a new connection for every session
+        database_pool_size: int = 5
+        database_max_overflow: int = 10
+        # seconds, -1 never recycles
+        database_pool_recycle: int = -1
+        database_pool_pre_ping: bool = False
+        # PRAGMAs run on every new sqlite connection, None keeps the sqlite
+        # default. WAL lets readers run alongside the writer.
+        sqlite_journal_mode: str | None = "wal"
+        sqlite_synchronous: str | None = "normal"
+        # negative: KiB
+        sqlite_cache_size: int | None = -65536
+        sqlite_mmap_size: int | None = 268435456
+        # milliseconds a connection waits for a lock before "database is locked"
+        sqlite_busy_timeout: int | None = 5000
+
+        batch_max_items: int = 1000
+        # page size cap of the admin user listing
+        admin_users_max_limit: int = 1000
+        # users per bulk provisioning request (the CLI takes any amount),
+        # and users hashed and inserted per transaction
+        provision_max_items: int = 1000
+        provision_chunk_size: int = 500
+        # todo list and search responses encode the rows as read, without
+        # the response_model validation, see app.internal.responses
+        fast_read_responses: bool = True
+        # rows fetched from the cursor per chunk of a todo export
+        export_batch_size: int = 1000
+        # todos inserted per transaction of an import, and the amount of
+        # errors listed in its summary
+        import_chunk_size: int = 1000
+        import_max_error_details: int = 100
+
+        log_level: str = "INFO"
+        # levels of single loggers, e.g. {"sqlalchemy.engine": "INFO"}
+        log_levels: dict | None = None
+        # share of successful requests written to the access log, failed
+        # ones (status >= 500) are always written
+        log_request_sample_rate: float = 1.0
+        # request latency, status and SQL metrics at /metrics
+        metrics_enabled: bool = False
+
+        # dogpile.cache region for todo reads, "dogpile.cache.null" disables
+        # caching; cache_arguments go to the backend as is
+        cache_backend: str = "dogpile.cache.memory"
+        cache_expiration_time: int = 300
+        cache_arguments: dict | None = None
+        # LRU bound of the memory backend
+        cache_max_entries: int = 10000
+
+        # expired refresh token families are deleted every interval seconds
+        # by the app, 0 disables the background task
+        token_reaper_interval: int = 3600
+        token_reaper_batch_size: int = 500
+        # pause between batches, lets writers in between
+        token_reaper_pause: float = 0.05
 
     def __init__(self, yaml_config_file: str):
-        # yaml.load(config_f, self.ConfigData)
-        self.config = self.ConfigData()
+        if getattr(self, 'path', None) == yaml_config_file:
+            return
+        self._load(yaml_config_file)
+
+    def reload(self):
+        """Read the settings file again, ``python -m app serve`` on SIGHUP
+
+        Only what is read after the reload sees the new values, e.g. the
+        engines of workers started afterwards.
+        """
+        self._load(self.path)
+
+    def _load(self, yaml_config_file: str):
+        if hasattr(self, 'config'):
+            # modules hold on to the ConfigData, reset it to the defaults
+            self.config.__dict__.update(self.ConfigData().__dict__)
+        else:
+            self.config = self.ConfigData()
         self.config.load(yaml_config_file)
+        self.path = yaml_config_file
         if not self.config.jwt_encode_key and self.config.jwt_encode_key_file:
             with open(self.config.jwt_encode_key_file) as jwt_encode_key_fd:
                 key = jwt_encode_key_fd.read()
@@ -34,3 +137,17 @@ class Config:
                 key = jwt_decode_key_fd.read()
                 key.strip('\n')
                 self.config.jwt_decode_key = key
+
+
+class Settings:
+    """``app.internal.config``: attributes of ``Config.current()``
+
+    Modules keep this object from their import on, the settings file is
+    read when the first attribute is looked up.
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(Config.current(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(Config.current(), name, value)
@@ -1,14 +1,224 @@
+import asyncio
+import concurrent.futures
+import os
+from sqlalchemy import event
 from sqlalchemy.engine import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
 from . import config
+from .metrics import instrument_engine
 
 
-# URL = "sqlite:///db.sqlite3"
-URL = config.database_url
+def engine_options(url: str, pool_class=QueuePool) -> dict:
+    """Engine keyword arguments from the database_* settings"""
+    options = {
+        'echo': config.database_echo,
+        'future': True,
+        'pool_pre_ping': config.database_pool_pre_ping,
+        'pool_recycle': config.database_pool_recycle,
+    }
+    if url.startswith('sqlite') and pool_class is QueuePool and \
+       (url.endswith(':memory:') or url.rstrip('/') in ('sqlite:', 'sqlite:/')):
+        # in-memory databases live in their single connection, keep the
+        # dialect's per thread pool
+        return options
+    if config.database_pool_size <= 0:
+        options['poolclass'] = NullPool
+    else:
+        options.update(poolclass=pool_class,
+                       pool_size=config.database_pool_size,
+                       max_overflow=config.database_max_overflow)
+    return options
 
-engine = create_engine(URL, echo=True, future=True)
 
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+def apply_sqlite_profile(dbapi_connection, connection_record):
+    """Apply the sqlite_* PRAGMAs to every new connection"""
+    pragmas = {
+        'journal_mode': config.sqlite_journal_mode,
+        'synchronous': config.sqlite_synchronous,
+        'cache_size': config.sqlite_cache_size,
+        'mmap_size': config.sqlite_mmap_size,
+        'busy_timeout': config.sqlite_busy_timeout,
+    }
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        if value is not None:
+            cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
 
-Base = declarative_base(bind=engine)
+
+# Engines are created on first use, by the app's startup, the first
+# session or the first access to ``engine``, not when the module is
+# imported.
+_engine = None
+_async_engine = None
+
+
+class _LazySessionmaker(sessionmaker):
+    """sessionmaker bound by init_engines before its first session"""
+
+    def __call__(self, **local_kw):
+        init_engines()
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+# expire_on_commit=False: expired attributes can't lazy load once the
+# result has left the session's greenlet
+AsyncSessionLocal = _LazySessionmaker(class_=AsyncSession,
+                                      autocommit=False,
+                                      autoflush=False,
+                                      expire_on_commit=False)
+
+Base = declarative_base()
+
+
+def init_engines():
+    """Create the engines from the database_* settings, once
+
+    Binds SessionLocal, and AsyncSessionLocal with database_async.
+    Connections are only opened when a session or the app needs them.
+    """
+    global _engine, _async_engine
+    if _engine is not None:
+        return
+    url = config.database_url
+    # Sessions are handed between threadpool workers inside one request
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") \
+        else {}
+    engine = create_engine(url, connect_args=connect_args,
+                           **engine_options(url))
+    if url.startswith('sqlite'):
+        event.listen(engine, 'connect', apply_sqlite_profile)
+    if config.metrics_enabled:
+        instrument_engine(engine)
+    SessionLocal.configure(bind=engine)
+
+    if config.database_async:
+        async_url = config.database_async_url
+        # aiosqlite defaults to NullPool, which starts a connection thread
+        # for every session, so pool explicitly
+        async_engine = create_async_engine(
+            async_url, **engine_options(async_url, AsyncAdaptedQueuePool))
+        if async_url.startswith('sqlite'):
+            event.listen(async_engine.sync_engine, 'connect',
+                         apply_sqlite_profile)
+        if config.metrics_enabled:
+            instrument_engine(async_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=async_engine)
+        _async_engine = async_engine
+    _engine = engine
+
+
+def get_engine():
+    """The sync engine, created on first use"""
+    init_engines()
+    return _engine
+
+
+def __getattr__(name: str):
+    # ``from app.internal.db import engine`` keeps working for scripts and
+    # tests, and creates the engines at that point
+    if name == 'engine':
+        return get_engine()
+    if name == 'async_engine':
+        init_engines()
+        return _async_engine
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# Session type handed to the routes by get_session
+AnySession = Session | AsyncSession
+
+
+async def get_session():
+    """Session of the engine in use, AsyncSession with database_async
+
+    Dispatches on the engines created at startup, so the routes follow the
+    settings the app was started with rather than those of the import.
+    """
+    init_engines()
+    if _async_engine is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        # returns the connection to the pool, may roll back
+        await run_in_threadpool(db.close)
+
+
+async def dispose_engines():
+    """Close pooled connections, aiosqlite keeps a thread per connection"""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+
+def _forget_engines():
+    """After a fork: leave the parent's pooled connections to the parent
+
+    The child creates its own engines on first use, from the settings
+    current at that point.
+    """
+    global _engine, _async_engine
+    if _async_engine is not None:
+        _async_engine.sync_engine.dispose(close=False)
+    if _engine is not None:
+        _engine.dispose(close=False)
+    _engine = _async_engine = None
+
+
+os.register_at_fork(after_in_child=_forget_engines)
+
+
+async def run_in_session(db: AnySession, fn, *args, **kwargs):
+    """Run sync ``fn(session, *args, **kwargs)`` without blocking the loop
+
+    An ``AsyncSession`` runs it through ``run_sync``, so driver IO is awaited
+    on the event loop. A plain ``Session`` is sent to the threadpool.
+
+    Args:
+        db (AnySession): session from ``get_session``
+        fn: function taking a sync ``Session`` as the first argument
+
+    Returns:
+        whatever ``fn`` returns
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+def wait_future(future: concurrent.futures.Future):
+    """Wait for ``future`` from sync code without stalling the event loop
+
+    Inside ``AsyncSession.run_sync`` the sync code runs in a greenlet on the
+    loop thread, so the future is awaited from there. Anywhere else it is a
+    plain blocking wait.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return future.result()
+    return await_only(asyncio.wrap_future(future))
@@ -0,0 +1,162 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import bcrypt
+from fastapi import HTTPException
+from .db import wait_future
+from . import config
+
+
+class HashingExecutor:
+    """Process pool for bcrypt with a bounded amount of pending calls
+
+    At most ``workers + queue_size`` hashes are in flight, anything beyond
+    that is rejected right away with 503 instead of piling up threads that
+    wait on the pool. ``workers=0`` hashes inline in the calling thread.
+    Without sizes the executor is sized by ``configure`` on first use.
+    """
+
+    def __init__(self, workers: int | None = None,
+                 queue_size: int | None = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rejected = 0
+        self._slots = None
+        self._pool: concurrent.futures.ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        if workers is not None:
+            self.configure(workers, queue_size)
+
+    def configure(self, workers: int | None = None,
+                  queue_size: int | None = None):
+        """Resize, by default to the hashing_* settings
+
+        A running pool is shut down, the next call starts one of the new
+        size.
+        """
+        self.shutdown()
+        self.workers = workers if workers is not None else (
+            config.hashing_workers if config.hashing_workers is not None
+            else os.cpu_count() or 1)
+        self.queue_size = queue_size if queue_size is not None \
+            else config.hashing_queue_size
+        self._slots = threading.BoundedSemaphore(self.workers +
+                                                 self.queue_size)
+
+    def _get_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that runs the event loop and
+                # connection threads is not safe
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def run(self, fn, *args):
+        """Call ``fn(*args)`` in the pool and wait for the result
+
+        Raises:
+            HTTPException: 503, all workers and queue slots are taken
+        """
+        if self.workers is None:
+            self.configure()
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(status_code=503,
+                                detail="Server busy, try again later",
+                                headers={"Retry-After": "1"})
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return wait_future(future)
+
+    def map(self, fn, calls: list[tuple]) -> list:
+        """``fn(*args)`` of every ``args`` in ``calls``, results in order
+
+        For bulk work, blocks: waits for free slots instead of rejecting,
+        and keeps at most ``workers`` calls in flight, so single calls
+        (logins) still find queue slots and only wait for the calls
+        already running.
+        """
+        if self.workers is None:
+            self.configure()
+        if self.workers <= 0:
+            return [fn(*args) for args in calls]
+        pool = self._get_pool()
+        results = []
+        in_flight = collections.deque()
+        for args in calls:
+            if len(in_flight) >= self.workers:
+                results.append(in_flight.popleft().result())
+            self._slots.acquire()
+            try:
+                future = pool.submit(fn, *args)
+            except BaseException:
+                self._slots.release()
+                raise
+            future.add_done_callback(lambda _: self._slots.release())
+            in_flight.append(future)
+        results.extend(future.result() for future in in_flight)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _forget_pool(self):
+        # after a fork the pool's processes and threads belong to the parent
+        self._pool = None
+        self._lock = threading.Lock()
+        if self._slots is not None:
+            self._slots = threading.BoundedSemaphore(self.workers +
+                                                     self.queue_size)
+
+
+# sized by create_app, or on first use
+hashing_executor = HashingExecutor()
+os.register_at_fork(after_in_child=hashing_executor._forget_pool)
+
+
+def hash_password(password: str) -> str:
+    """bcrypt hash of the password with the configured cost
+
+    Args:
+        password (str): plaintext password
+
+    Returns:
+        str: hash value
+    """
+    salt = bcrypt.gensalt(rounds=config.bcrypt_rounds)
+    return hashing_executor.run(bcrypt.hashpw, password.encode(), salt)\
+        .decode()
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    """``hash_password`` of every password, hashed in parallel by the pool
+
+    Blocks until all are hashed, call it from a worker thread.
+    """
+    return [hashed.decode() for hashed in hashing_executor.map(
+        bcrypt.hashpw,
+        [(password.encode(), bcrypt.gensalt(rounds=config.bcrypt_rounds))
+         for password in passwords])]
+
+
+def check_password(password: str, hashed: str) -> bool:
+    """Check plaintext password against a bcrypt hash
+
+    The cost is read from the hash, so hashes made with another
+    bcrypt_rounds keep working.
+    """
+    return hashing_executor.run(bcrypt.checkpw,
+                                password.encode(), hashed.encode())
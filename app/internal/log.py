@@ -0,0 +1,150 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from . import config
+
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+request_id: contextvars.ContextVar[str | None] = \
+    contextvars.ContextVar('request_id', default=None)
+
+# extra fields with these in their name are never written
+SECRET_FIELDS = re.compile(r'password|token|secret|key|authorization', re.I)
+
+# attributes every LogRecord has, anything else came in through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+_RECORD_ATTRIBUTES.update(('message', 'asctime', 'request_id'))
+
+
+class RequestIdFilter(logging.Filter):
+    """Tags records with the id of the request they were logged in"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, extra fields are redacted by name"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        for name, value in vars(record).items():
+            if name in _RECORD_ATTRIBUTES:
+                continue
+            entry[name] = '[redacted]' if SECRET_FIELDS.search(name) else value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _FormattingQueueHandler(logging.handlers.QueueHandler):
+    # the record is formatted on the logging thread, while the request id
+    # is still set; the listener thread only writes the line
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        line = self.format(record)
+        record = logging.makeLogRecord({'msg': line, 'levelno': record.levelno,
+                                        'levelname': record.levelname})
+        return record
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging():
+    """Send the root logger through a queue to a JSON writer thread
+
+    Levels come from log_level and log_levels. Safe to call again, the
+    handler is only installed once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    handler = _FormattingQueueHandler(log_queue)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RequestIdFilter())
+
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(logging.Formatter('%(message)s'))
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(config.log_level.upper())
+    for name, level in (config.log_levels or {}).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+
+def stop_logging():
+    """Flush the queue and stop the writer thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _FormattingQueueHandler):
+            root.removeHandler(handler)
+    _listener = None
+
+
+access_logger = logging.getLogger('app.access')
+
+
+class RequestLogMiddleware:
+    """ASGI middleware assigning request ids and writing the access log
+
+    The id comes from the X-Request-ID request header when present and is
+    echoed in the response. Successful requests are logged with probability
+    log_request_sample_rate, responses with status >= 500 always.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        incoming = dict(scope['headers']).get(REQUEST_ID_HEADER.lower().encode())
+        rid = incoming.decode('latin-1')[:64] if incoming else uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (REQUEST_ID_HEADER.lower().encode(), rid.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            if status >= 500 or random.random() < config.log_request_sample_rate:
+                access_logger.info(
+                    "%s %s %d", scope['method'], scope['path'], status,
+                    extra={'method': scope['method'], 'path': scope['path'],
+                           'status': status,
+                           'duration_ms': round(
+                               (time.perf_counter() - started) * 1000, 3)})
+            request_id.reset(token)
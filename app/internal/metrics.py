@@ -0,0 +1,218 @@
+"""Request and SQL metrics in the Prometheus text format
+
+Only wired up with ``metrics_enabled``: the middleware, the engine
+listeners and the ``/metrics`` route don't exist otherwise, so there is no
+cost when it's off.
+
+Counters are kept per process. The workers of ``python -m app serve`` set
+``worker`` and their series carry it as a label, a scrape through the
+shared socket reaches one of them; sum over ``worker`` for the totals.
+"""
+import contextvars
+import threading
+import time
+from fastapi import Response
+from sqlalchemy import event
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# pid of the serve worker, label of every series
+worker: str | None = None
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"')\
+        .replace('\n', r'\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if worker is not None:
+        pairs.append(f'worker="{worker}"')
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} '
+                             f'{value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, label_names: tuple,
+                 buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [count per bucket..., sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * len(self.buckets) + [0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, values in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, values):
+                    le = _labels(self.label_names, labels, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{le} {count}')
+                le = _labels(self.label_names, labels, 'le="+Inf"')
+                lines.append(f'{self.name}_bucket{le} {values[-1]}')
+                plain = _labels(self.label_names, labels)
+                lines.append(f'{self.name}_sum{plain} {values[-2]}')
+                lines.append(f'{self.name}_count{plain} {values[-1]}')
+        return lines
+
+
+ROUTE_LABELS = ('method', 'route')
+
+requests_total = Counter(
+    'app_requests_total', "Requests by route and status",
+    ROUTE_LABELS + ('status',))
+request_duration = Histogram(
+    'app_request_duration_seconds', "Request latency",
+    ROUTE_LABELS, LATENCY_BUCKETS)
+request_sql_statements = Histogram(
+    'app_request_sql_statements', "SQL statements executed per request",
+    ROUTE_LABELS, STATEMENT_BUCKETS)
+request_sql_duration = Histogram(
+    'app_request_sql_seconds', "Time spent in SQL statements per request",
+    ROUTE_LABELS, LATENCY_BUCKETS)
+
+METRICS = (requests_total, request_duration, request_sql_statements,
+           request_sql_duration)
+
+
+class RequestSqlStats:
+    __slots__ = ('statements', 'seconds')
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# the threadpool and run_sync copy the context, the stats object itself is
+# shared, so statements executed there count for the request
+request_sql_stats: contextvars.ContextVar[RequestSqlStats | None] = \
+    contextvars.ContextVar('request_sql_stats', default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    # on the execution context, it ends with the statement even when the
+    # statement fails
+    context._query_started = time.perf_counter()
+
+
+def _record_statement(context):
+    stats = request_sql_stats.get()
+    if stats is not None and context is not None and \
+       hasattr(context, '_query_started'):
+        stats.statements += 1
+        stats.seconds += time.perf_counter() - context._query_started
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    _record_statement(context)
+
+
+def _handle_error(exception_context):
+    # failed statements (e.g. an IntegrityError) took their time too,
+    # after_cursor_execute isn't called for them
+    _record_statement(exception_context.execution_context)
+
+
+def instrument_engine(engine):
+    """Count statements and their time for the request they run in"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and SQL use per route
+
+    Routes are labeled by their path template, requests that matched no
+    route as "unmatched", so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: dict | None = None
+
+    def _route(self, scope) -> str:
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path
+                for route in scope['app'].routes if hasattr(route, 'endpoint')}
+        return self._route_paths.get(scope.get('endpoint'), 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestSqlStats()
+        token = request_sql_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_sql_stats.reset(token)
+            labels = (scope['method'], self._route(scope))
+            requests_total.inc(labels + (str(status),))
+            request_duration.observe(labels, time.perf_counter() - started)
+            request_sql_statements.observe(labels, stats.statements)
+            request_sql_duration.observe(labels, stats.seconds)
+
+
+def render() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def metrics_endpoint():
+    return Response(render(), media_type='text/plain; version=0.0.4')
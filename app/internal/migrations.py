@@ -0,0 +1,379 @@
+"""Schema creation and upgrades of databases created by earlier versions
+
+``python -m app migrate`` creates missing tables with ``create_all``, then
+applies the steps of MIGRATIONS the database hasn't had yet. ``create_all``
+only creates missing tables, columns and indexes added to existing tables
+come from the steps, which the single ``python -m app`` migration
+commands run as well. The app itself never changes the schema, it checks
+it at startup with ``check_schema``.
+"""
+import sqlalchemy
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+from .db import Base
+from .models import ALL_USERS, RefreshToken, SchemaVersion, Todo, TodoStats
+from .models import User
+from .models import TODO_SEARCH_DDL, TODO_SEARCH_TABLE, TODO_SEARCH_TRIGGERS
+from .schemas import normalize_username, permissions_to_mask
+from ..crud import assign_token_families
+
+
+def missing_columns(engine, table: sqlalchemy.Table) -> list[sqlalchemy.Column]:
+    existing = {c['name'] for c in sqlalchemy.inspect(engine).get_columns(table.name)}
+    return [column for column in table.columns if column.name not in existing]
+
+
+def add_missing_columns(engine, table: sqlalchemy.Table) -> list[str]:
+    """Add the table's nullable columns and indexes missing in the database
+
+    Returns:
+        list[str]: names of the added columns
+    """
+    added = missing_columns(engine, table)
+    with engine.begin() as conn:
+        for column in added:
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(sqlalchemy.text(
+                f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+    return [column.name for column in added]
+
+
+def missing_indexes(engine, table: sqlalchemy.Table) -> list[str]:
+    existing = {i['name'] for i in sqlalchemy.inspect(engine).get_indexes(table.name)}
+    return sorted(i.name for i in table.indexes if i.name not in existing)
+
+
+def duplicate_todo_names(engine) -> list[tuple[int, str, int]]:
+    """(owner, name, count) of todo names used more than once by an owner"""
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(Todo.owner, Todo.name, func.count())
+            .group_by(Todo.owner, Todo.name)
+            .having(func.count() > 1)
+        )
+        return [tuple(row) for row in rows]
+
+
+def add_todo_indexes(engine) -> list[str]:
+    """Create the todos indexes, refuses while todo names are duplicated
+
+    Raises:
+        ValueError: an owner has several todos with the same name, the
+            unique index can't be created
+
+    Returns:
+        list[str]: names of the created indexes
+    """
+    missing = missing_indexes(engine, Todo.__table__)
+    if 'uq_todos_owner_name' in missing:
+        duplicates = duplicate_todo_names(engine)
+        if duplicates:
+            raise ValueError(
+                f"{len(duplicates)} todo names are duplicated in their owner "
+                f"scope, rename them first: {duplicates[:10]}")
+    for index in Todo.__table__.indexes:
+        # CREATE [UNIQUE] INDEX IF NOT EXISTS
+        index.create(bind=engine, checkfirst=True)
+    return missing
+
+
+def backfill_permission_masks(engine, batch_size: int = 500) -> int:
+    """Fill users.permission_mask from the comma joined permissions column
+
+    Returns:
+        int: amount of users updated
+    """
+    updated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(User.id, User._permissions)
+                .where(User.permission_mask.is_(None))
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+            conn.execute(
+                update(User.__table__)
+                .where(User.id == bindparam('_id'))
+                .values(permission_mask=bindparam('_mask')),
+                [{'_id': id, '_mask': permissions_to_mask(
+                    int(p) for p in (permissions or '').split(',') if p)}
+                 for id, permissions in rows]
+            )
+            updated += len(rows)
+
+
+def backfill_user_names(engine, batch_size: int = 500) -> int:
+    """Fill users.name_lower from name, in python: sqlite's lower() only
+    folds ASCII
+
+    Returns:
+        int: amount of users updated
+    """
+    updated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(User.id, User.name)
+                .where(User.name_lower.is_(None), User.name.isnot(None))
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+            conn.execute(
+                update(User.__table__)
+                .where(User.id == bindparam('_id'))
+                .values(name_lower=bindparam('_name_lower')),
+                [{'_id': id, '_name_lower': normalize_username(name)}
+                 for id, name in rows]
+            )
+            updated += len(rows)
+
+
+def unnormalized_user_names(engine) -> bool:
+    """True if a user has no name_lower, seeks ix_users_name_lower_id"""
+    with engine.connect() as conn:
+        return conn.execute(
+            select(User.id).where(User.name_lower.is_(None),
+                                  User.name.isnot(None)).limit(1)
+        ).first() is not None
+
+
+def backfill_todo_versions(engine, batch_size: int = 500) -> int:
+    """Set the version of todos written before versions existed to 0
+
+    Returns:
+        int: amount of todos updated
+    """
+    updated = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(select(Todo.id).where(Todo.version.is_(None))
+                               .limit(batch_size)).scalars().all()
+            if not ids:
+                return updated
+            conn.execute(update(Todo.__table__).where(Todo.id.in_(ids))
+                         .values(version=0))
+            updated += len(ids)
+
+
+def missing_todo_search(engine) -> bool:
+    """True if the todos full-text table or one of its triggers is missing"""
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        names = set(conn.execute(sqlalchemy.text(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+        )).scalars())
+    return not names.issuperset((TODO_SEARCH_TABLE,) + TODO_SEARCH_TRIGGERS)
+
+
+def rebuild_todo_search(engine) -> int:
+    """Create the todos full-text table and triggers if missing, reindex
+
+    Returns:
+        int: amount of todos indexed
+    """
+    with engine.begin() as conn:
+        for statement in TODO_SEARCH_DDL:
+            conn.execute(sqlalchemy.text(statement))
+        conn.execute(sqlalchemy.text(
+            f"INSERT INTO {TODO_SEARCH_TABLE}({TODO_SEARCH_TABLE}) "
+            f"VALUES ('rebuild')"))
+        return conn.execute(select(func.count()).select_from(Todo)).scalar()
+
+
+# (owner, total, done) of every owner with todos and of ALL_USERS
+_COUNT_TODO_STATS = f"""
+    SELECT owner, count(*) AS total, count(*) FILTER (WHERE done) AS done
+    FROM todos WHERE owner IS NOT NULL GROUP BY owner
+    UNION ALL
+    SELECT {ALL_USERS}, count(*), count(*) FILTER (WHERE done)
+    FROM todos WHERE owner IS NOT NULL
+"""
+
+
+def missing_todo_stats(engine) -> bool:
+    """True if todo_stats is missing or was never filled for existing todos"""
+    if not sqlalchemy.inspect(engine).has_table(TodoStats.__tablename__):
+        return True
+    with engine.connect() as conn:
+        return bool(conn.execute(sqlalchemy.text(
+            f"SELECT NOT EXISTS (SELECT 1 FROM todo_stats "
+            f"WHERE owner = {ALL_USERS}) AND EXISTS (SELECT 1 FROM todos)"
+        )).scalar())
+
+
+def todo_stats_drift(engine) -> list[tuple[int, tuple[int, int], tuple[int, int]]]:
+    """Owners whose todo_stats counts differ from their todos
+
+    Both sides are read by one statement, so it's consistent while the app
+    writes todos.
+
+    Returns:
+        list[tuple[int, tuple[int, int], tuple[int, int]]]: owner, stored
+            and counted (total, done), ALL_USERS for the totals
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.text(f"""
+            SELECT owner, sum(stored_total), sum(stored_done),
+                   sum(total), sum(done)
+            FROM (SELECT owner, total AS stored_total, done AS stored_done,
+                         0 AS total, 0 AS done FROM todo_stats
+                  UNION ALL
+                  SELECT owner, 0, 0, total, done
+                  FROM ({_COUNT_TODO_STATS}))
+            GROUP BY owner
+            HAVING sum(stored_total) != sum(total)
+                OR sum(stored_done) != sum(done)
+            ORDER BY owner
+        """))
+        return [(owner, (stored_total, stored_done), (total, done))
+                for owner, stored_total, stored_done, total, done in rows]
+
+
+def rebuild_todo_stats(engine) -> int:
+    """Create todo_stats if missing and count every owner's todos again
+
+    Runs in one transaction, writes of the app wait for it.
+
+    Returns:
+        int: amount of owners with todos
+    """
+    with engine.begin() as conn:
+        TodoStats.__table__.create(bind=conn, checkfirst=True)
+        conn.execute(sqlalchemy.delete(TodoStats.__table__))
+        conn.execute(sqlalchemy.text(
+            f"INSERT INTO todo_stats (owner, total, done) {_COUNT_TODO_STATS}"))
+        return conn.execute(select(func.count()).select_from(TodoStats)
+                            .where(TodoStats.owner != ALL_USERS)).scalar()
+
+
+def _migrate_token_families(engine, batch_size: int):
+    add_missing_columns(engine, RefreshToken.__table__)
+    with Session(engine) as db:
+        assign_token_families(db, batch_size)
+
+
+def _migrate_permission_masks(engine, batch_size: int):
+    add_missing_columns(engine, User.__table__)
+    backfill_permission_masks(engine, batch_size)
+
+
+def _migrate_todo_search(engine, batch_size: int):
+    if missing_todo_search(engine):
+        rebuild_todo_search(engine)
+
+
+def _migrate_todo_versions(engine, batch_size: int):
+    add_missing_columns(engine, Todo.__table__)
+    backfill_todo_versions(engine, batch_size)
+
+
+def _migrate_todo_stats(engine, batch_size: int):
+    if missing_todo_stats(engine):
+        rebuild_todo_stats(engine)
+
+
+def _migrate_user_names(engine, batch_size: int):
+    add_missing_columns(engine, User.__table__)
+    backfill_user_names(engine, batch_size)
+
+
+# (description, step) in the order they were introduced, append only. The
+# schema version is the amount of steps applied. Steps are idempotent, a
+# database from before versions existed runs them all once.
+MIGRATIONS = [
+    ('todos indexes', lambda engine, batch_size: add_todo_indexes(engine)),
+    ('refresh token families', _migrate_token_families),
+    ('user permission masks', _migrate_permission_masks),
+    ('todos search index', _migrate_todo_search),
+    ('todo versions', _migrate_todo_versions),
+    ('todo stats', _migrate_todo_stats),
+    ('lowercase user names', _migrate_user_names),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(engine) -> int | None:
+    """Version recorded by ``migrate``, None if it never ran"""
+    if not sqlalchemy.inspect(engine).has_table(SchemaVersion.__tablename__):
+        return None
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(SchemaVersion.version))).scalar()
+
+
+def migrate(engine, batch_size: int = 500):
+    """Create missing tables and apply the pending MIGRATIONS steps
+
+    The version is recorded after every step, a failed step is retried by
+    the next run.
+
+    Raises:
+        ValueError: todo names are duplicated, see add_todo_indexes
+
+    Returns:
+        Iterator[tuple[int, str]]: version and description of every step,
+            as it is applied
+    """
+    Base.metadata.create_all(bind=engine)
+    applied = schema_version(engine) or 0
+    for version, (description, step) in enumerate(MIGRATIONS[applied:],
+                                                  start=applied + 1):
+        step(engine, batch_size)
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.delete(SchemaVersion.__table__))
+            conn.execute(sqlalchemy.insert(SchemaVersion.__table__)
+                         .values(version=version))
+        yield version, description
+
+
+def check_schema(engine):
+    """Refuse to run against a database that needs a migration command
+
+    A database at SCHEMA_VERSION passes with one lookup, others are
+    inspected. Todo name uniqueness is only enforced by
+    uq_todos_owner_name, running without it would silently accept
+    duplicates.
+
+    Raises:
+        RuntimeError: tables, indexes or columns are missing
+    """
+    if schema_version(engine) == SCHEMA_VERSION:
+        return
+    if not sqlalchemy.inspect(engine).has_table(User.__tablename__):
+        raise RuntimeError(
+            "the database has no tables, run `python -m app migrate`")
+    missing = missing_indexes(engine, Todo.__table__)
+    if missing:
+        raise RuntimeError(
+            f"todos is missing the indexes {', '.join(missing)}, run "
+            f"`python -m app migrate-todo-indexes`")
+    if missing_columns(engine, Todo.__table__):
+        raise RuntimeError(
+            "todos is missing columns, run `python -m app migrate-todo-versions`")
+    if missing_columns(engine, RefreshToken.__table__):
+        raise RuntimeError(
+            "refresh_tokens is missing columns, run "
+            "`python -m app migrate-token-families`")
+    missing = {column.name for column in missing_columns(engine, User.__table__)}
+    if 'permission_mask' in missing:
+        raise RuntimeError(
+            "users is missing columns, run "
+            "`python -m app migrate-permission-masks`")
+    if missing or missing_indexes(engine, User.__table__) or \
+            unnormalized_user_names(engine):
+        raise RuntimeError(
+            "users.name_lower is missing or not filled, run "
+            "`python -m app migrate-user-names`")
+    if missing_todo_search(engine):
+        raise RuntimeError(
+            "the todos search index is missing, run "
+            "`python -m app rebuild-todo-search`")
+    if missing_todo_stats(engine):
+        raise RuntimeError(
+            "todo_stats is missing or empty, run "
+            "`python -m app rebuild-todo-stats`")
@@ -1,6 +1,10 @@
 import enum
 from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime
+from sqlalchemy import DDL, Index, event
+from sqlalchemy.orm import validates
 from app.internal.db import Base
+from app.internal.schemas import mask_to_permissions, normalize_username
+from app.internal.schemas import permissions_to_mask
 
 
 class Todo(Base):
@@ -10,7 +14,106 @@ class Todo(Base):
     name = Column(String, index=True)
     description = Column(String)
     done = Column(Boolean)
-    owner = Column(Integer, index=True)
+    owner = Column(Integer)
+    # owner's todo list version of the last write to the todo, see
+    # TodoListVersion
+    version = Column(Integer, default=0)
+
+    __table_args__ = (
+        # keyset pagination seeks on (owner, id), also serves owner lookups
+        Index('ix_todos_owner_id', 'owner', 'id'),
+        # todo names are unique in the user scope, also serves name prefix
+        # filters and sorting by name
+        Index('uq_todos_owner_name', 'owner', 'name', unique=True),
+        # the same two orders restricted to open or done todos
+        Index('ix_todos_owner_done_id', 'owner', 'done', 'id'),
+        Index('ix_todos_owner_done_name', 'owner', 'done', 'name'),
+    )
+
+
+# Full-text index of todo names and descriptions, sqlite only. An FTS5
+# external content table over todos, kept in sync by triggers so every
+# write path (batches, imports, raw SQL) updates it. The owner column is
+# indexed too, queries restrict to one user with an owner:"<id>" term.
+TODO_SEARCH_TABLE = 'todos_fts'
+TODO_SEARCH_TRIGGERS = ('todos_fts_insert', 'todos_fts_delete',
+                        'todos_fts_update')
+TODO_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS todos_fts USING fts5("
+    "name, description, owner, content='todos', content_rowid='id')",
+    # matches in names count ten times as much, owner matches not at all
+    "INSERT INTO todos_fts(todos_fts, rank) "
+    "VALUES('rank', 'bm25(10.0, 1.0, 0.0)')",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_insert AFTER INSERT ON todos "
+    "BEGIN "
+    "INSERT INTO todos_fts(rowid, name, description, owner) "
+    "VALUES (new.id, new.name, new.description, new.owner); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_delete AFTER DELETE ON todos "
+    "BEGIN "
+    "INSERT INTO todos_fts(todos_fts, rowid, name, description, owner) "
+    "VALUES ('delete', old.id, old.name, old.description, old.owner); "
+    "END",
+    # done toggles leave the index alone
+    "CREATE TRIGGER IF NOT EXISTS todos_fts_update "
+    "AFTER UPDATE OF name, description, owner ON todos "
+    "BEGIN "
+    "INSERT INTO todos_fts(todos_fts, rowid, name, description, owner) "
+    "VALUES ('delete', old.id, old.name, old.description, old.owner); "
+    "INSERT INTO todos_fts(rowid, name, description, owner) "
+    "VALUES (new.id, new.name, new.description, new.owner); "
+    "END",
+)
+
+for statement in TODO_SEARCH_DDL:
+    event.listen(Todo.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+# the index would outlive its content table and return stale rows
+event.listen(Todo.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS todos_fts').execute_if(dialect='sqlite'))
+
+
+class TodoListVersion(Base):
+    """Per user counter bumped by every write to the user's todos
+
+    Validates the ETags of the todo listings without reading todos. The
+    version written to a todo is the counter after the bump, so (owner,
+    id, version) never repeats even when sqlite reuses a deleted id.
+    """
+    __tablename__ = 'todo_list_versions'
+
+    owner = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+# todo_stats owner of the counts of all users' todos, never a user id
+ALL_USERS = 0
+
+
+class TodoStats(Base):
+    """Per user todo counts, maintained by the crud write functions
+
+    Every write adds its difference to the owner's row and to the
+    ALL_USERS row in the transaction of the write, so reading the counts
+    is a primary key lookup. ``python -m app rebuild-todo-stats`` counts
+    them from todos again.
+    """
+    __tablename__ = 'todo_stats'
+
+    owner = Column(Integer, primary_key=True)
+    total = Column(Integer, nullable=False)
+    done = Column(Integer, nullable=False)
+
+
+class SchemaVersion(Base):
+    """Steps of app.internal.migrations.MIGRATIONS applied, one row
+
+    Written by ``python -m app migrate``, lets the app check the schema at
+    startup with one lookup.
+    """
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
 
 
 class Permissions(enum.Enum):
@@ -32,15 +135,36 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, unique=True)
+    # normalize_username(name), set along with name; names differing only
+    # in case share it
+    name_lower = Column(String)
     password = Column(String)
 
+    # comma joined permission values, still written for instances that
+    # don't read permission_mask yet
     _permissions = Column('permissions', String)
+    permission_mask = Column(Integer)
+
+    __table_args__ = (
+        # case-insensitive name prefix search, keyset paginated on
+        # (name_lower, id)
+        Index('ix_users_name_lower_id', 'name_lower', 'id'),
+    )
+
+    @validates('name')
+    def _set_name_lower(self, key: str, name: str | None) -> str | None:
+        self.name_lower = None if name is None else normalize_username(name)
+        return name
 
-    def get_permissions(self):
-        return self._permissions.split(',')
+    def get_permissions(self) -> list[int]:
+        if self.permission_mask is None:
+            # row not migrated by `python -m app migrate-permission-masks`
+            return [int(p) for p in self._permissions.split(',') if p]
+        return mask_to_permissions(self.permission_mask)
 
     def set_permissions(self, permissions: list[int]):
-        self._permissions = ','.join([str(i) for i in permissions])
+        self._permissions = ','.join([str(int(i)) for i in permissions])
+        self.permission_mask = permissions_to_mask(permissions)
 
     permissions = property(get_permissions, set_permissions, doc="permissions")
 
@@ -53,3 +177,5 @@ class RefreshToken(Base):
     token_child = Column(Text, ForeignKey('refresh_tokens.token'))
     not_after = Column(DateTime)
     active = Column(Boolean)
+    # shared by every token rotated from the same login
+    family_id = Column(String, index=True)
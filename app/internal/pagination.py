@@ -0,0 +1,99 @@
+import base64
+import binascii
+import json
+from typing import Callable
+from fastapi import HTTPException, Response
+
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(*keys) -> str:
+    """Encode the sort key of the last row of a page into an opaque cursor
+
+    Args:
+        *keys: json serializable sort key values, e.g. the row id
+
+    Returns:
+        str: url safe cursor
+    """
+    raw = json.dumps(keys, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Decode a cursor produced by ``encode_cursor``
+
+    Args:
+        cursor (str): cursor received from the client
+
+    Raises:
+        HTTPException: cursor is malformed
+
+    Returns:
+        list: sort key values
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        keys = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(keys, list) or not keys:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return keys
+
+
+def decode_key_cursor(cursor: str, key_type: type):
+    """Decode a cursor over a single column holding ``key_type`` values"""
+    keys = decode_cursor(cursor)
+    if len(keys) != 1 or type(keys[0]) is not key_type:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return keys[0]
+
+
+def decode_id_cursor(cursor: str) -> int:
+    """Decode a cursor over the ``id`` column"""
+    return decode_key_cursor(cursor, int)
+
+
+def decode_offset_cursor(cursor: str) -> int:
+    """Decode a cursor holding the offset of the next page"""
+    offset = decode_key_cursor(cursor, int)
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+
+def decode_name_cursor(cursor: str) -> tuple[str, int]:
+    """Decode a cursor over (name, id) of rows sorted by a non-unique name"""
+    keys = decode_cursor(cursor)
+    if len(keys) != 2 or not isinstance(keys[0], str) or \
+            not isinstance(keys[1], int) or isinstance(keys[1], bool):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return keys[0], keys[1]
+
+
+def paginate_by_key(rows: list, limit: int, response: Response,
+                    key: Callable) -> list:
+    """Trim a page fetched with ``limit + 1`` rows and set the next cursor
+
+    Args:
+        rows (list): rows in sort order, at most ``limit + 1`` of them
+        limit (int): page size requested by the client
+        response (Response): response to set the next cursor header on
+        key (Callable): sort key of a row, it's unique among the rows; a
+            tuple for keys of several columns
+
+    Returns:
+        list: the page
+    """
+    if len(rows) > limit > 0:
+        keys = key(rows[limit - 1])
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            *(keys if isinstance(keys, tuple) else (keys,)))
+    return rows[:max(limit, 0)]
+
+
+def paginate_by_id(rows: list, limit: int, response: Response) -> list:
+    """``paginate_by_key`` of rows ordered by id"""
+    return paginate_by_key(rows, limit, response, lambda row: row.id)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+import sqlalchemy
+from sqlalchemy.exc import OperationalError
+from starlette.concurrency import run_in_threadpool
+from .db import SessionLocal, get_engine
+from .models import RefreshToken
+from ..crud import delete_expired_refresh_tokens
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReapReport:
+    deleted: int
+    rows_before: int
+    rows_after: int
+    # bytes of the table and its indexes, None where sqlite's dbstat is
+    # not available
+    size_before: int | None
+    size_after: int | None
+    seconds: float
+
+
+def refresh_tokens_size() -> tuple[int, int | None]:
+    """Rows of refresh_tokens and bytes used by the table and its indexes"""
+    table = RefreshToken.__tablename__
+    engine = get_engine()
+    with engine.connect() as conn:
+        rows = conn.execute(sqlalchemy.select(sqlalchemy.func.count())
+                            .select_from(RefreshToken)).scalar()
+        if engine.dialect.name != 'sqlite':
+            return rows, None
+        try:
+            size = conn.execute(sqlalchemy.text(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                "(SELECT name FROM sqlite_master WHERE tbl_name = :table)"
+            ), {'table': table}).scalar()
+        except OperationalError:
+            size = None
+    return rows, size
+
+
+def reap_refresh_tokens(batch_size: int | None = None,
+                        pause: float | None = None) -> ReapReport:
+    """Delete refresh tokens of families that are fully past not_after
+
+    Every batch is its own short transaction, ``pause`` seconds apart;
+    both default to the token_reaper_* settings.
+    """
+    batch_size = config.token_reaper_batch_size if batch_size is None \
+        else batch_size
+    pause = config.token_reaper_pause if pause is None else pause
+    started = time.perf_counter()
+    rows_before, size_before = refresh_tokens_size()
+    now = datetime.now()
+    deleted = 0
+    after = ''
+    while after is not None:
+        with SessionLocal() as db:
+            batch_deleted, after = delete_expired_refresh_tokens(
+                db, now, batch_size, after)
+        deleted += batch_deleted
+        if after is not None and pause:
+            time.sleep(pause)
+    rows_after, size_after = refresh_tokens_size()
+    report = ReapReport(deleted, rows_before, rows_after, size_before,
+                        size_after, time.perf_counter() - started)
+    logger.info("Reaped expired refresh tokens", extra=vars(report))
+    return report
+
+
+class RefreshTokenReaper:
+    """Runs ``reap_refresh_tokens`` every ``interval`` seconds in the app
+
+    Without an interval it is read by ``configure`` when started.
+    """
+
+    def __init__(self, interval: int | None = None):
+        self.interval = interval
+        self.last_report: ReapReport | None = None
+        self._task: asyncio.Task | None = None
+
+    def configure(self, interval: int | None = None):
+        """Interval of the next start, by default token_reaper_interval"""
+        self.interval = interval if interval is not None \
+            else config.token_reaper_interval
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.last_report = await run_in_threadpool(reap_refresh_tokens)
+
+    async def start(self):
+        if self.interval is None:
+            self.configure()
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# configured by create_app, or when started
+refresh_token_reaper = RefreshTokenReaper()
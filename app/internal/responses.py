@@ -0,0 +1,45 @@
+"""JSON responses of todo rows that skip the response_model round trip
+
+FastAPI validates what a route returns against its response_model, turns
+it into plain data with jsonable_encoder and encodes that with the stdlib
+json module. Todo rows read from the database already are plain data of
+the right types, so with ``fast_read_responses`` the read routes hand
+them to ``FastJSONResponse`` as is. orjson encodes them if it's
+installed, the bytes are the same as those of JSONResponse either way.
+"""
+import json
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """Encode like starlette's JSONResponse
+
+    Only for dicts, lists, strings, ints, bools and None: orjson formats
+    some floats differently from the stdlib.
+    """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def fast_json_response(content, response: Response) -> FastJSONResponse:
+    """Response of ``content`` with the headers and status code set on the
+    route's ``response`` parameter, FastAPI ignores those for returned
+    responses"""
+    result = FastJSONResponse(content)
+    result.headers.raw.extend(response.headers.raw)
+    if response.status_code:
+        result.status_code = response.status_code
+    return result
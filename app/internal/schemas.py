@@ -1,4 +1,4 @@
-from enum import IntEnum
+from enum import Enum, IntEnum
 from pydantic import BaseModel, Field
 
 # from app.models import Permissions
@@ -10,11 +10,26 @@ class TodoSchema(BaseModel):
     description: str
     owner: int
     done: bool
+    version: int = 0
 
     class Config:
         orm_mode = True
 
 
+# keys of a todo in responses and exports, in order
+TODO_FIELDS = tuple(TodoSchema.__fields__)
+
+
+class TodoSortField(str, Enum):
+    id = 'id'
+    name = 'name'
+
+
+class SortOrder(str, Enum):
+    asc = 'asc'
+    desc = 'desc'
+
+
 class TodoCreateSchema(BaseModel):
     name: str
     description: str
@@ -26,6 +41,35 @@ class TodoUpdateSchema(BaseModel):
     done: bool | None = Field(None)
 
 
+class TodoBatchUpdateSchema(TodoUpdateSchema):
+    id: int
+
+
+class TodoBatchResultSchema(BaseModel):
+    status: int
+    todo: TodoSchema | None = None
+    error: str | None = None
+
+
+class TodoStatsSchema(BaseModel):
+    total: int = 0
+    done: int = 0
+    open: int = 0
+
+
+class TodoImportErrorSchema(BaseModel):
+    line: int
+    error: str
+
+
+class TodoImportResultSchema(BaseModel):
+    inserted: int = 0
+    duplicates: int = 0
+    errors: int = 0
+    # the first import_max_error_details errors
+    error_details: list[TodoImportErrorSchema] = []
+
+
 class UserPermissionsEnum(IntEnum):
     personal_read = 1
     personal_write = 2
@@ -33,6 +77,34 @@ class UserPermissionsEnum(IntEnum):
     admin = 100
 
 
+# bit of every permission in users.permission_mask and the "perm" claim,
+# the enum values themselves don't fit an integer column as bit positions
+PERMISSION_BITS = {
+    UserPermissionsEnum.personal_read: 1 << 0,
+    UserPermissionsEnum.personal_write: 1 << 1,
+    UserPermissionsEnum.users_listing: 1 << 2,
+    UserPermissionsEnum.admin: 1 << 3,
+}
+
+
+def permissions_to_mask(permissions) -> int:
+    """Bitmask of permission values, unknown values are ignored"""
+    mask = 0
+    for permission in permissions:
+        mask |= PERMISSION_BITS.get(int(permission), 0)
+    return mask
+
+
+def mask_to_permissions(mask: int) -> list[UserPermissionsEnum]:
+    return [permission for permission, bit in PERMISSION_BITS.items()
+            if mask & bit]
+
+
+def normalize_username(name: str) -> str:
+    """Case-insensitive form of a username, see users.name_lower"""
+    return name.lower()
+
+
 class UserDTOSchema(BaseModel):
     name: str
     raw_password: str
@@ -78,3 +150,9 @@ class UserFullSchema(BaseModel):
 
 class UserDTOSchemaAdmin(UserDTOSchema):
     permissions: list[UserPermissionsEnum]
+
+
+class UserBatchResultSchema(BaseModel):
+    status: int
+    user: UserSchema | None = None
+    error: str | None = None
@@ -1,103 +1,293 @@
+from operator import attrgetter, itemgetter
 from sqlite3 import IntegrityError
 import sqlalchemy.exc
-from sqlalchemy.orm import Session
-from fastapi import Depends, Response, HTTPException, APIRouter
+from fastapi import Body, Depends, Response, HTTPException, APIRouter, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from .internal.auth import authenticate_user_password, verify_auth_token
 from .internal.auth import generate_new_token_pair
-from .internal.auth import register_user
+from .internal.auth import register_user, require_permissions
 from .internal.schemas import TodoSchema, TodoCreateSchema, TodoUpdateSchema, UserPermissionsEnum
 from .internal.schemas import UserSchema
+from .internal.schemas import TodoBatchUpdateSchema, TodoBatchResultSchema
 from .internal.schemas import UserDTOSchema, TokenPair, TokenRefreshRequest
-from .internal.db import SessionLocal, Base, engine
-from app import crud
+from .internal.schemas import TodoImportResultSchema, TodoStatsSchema
+from .internal.schemas import SortOrder, TodoSortField
+from .internal.db import get_session, run_in_session
+from .internal.db import AnySession
+from .internal.pagination import decode_key_cursor, paginate_by_key
+from .internal.pagination import NEXT_CURSOR_HEADER, decode_offset_cursor
+from .internal.pagination import encode_cursor
+from .internal.conditional import ETAG_HEADER, if_match_versions
+from .internal.conditional import not_modified, todo_etag, todo_list_etag
+from .internal.responses import fast_json_response
+from .internal import config
+from app import acrud
+from app.crud import StaleVersionError
+from app.export import todo_export_response
+from app.importer import import_todos_from_request
 
 
-Base.metadata.create_all(bind=engine)
-
 main_router = APIRouter(prefix='/api')
 
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+can_read = require_permissions(UserPermissionsEnum.personal_read)
+can_write = require_permissions(UserPermissionsEnum.personal_write)
+can_read_write = require_permissions(UserPermissionsEnum.personal_read,
+                                     UserPermissionsEnum.personal_write)
 
 
 @main_router.get('/todos', response_model=list[TodoSchema])
-def get_todos_list(offset: int = 0,
-                   limit: int = 100,
-                   db: Session = Depends(get_db),
-                   token: dict[str, any] = Depends(verify_auth_token)):
+async def get_todos_list(request: Request,
+                         response: Response,
+                         offset: int = 0,
+                         limit: int = 100,
+                         cursor: str | None = None,
+                         done: bool | None = None,
+                         name_prefix: str | None = None,
+                         sort: TodoSortField = TodoSortField.id,
+                         order: SortOrder = SortOrder.asc,
+                         db: AnySession = Depends(get_session),
+                         token: dict[str, any] = Depends(can_read)):
+    """List user's todos
 
-    print(f"getting for user {token['sub']}")
-    permissions: list[str] = token['permissions']
-    if UserPermissionsEnum.personal_read not in permissions:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    Filter on ``done`` and on a ``name_prefix``, sort by ``id`` or ``name``
+    in ``asc`` or ``desc`` order. Pass the X-Next-Cursor header of a page as
+    ``cursor``, along with the same filters and sort, to get the next one.
+    ``offset`` is still accepted for old clients.
 
-    result = crud.get_todos_for_user(db, offset, limit, token['sub'])
-    return result
+    The ETag changes with every write to the user's todos, send it back in
+    ``If-None-Match`` to get a 304 while nothing changed.
+    """
+    key_type = str if sort == TodoSortField.name else int
+    after = decode_key_cursor(cursor, key_type) if cursor else None
+    etag = todo_list_etag(token['sub'], await acrud.get_todo_list_version(
+        db, token['sub']))
+    if unchanged := not_modified(request, etag):
+        return unchanged
+    response.headers[ETAG_HEADER] = etag
+    fast = config.fast_read_responses
+    list_todos = acrud.list_todo_rows_for_user if fast \
+        else acrud.list_todos_for_user
+    result = await list_todos(
+        db, token['sub'], limit + 1, offset=0 if cursor else offset,
+        after=after, done=done, name_prefix=name_prefix, sort=sort,
+        order=order)
+    key = itemgetter(sort.value) if fast else attrgetter(sort.value)
+    page = paginate_by_key(result, limit, response, key)
+    return fast_json_response(page, response) if fast else page
+
+
+# before /todos/{todo_id}, which would match "export" as well
+@main_router.get('/todos/export', response_class=StreamingResponse)
+async def export_todos(request: Request,
+                       db: AnySession = Depends(get_session),
+                       token: dict[str, any] = Depends(can_read)):
+    """Stream all of the user's todos as NDJSON, one todo per line
+
+    Gzip encoded for clients sending ``Accept-Encoding: gzip``. Answers
+    ``If-None-Match`` like the todo list.
+    """
+    etag = todo_list_etag(token['sub'], await acrud.get_todo_list_version(
+        db, token['sub']))
+    if unchanged := not_modified(request, etag):
+        return unchanged
+    response = todo_export_response(request, token['sub'], 'todos.ndjson')
+    response.headers[ETAG_HEADER] = etag
+    return response
+
+
+@main_router.get('/todos/stats', response_model=TodoStatsSchema)
+async def get_todo_stats(db: AnySession = Depends(get_session),
+                         token: dict[str, any] = Depends(can_read)):
+    """Amount of the user's todos, done and open"""
+    return await acrud.get_todo_stats(db, token['sub'])
+
+
+@main_router.get('/todos/search', response_model=list[TodoSchema])
+async def search_todos(request: Request,
+                       response: Response,
+                       q: str,
+                       limit: int = 20,
+                       cursor: str | None = None,
+                       db: AnySession = Depends(get_session),
+                       token: dict[str, any] = Depends(can_read)):
+    """Full-text search of the user's todo names and descriptions
+
+    Best matches first. Todos have to contain every word of ``q``, a
+    trailing ``*`` matches word prefixes. Pass the X-Next-Cursor header of
+    a page as ``cursor`` to get the next one. Ranks change with every
+    user's writes, so pages are positions in the ranking of the moment,
+    not a snapshot. Answers ``If-None-Match`` like the todo list.
+    """
+    offset = decode_offset_cursor(cursor) if cursor else 0
+    etag = todo_list_etag(token['sub'], await acrud.get_todo_list_version(
+        db, token['sub']))
+    if unchanged := not_modified(request, etag):
+        return unchanged
+    response.headers[ETAG_HEADER] = etag
+    fast = config.fast_read_responses
+    search = acrud.search_todo_rows if fast else acrud.search_todos
+    results = await search(db, q, limit + 1, token['sub'], offset)
+    if len(results) > limit > 0:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(offset + limit)
+    page = [todo for _, todo in results[:max(limit, 0)]]
+    return fast_json_response(page, response) if fast else page
+
+
+@main_router.post('/todos/import', response_model=TodoImportResultSchema)
+async def import_todos(request: Request,
+                       token: dict[str, any] = Depends(can_write)):
+    """Create todos from an NDJSON body, or CSV with ``Content-Type: text/csv``
+
+    Every row needs a name and a description, CSV files a header row.
+    The body is read as it arrives and inserted in chunks, so it may be
+    arbitrarily large; ``Content-Encoding: gzip`` bodies are accepted.
+    Returns the amount of inserted todos, skipped duplicate names and
+    invalid rows.
+    """
+    return await run_in_threadpool(import_todos_from_request, request,
+                                   token['sub'])
 
 
 @main_router.post('/todos', response_model=TodoSchema, status_code=201)
-def create_todo(todo: TodoCreateSchema,
-                response: Response,
-                db: Session = Depends(get_db),
-                token: dict[str, any] = Depends(verify_auth_token)):
-    permissions = token['permissions']
-    if UserPermissionsEnum.personal_write not in permissions:
-        raise HTTPException(status_code=403, detail="Not authorized")
+async def create_todo(todo: TodoCreateSchema,
+                      response: Response,
+                      db: AnySession = Depends(get_session),
+                      token: dict[str, any] = Depends(can_write)):
     try:
-        result = crud.create_todo(db, todo, token['sub'])
+        result = await acrud.create_todo(db, todo, token['sub'])
     except IntegrityError:
         raise HTTPException(status_code=400,
                             detail="Todo Name Exists in the user scope")
     resource_url = main_router.url_path_for('get_todo_by_id',
                                             todo_id=result.id)
     response.headers['Location'] = resource_url
+    response.headers[ETAG_HEADER] = todo_etag(result)
     return result
 
 
+def check_batch_size(items: list):
+    if len(items) > config.batch_max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch exceeds {config.batch_max_items} items")
+
+
+def batch_item_result(result, status: int = 200) -> TodoBatchResultSchema:
+    """Map a crud batch item result to its response entry"""
+    if isinstance(result, IntegrityError):
+        return TodoBatchResultSchema(
+            status=400, error="Todo Name Exists in the user scope")
+    if isinstance(result, LookupError):
+        return TodoBatchResultSchema(status=404, error="Not Found")
+    if isinstance(result, TodoSchema):
+        return TodoBatchResultSchema(status=status, todo=result)
+    return TodoBatchResultSchema(status=status)
+
+
+@main_router.post('/todos/batch',
+                  response_model=list[TodoBatchResultSchema])
+async def create_todos_batch(
+    todos: list[TodoCreateSchema],
+    db: AnySession = Depends(get_session),
+    token: dict[str, any] = Depends(can_write)
+):
+    check_batch_size(todos)
+    try:
+        results = await acrud.create_todos(db, todos, token['sub'])
+    except IntegrityError:
+        raise HTTPException(status_code=400,
+                            detail="Todo Name Exists in the user scope")
+    return [batch_item_result(r, status=201) for r in results]
+
+
+@main_router.patch('/todos/batch',
+                   response_model=list[TodoBatchResultSchema])
+async def update_todos_batch(
+    updates: list[TodoBatchUpdateSchema],
+    db: AnySession = Depends(get_session),
+    token: dict[str, any] = Depends(can_read_write)
+):
+    check_batch_size(updates)
+    try:
+        results = await acrud.update_todos(db, updates, token['sub'])
+    except IntegrityError:
+        raise HTTPException(status_code=400,
+                            detail="Todo Name Exists in the user scope")
+    return [batch_item_result(r) for r in results]
+
+
+@main_router.delete('/todos/batch',
+                    response_model=list[TodoBatchResultSchema])
+async def delete_todos_batch(
+    ids: list[int] = Body(...),
+    db: AnySession = Depends(get_session),
+    token: dict[str, any] = Depends(can_read_write)
+):
+    check_batch_size(ids)
+    results = await acrud.delete_todos(db, ids, token['sub'])
+    return [batch_item_result(r) for r in results]
+
+
 @main_router.get('/todos/{todo_id}', response_model=TodoSchema)
-def get_todo_by_id(todo_id: int,
-                   db: Session = Depends(get_db),
-                   token: dict[str, any] = Depends(verify_auth_token)):
-    permissions = token['permissions']
-    if UserPermissionsEnum.personal_read not in permissions:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    result = crud.get_todo_by_id(db, todo_id)
+async def get_todo_by_id(todo_id: int,
+                         request: Request,
+                         response: Response,
+                         db: AnySession = Depends(get_session),
+                         token: dict[str, any] = Depends(can_read)):
+    """Get a todo
+
+    The ETag changes with every write to the todo, send it back in
+    ``If-None-Match`` to get a 304, or in ``If-Match`` of a PUT or DELETE
+    to only apply it to this version of the todo.
+    """
+    result = await acrud.get_todo_by_id(db, todo_id, token['sub'])
+    if not result:
+        raise HTTPException(404, 'Not Found')
+    etag = todo_etag(result)
+    if unchanged := not_modified(request, etag):
+        return unchanged
+    response.headers[ETAG_HEADER] = etag
     return result
 
 
 @main_router.put('/todos/{todo_id}', response_model=TodoSchema)
-def update_todo_by_id(todo_id: int,
-                      update: TodoUpdateSchema,
-                      db: Session = Depends(get_db),
-                      token: dict[str, any] = Depends(verify_auth_token)):
-    permissions = token['permissions']
-    if UserPermissionsEnum.personal_read not in permissions or\
-       UserPermissionsEnum.personal_write not in permissions:
-        raise HTTPException(status_code=403, detail="Not authorized")
-
-    result = crud.update_todo_by_id(db, todo_id, update)
-    print(result.name, result.description)
+async def update_todo_by_id(todo_id: int,
+                            update: TodoUpdateSchema,
+                            request: Request,
+                            response: Response,
+                            db: AnySession = Depends(get_session),
+                            token: dict[str, any] = Depends(can_read_write)):
+    versions = if_match_versions(request, token['sub'], todo_id)
+    try:
+        result = await acrud.update_todo_by_id(db, todo_id, update,
+                                               token['sub'], versions)
+    except IntegrityError:
+        raise HTTPException(status_code=400,
+                            detail="Todo Name Exists in the user scope")
+    except StaleVersionError:
+        raise HTTPException(412, 'Precondition Failed')
+    if not result:
+        raise HTTPException(404, 'Not Found')
+    response.headers[ETAG_HEADER] = todo_etag(result)
     return result
 
 
 @main_router.delete('/todos/{todo_id}')
-def delete_todo_by_id(
+async def delete_todo_by_id(
     todo_id: int,
+    request: Request,
     response: Response,
-    db: Session = Depends(get_db),
-    token: dict[str, any] = Depends(verify_auth_token)
+    db: AnySession = Depends(get_session),
+    token: dict[str, any] = Depends(can_read_write)
 ):
-    # TODO check user write permissions
-    permissions = token['permissions']
-    if UserPermissionsEnum.personal_read not in permissions or\
-       UserPermissionsEnum.personal_write not in permissions:
-        raise HTTPException(status_code=403, detail="Not authorized")
-    if crud.delete_todo_by_id(db, todo_id) == 0:
+    versions = if_match_versions(request, token['sub'], todo_id)
+    try:
+        deleted = await acrud.delete_todo_by_id(db, todo_id, token['sub'],
+                                                versions)
+    except StaleVersionError:
+        raise HTTPException(412, 'Precondition Failed')
+    if deleted == 0:
         raise HTTPException(404, 'Not Found')
 
     response.status_code = 200
@@ -105,16 +295,19 @@ def delete_todo_by_id(
 
 
 @main_router.post('/auth/login', response_model=TokenPair)
-def login(user: UserDTOSchema, db: Session = Depends(get_db)):
-    token_pair = authenticate_user_password(db, user.name, user.raw_password)
+async def login(user: UserDTOSchema, db: AnySession = Depends(get_session)):
+    token_pair = await run_in_session(db, authenticate_user_password,
+                                      user.name, user.raw_password)
     return token_pair
 
 
 @main_router.post('/auth/register', response_model=UserSchema)
-def register(user: UserDTOSchema, db: Session = Depends(get_db)):
+async def register(user: UserDTOSchema,
+                   db: AnySession = Depends(get_session)):
     try:
-        user = register_user(
+        user = await run_in_session(
             db,
+            register_user,
             user.name,
             user.raw_password,
             permissions=[UserPermissionsEnum.personal_read,
@@ -127,12 +320,13 @@ def register(user: UserDTOSchema, db: Session = Depends(get_db)):
 
 
 @main_router.post('/auth/refresh_token', response_model=TokenPair)
-def refresh_token(token_refresh_request: TokenRefreshRequest,
-                  db: Session = Depends(get_db)):
-    token_pair = generate_new_token_pair(db, token_refresh_request)
+async def refresh_token(token_refresh_request: TokenRefreshRequest,
+                        db: AnySession = Depends(get_session)):
+    token_pair = await run_in_session(db, generate_new_token_pair,
+                                      token_refresh_request)
     return token_pair
 
 
 @main_router.get('/secret')
-def secret(token: dict[str, any] = Depends(verify_auth_token)):
+async def secret(token: dict[str, any] = Depends(verify_auth_token)):
     return token.get('name')
@@ -0,0 +1,120 @@
+"""Bulk creation of users with parallel password hashing
+
+Users are created ``provision_chunk_size`` at a time. Names that exist, or
+came earlier, are conflicts and their passwords are never hashed. The
+other passwords of the chunk are hashed in parallel by the hashing pool
+(``hash_passwords``), then the chunk is inserted in one transaction with
+``crud.create_users``. Hashing is nearly all of the cost, so throughput
+grows with ``hashing_workers``. Like the import, provisioning always
+writes through the sync engine; call it in the threadpool.
+"""
+import itertools
+from sqlite3 import IntegrityError
+from typing import Iterable, Iterator
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from app import crud
+from app.importer import _describe, csv_rows, ndjson_rows
+from app.internal import config
+from app.internal.db import SessionLocal
+from app.internal.hashing import hash_passwords
+from app.internal.schemas import UserDTOSchemaAdmin, UserInsertSchema
+from app.internal.schemas import UserSchema
+
+
+class ConcurrentNameError(IntegrityError):
+    """A name of the chunk was taken concurrently, no user of it was created"""
+
+
+def _provision_chunk(db: Session, users: list[UserDTOSchemaAdmin]
+                     ) -> list[UserSchema | IntegrityError]:
+    taken = set(crud.taken_user_names(db, list({u.name for u in users})))
+    new = []
+    for user in users:
+        if user.name not in taken:
+            taken.add(user.name)
+            new.append(user)
+    passwords = hash_passwords([user.raw_password for user in new])
+    created = iter(crud.create_users(db, [
+        UserInsertSchema(name=user.name, password=password,
+                         permissions=user.permissions)
+        for user, password in zip(new, passwords)]))
+    results = []
+    for user in users:
+        # a user of ``new`` is the first one with its name
+        if new and user is new[0]:
+            new.pop(0)
+            results.append(next(created))
+        else:
+            results.append(IntegrityError("Username already in use"))
+    return results
+
+
+def provision_users(users: Iterable[tuple[int, UserDTOSchemaAdmin]],
+                    chunk_size: int | None = None
+                    ) -> Iterator[tuple[int, UserSchema | IntegrityError]]:
+    """Create the users, yields a result per user as its chunk is committed
+
+    Args:
+        users (Iterable[tuple[int, UserDTOSchemaAdmin]]): key (index, line
+            number) and user, consumed a chunk at a time
+        chunk_size (int | None): users per transaction, default
+            provision_chunk_size
+
+    Returns:
+        Iterator[tuple[int, UserSchema | IntegrityError]]: key and created
+            user, or the name conflict; ConcurrentNameError for every user
+            of a chunk whose names were taken concurrently even on retry,
+            the chunks before and after it are created
+    """
+    users = iter(users)
+    chunk_size = chunk_size or config.provision_chunk_size
+    with SessionLocal() as db:
+        while chunk := list(itertools.islice(users, chunk_size)):
+            keys = [key for key, _ in chunk]
+            try:
+                results = _provision_chunk(db, [u for _, u in chunk])
+            except IntegrityError:
+                results = [ConcurrentNameError(
+                    "Names of the chunk were taken concurrently")] * len(chunk)
+            yield from zip(keys, results)
+
+
+def provision_users_from_file(text, body_format: str,
+                              chunk_size: int | None = None
+                              ) -> Iterator[tuple[int, object]]:
+    """``provision_users`` of an NDJSON or CSV file of users
+
+    Rows have the fields of UserDTOSchemaAdmin, CSV files a header row and
+    permission values separated by spaces.
+
+    Args:
+        text: text file
+        body_format (str): "ndjson" or "csv"
+        chunk_size (int | None): users per transaction
+
+    Returns:
+        Iterator[tuple[int, object]]: line number and created user, name
+            conflict, or a ValueError describing an invalid row; invalid
+            rows come before the chunk they were read with
+    """
+    invalid = []
+
+    def valid_rows():
+        rows = csv_rows(text) if body_format == 'csv' else ndjson_rows(text)
+        for line, row in rows:
+            if isinstance(row, Exception):
+                invalid.append((line, ValueError(_describe(row))))
+                continue
+            if body_format == 'csv':
+                row['permissions'] = (row.get('permissions') or '').split()
+            try:
+                yield line, UserDTOSchemaAdmin.parse_obj(row)
+            except ValidationError as e:
+                invalid.append((line, ValueError(_describe(e))))
+
+    for result in provision_users(valid_rows(), chunk_size):
+        yield from invalid
+        invalid.clear()
+        yield result
+    yield from invalid
@@ -0,0 +1,256 @@
+"""Prefork launcher of ``python -m app serve``
+
+The parent binds the listening socket, builds the app once (preload) and
+forks the workers, every worker runs a uvicorn server on the shared
+socket. The parent never serves requests, it only supervises:
+
+    SIGHUP            re-read the settings, build the app again, start a
+                      new generation of workers and stop the old one
+                      gracefully, the socket stays open meanwhile
+    SIGTTIN, SIGTTOU  one worker more, one less
+    SIGTERM, SIGINT   stop the workers gracefully, SIGKILL after
+                      graceful_timeout; a second SIGINT kills right away
+
+A worker that exits unexpectedly is replaced. A worker whose startup
+fails (e.g. the schema isn't migrated) stops the launcher.
+
+Every worker is its own process with its own memory:
+
+- a per process cache_backend would serve reads another worker's write
+  made stale, with more than one worker the cache is turned off unless
+  the backend is shared (e.g. redis)
+- only one worker runs the refresh token reaper
+- each worker's hashing pool gets its share of hashing_workers, as of
+  the worker count when it was started
+- the metrics of /metrics are those of the worker that answered, labeled
+  with its pid
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+import uvicorn
+from app import create_app
+from app.internal import config, metrics
+from app.internal.config import Config
+from app.internal.hashing import hashing_executor
+from app.internal.reaper import refresh_token_reaper
+
+# exit code of a worker whose app startup failed
+WORKER_BOOT_FAILED = 3
+
+SIGNALS = {signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGTTIN,
+           signal.SIGTTOU, signal.SIGCHLD}
+
+# dogpile backends whose entries live in the process
+PROCESS_LOCAL_CACHES = {'dogpile.cache.memory', 'dogpile.cache.memory_pickle'}
+
+
+def bind(host: str, port: int, backlog: int) -> socket.socket:
+    """Listening TCP socket, shared by all workers"""
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return socket.create_server((host, port), family=family, backlog=backlog)
+
+
+def log(message: str):
+    print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+class Supervisor:
+    """Forks and watches the workers, see the module docstring
+
+    Args:
+        sock (socket.socket): listening socket
+        workers (int): number of workers to keep running
+        backlog (int): listen backlog, handed to uvicorn
+        graceful_timeout (float): seconds a stopped worker may take to
+            finish its requests before it is killed
+    """
+
+    def __init__(self, sock: socket.socket, workers: int, backlog: int,
+                 graceful_timeout: float):
+        self.sock = sock
+        self.target = max(1, workers)
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.api = None
+        # the app of ``api`` caches in the process
+        self.local_cache = False
+        # worker of the current generation that runs the reaper
+        self.reaper_pid: int | None = None
+        # pid -> fork time of the current generation
+        self.workers: dict[int, float] = {}
+        # pid -> kill deadline of the workers being stopped
+        self.stopping: dict[int, float] = {}
+        self.shutting_down = False
+        self.exit_code = 0
+
+    def load(self):
+        """Build the app in the parent, the workers inherit it"""
+        # a reload leaves the previous app to the collector
+        gc.unfreeze()
+        self.local_cache = config.cache_backend in PROCESS_LOCAL_CACHES
+        if self.local_cache and self.target > 1:
+            log(f"{config.cache_backend} is per process, caching is off "
+                f"with {self.target} workers")
+            config.cache_backend = 'dogpile.cache.null'
+            self.local_cache = False
+        self.api = create_app()
+        # keep the preloaded objects out of the collector's reach, so the
+        # workers' collections don't copy the shared pages
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self):
+        reaper = self.reaper_pid not in self.workers
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(reaper)
+        self.workers[pid] = time.monotonic()
+        if reaper:
+            self.reaper_pid = pid
+        log(f"started worker {pid}")
+
+    def _run_worker(self, reaper: bool):
+        code = 1
+        try:
+            signal.pthread_sigmask(signal.SIG_SETMASK, set())
+            if not reaper:
+                refresh_token_reaper.configure(0)
+            # create_app sized the pool for the whole machine
+            if hashing_executor.workers > 0:
+                hashing_executor.configure(
+                    max(1, hashing_executor.workers // self.target))
+            metrics.worker = str(os.getpid())
+            server = uvicorn.Server(uvicorn.Config(
+                self.api, lifespan='on', backlog=self.backlog,
+                log_config=None, access_log=False))
+            server.run(sockets=[self.sock])
+            code = 0 if server.started else WORKER_BOOT_FAILED
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # never return into the parent's loop, nor run its atexit
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def stop(self, pid: int, sig: int = signal.SIGTERM):
+        self.workers.pop(pid, None)
+        self.stopping.setdefault(pid,
+                                 time.monotonic() + self.graceful_timeout)
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reload(self):
+        log("reloading")
+        Config.instance.reload()
+        self.replace_workers()
+
+    def replace_workers(self):
+        """Build the app again and hand over to a new generation"""
+        self.load()
+        old = list(self.workers)
+        self.reaper_pid = None
+        for _ in range(self.target):
+            self.spawn()
+        # the old generation finishes its requests, new connections wait
+        # in the backlog for the new one
+        for pid in old:
+            self.stop(pid)
+
+    def handle(self, sig: int):
+        if sig in (signal.SIGTERM, signal.SIGINT):
+            if self.shutting_down and sig == signal.SIGINT:
+                for pid in list(self.stopping):
+                    self.stop(pid, signal.SIGKILL)
+            self.shutting_down = True
+            for pid in list(self.workers):
+                self.stop(pid)
+        elif self.shutting_down:
+            return
+        elif sig == signal.SIGHUP:
+            self.reload()
+        elif sig == signal.SIGTTIN:
+            self.target += 1
+            if self.local_cache:
+                # the running worker's cache would go stale, the new
+                # generation runs without it
+                self.replace_workers()
+        elif sig == signal.SIGTTOU:
+            self.target = max(1, self.target - 1)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping.pop(pid, None) is not None:
+                log(f"worker {pid} stopped")
+            elif self.workers.pop(pid, None) is not None:
+                log(f"worker {pid} exited with {code}")
+                if code == WORKER_BOOT_FAILED and not self.shutting_down:
+                    log("worker failed to start, shutting down")
+                    self.exit_code = 1
+                    self.handle(signal.SIGTERM)
+
+    def scale(self):
+        if self.shutting_down:
+            return
+        while len(self.workers) < self.target:
+            self.spawn()
+        while len(self.workers) > self.target:
+            # the newest one, never the reaper
+            self.stop(max(set(self.workers) - {self.reaper_pid},
+                          key=self.workers.get))
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.stopping.items()):
+            if deadline <= now:
+                log(f"worker {pid} didn't stop in time, killing it")
+                self.stopping[pid] = float('inf')
+                os.kill(pid, signal.SIGKILL)
+
+    def run(self) -> int:
+        """Supervise until stopped
+
+        Returns:
+            int: exit code of the launcher
+        """
+        # signals are taken one at a time by sigtimedwait, nothing runs
+        # inside a handler
+        signal.pthread_sigmask(signal.SIG_BLOCK, SIGNALS)
+        self.load()
+        host, port = self.sock.getsockname()[:2]
+        log(f"listening on {host}:{port}")
+        while not self.shutting_down or self.workers or self.stopping:
+            self.reap()
+            self.scale()
+            self.kill_overdue()
+            info = signal.sigtimedwait(SIGNALS, 1.0)
+            if info is not None and info.si_signo != signal.SIGCHLD:
+                self.handle(info.si_signo)
+        self.sock.close()
+        log("stopped")
+        return self.exit_code
+
+
+def serve(host: str, port: int, workers: int, backlog: int,
+          graceful_timeout: float) -> int:
+    """Bind, preload and supervise the workers, see Supervisor
+
+    Returns:
+        int: exit code, 1 if a worker failed to start
+    """
+    sock = bind(host, port, backlog)
+    return Supervisor(sock, workers, backlog, graceful_timeout).run()
@@ -0,0 +1,93 @@
+"""Throughput of the sync and async database paths at high concurrency
+
+Every mode runs in its own process because the database mode is read from
+the config when the app is imported.
+
+    python benchmarks/bench_async.py --concurrency 200 --requests 5000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+
+import common
+
+
+def seed(todos: int):
+    from app import crud
+    from app.internal.auth import register_user
+    from app.internal.db import Base, SessionLocal, engine
+    from app.internal.schemas import TodoCreateSchema, UserPermissionsEnum
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = register_user(db, 'bench', 'bench',
+                             permissions=[UserPermissionsEnum.personal_read,
+                                          UserPermissionsEnum.personal_write])
+        for i in range(todos):
+            crud.create_todo(db, TodoCreateSchema(name=f'todo-{i}',
+                                                  description='benchmark'),
+                             user.id)
+
+
+async def measure(args) -> dict:
+    from app import api
+    from app.internal.db import dispose_engines
+    client = common.AsgiClient(api)
+    _, _, body = await client.request('POST', '/api/auth/login', json_body={
+        'name': 'bench', 'raw_password': 'bench'})
+    headers = {'authorization': f"Token {json.loads(body)['auth_token']}"}
+
+    async def list_todos():
+        status, _, _ = await client.request('GET', '/api/todos?limit=20',
+                                            headers=headers)
+        return status
+
+    # warm up the pools before measuring
+    await common.run_load(list_todos, 10, 50)
+    result = await common.run_load(list_todos, args.concurrency,
+                                   args.requests)
+    await dispose_engines()
+    return result
+
+
+def worker(args):
+    common.prepare_workdir(database_async=args.mode == 'async')
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        seed(args.todos)
+        result = asyncio.run(measure(args))
+    result['mode'] = args.mode
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--todos', type=int, default=100)
+    parser.add_argument('--mode', choices=['sync', 'async'])
+    args = parser.parse_args()
+    if args.mode:
+        return worker(args)
+
+    print(f"{'mode':<6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>7}")
+    for mode in ('sync', 'async'):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--concurrency', str(args.concurrency),
+             '--requests', str(args.requests), '--todos', str(args.todos)],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{mode:<6} {result['rps']:>9} {result['p50_ms']:>9} "
+              f"{result['p95_ms']:>9} {result['p99_ms']:>9} "
+              f"{result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
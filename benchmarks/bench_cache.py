@@ -0,0 +1,98 @@
+"""Polling latency of the todo read endpoints with and without the cache
+
+Clients poll ``GET /api/todos`` and ``GET /api/todos/{id}``, every
+``--write-every``th request updates a todo, which invalidates the user's
+cached reads. Each backend runs in its own process with its own settings
+file and scratch database.
+
+    python benchmarks/bench_cache.py --requests 5000 --write-every 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+
+import common
+from bench_async import seed
+
+
+BACKENDS = {'memory': 'dogpile.cache.memory', 'null': 'dogpile.cache.null'}
+
+
+async def measure(args) -> dict:
+    from app import api
+    from app.internal.cache import cache_stats
+    client = common.AsgiClient(api)
+    _, _, body = await client.request('POST', '/api/auth/login', json_body={
+        'name': 'bench', 'raw_password': 'bench'})
+    headers = {'authorization': f"Token {json.loads(body)['auth_token']}"}
+    _, _, body = await client.request('GET', '/api/todos?limit=1000',
+                                      headers=headers)
+    ids = [todo['id'] for todo in json.loads(body)]
+    counter = itertools.count()
+
+    async def poll():
+        n = next(counter)
+        todo_id = ids[n % len(ids)]
+        if args.write_every and n % args.write_every == 0:
+            status, _, _ = await client.request(
+                'PUT', f'/api/todos/{todo_id}', headers=headers,
+                json_body={'done': n % 2 == 0})
+        elif n % 2:
+            status, _, _ = await client.request('GET', '/api/todos?limit=20',
+                                                headers=headers)
+        else:
+            status, _, _ = await client.request('GET', f'/api/todos/{todo_id}',
+                                                headers=headers)
+        return status
+
+    await common.run_load(poll, 10, 50)
+    cache_stats.clear()
+    result = await common.run_load(poll, args.concurrency, args.requests)
+    result.update(cache_stats.as_dict())
+    return result
+
+
+def worker(args):
+    common.prepare_workdir(cache_backend=BACKENDS[args.backend])
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        seed(args.todos)
+        result = asyncio.run(measure(args))
+    result['backend'] = args.backend
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--todos', type=int, default=100)
+    parser.add_argument('--write-every', type=int, default=20)
+    parser.add_argument('--backend', choices=list(BACKENDS))
+    args = parser.parse_args()
+    if args.backend:
+        return worker(args)
+
+    print(f"{'backend':<8} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'hit %':>6} {'hit ms':>7} {'miss ms':>8}")
+    for backend in BACKENDS:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--backend', backend,
+             '--concurrency', str(args.concurrency),
+             '--requests', str(args.requests), '--todos', str(args.todos),
+             '--write-every', str(args.write_every)],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{backend:<8} {result['rps']:>8} {result['p50_ms']:>8} "
+              f"{result['p99_ms']:>8} {result['hit_ratio'] * 100:>6.1f} "
+              f"{result['avg_hit_ms']:>7.3f} {result['avg_miss_ms']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
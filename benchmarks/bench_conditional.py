@@ -0,0 +1,73 @@
+"""Cost of a poll of GET /api/todos with and without If-None-Match
+
+One user with ``--todos`` todos polls the first page of ``--limit`` todos
+through the ASGI app. Plain polls run the query (or the cache lookup),
+validate and serialize the page every time. Conditional polls send the
+ETag of the previous response back and get a 304. Run with the cache
+backend from config.yaml and with ``--no-cache``.
+
+    python benchmarks/bench_conditional.py --todos 1000 --limit 100
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+
+import common
+
+
+async def measure(client, args) -> list[tuple]:
+    async def login() -> dict:
+        _, _, body = await client.request('POST', '/api/auth/login', json_body={
+            'name': 'bench-0', 'raw_password': 'bench'})
+        return {'authorization': f"Token {json.loads(body)['auth_token']}"}
+
+    headers = await login()
+    url = f'/api/todos?limit={args.limit}'
+    _, response_headers, body = await client.request('GET', url,
+                                                     headers=headers)
+    etag = response_headers['etag']
+    sizes = {'plain': len(body), 'if-none-match': 0}
+    rows = []
+    for mode, request_headers in (
+            ('plain', headers),
+            ('if-none-match', {**headers, 'if-none-match': etag})):
+        async def poll():
+            status, _, _ = await client.request('GET', url,
+                                                headers=request_headers)
+            return 200 if status == 304 else status
+        result = await common.run_load(poll, args.concurrency, args.requests)
+        rows.append((mode, result, sizes[mode]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--todos', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    overrides = {'cache_backend': 'dogpile.cache.null'} if args.no_cache else {}
+    common.prepare_workdir(**overrides)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import suite
+        common.quiet_engines()
+        from app import api
+        from app.internal.db import Base, engine
+        Base.metadata.create_all(bind=engine)
+    suite.seed(1, args.todos)
+
+    rows = asyncio.run(measure(common.AsgiClient(api), args))
+    print(f"{'poll':<14} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'body bytes':>11}")
+    for mode, result, size in rows:
+        print(f"{mode:<14} {result['rps']:>8.0f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {size:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Peak memory of the streaming export against reading all todos at once
+
+For each size one user gets that many todos, then the whole set is read
+once through ``todo_export_chunks`` and once as a single
+``get_todos_for_user`` page serialized to JSON. Peak memory is measured
+with tracemalloc, so it only covers Python allocations.
+
+    python benchmarks/bench_export.py --sizes 10000 100000 300000
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+
+import common
+
+
+def seed(user_id: int, todos: int):
+    from sqlalchemy import insert
+    from app.internal.db import SessionLocal
+    from app.internal.models import Todo
+
+    with SessionLocal() as db:
+        for start in range(0, todos, 10000):
+            db.execute(insert(Todo.__table__), [
+                {'name': f'todo-{i}', 'description': 'benchmark',
+                 'done': False, 'owner': user_id}
+                for i in range(start, min(todos, start + 10000))])
+        db.commit()
+
+
+def measure(fn) -> tuple[float, float, int]:
+    """Seconds, peak MiB and bytes produced of ``fn()``"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 2 ** 20, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 300000])
+    args = parser.parse_args()
+
+    common.prepare_workdir()
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        from app.crud import get_todos_for_user
+        from app.export import todo_export_chunks
+        from app.internal.cache import invalidate_all
+        from app.internal.db import SessionLocal
+
+    def export(user_id):
+        return sum(len(chunk) for chunk in todo_export_chunks(user_id))
+
+    def materialized(user_id):
+        invalidate_all()
+        with SessionLocal() as db:
+            todos = get_todos_for_user(db, 0, -1, user_id)
+            return len(json.dumps([todo.dict() for todo in todos]))
+
+    print(f"{'todos':>8} {'mode':<13} {'seconds':>8} {'peak MiB':>9} "
+          f"{'MiB out':>8}")
+    for user_id, size in enumerate(args.sizes, start=1):
+        seed(user_id, size)
+        for mode, fn in (('export', export), ('materialized', materialized)):
+            elapsed, peak, produced = measure(lambda: fn(user_id))
+            print(f"{size:>8} {mode:<13} {elapsed:>8.2f} {peak:>9.1f} "
+                  f"{produced / 2 ** 20:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Read latency during a login storm, bcrypt inline vs the hashing pool
+
+Every mode runs in its own process because the hashing settings are read
+from the config when the app is imported.
+
+    python benchmarks/bench_hashing.py --logins 50 --readers 20
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+
+import common
+
+
+MODES = {
+    'inline': {'hashing_workers': 0},
+    'pool': {'hashing_workers': None},
+}
+
+
+def seed():
+    from app import crud
+    from app.internal.auth import register_user
+    from app.internal.db import Base, SessionLocal, engine
+    from app.internal.schemas import TodoCreateSchema, UserPermissionsEnum
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        user = register_user(db, 'bench', 'bench',
+                             permissions=[UserPermissionsEnum.personal_read,
+                                          UserPermissionsEnum.personal_write])
+        for i in range(20):
+            crud.create_todo(db, TodoCreateSchema(name=f'todo-{i}',
+                                                  description='benchmark'),
+                             user.id)
+
+
+async def measure(args) -> dict:
+    from app import api
+    from app.internal.db import dispose_engines
+    from app.internal.hashing import hashing_executor
+    client = common.AsgiClient(api)
+    credentials = {'name': 'bench', 'raw_password': 'bench'}
+    _, _, body = await client.request('POST', '/api/auth/login',
+                                      json_body=credentials)
+    headers = {'authorization': f"Token {json.loads(body)['auth_token']}"}
+
+    async def list_todos():
+        status, _, _ = await client.request('GET', '/api/todos?limit=20',
+                                            headers=headers)
+        return status
+
+    storm = True
+    logins = {'ok': 0, 'rejected': 0}
+
+    async def login_loop():
+        while storm:
+            status, _, _ = await client.request('POST', '/api/auth/login',
+                                                json_body=credentials)
+            if status == 503:
+                logins['rejected'] += 1
+                # clients back off on Retry-After
+                await asyncio.sleep(0.05)
+            else:
+                logins['ok'] += 1
+
+    await common.run_load(list_todos, 5, 50)
+    stormers = [asyncio.create_task(login_loop()) for _ in range(args.logins)]
+    await asyncio.sleep(0.5)
+    result = await common.run_load(list_todos, args.readers, args.requests)
+    storm = False
+    await asyncio.gather(*stormers)
+    result.update(logins)
+    await dispose_engines()
+    hashing_executor.shutdown()
+    return result
+
+
+def worker(args):
+    common.prepare_workdir(bcrypt_rounds=args.rounds, **MODES[args.mode])
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        seed()
+        result = asyncio.run(measure(args))
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=50,
+                        help='concurrent clients logging in in a loop')
+    parser.add_argument('--readers', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='reads to measure')
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='bcrypt cost')
+    parser.add_argument('--mode', choices=list(MODES))
+    args = parser.parse_args()
+    if args.mode:
+        return worker(args)
+
+    print(f"{'mode':<7} {'read rps':>9} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'logins':>7} {'503s':>6}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--logins', str(args.logins), '--readers', str(args.readers),
+             '--requests', str(args.requests), '--rounds', str(args.rounds)],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{mode:<7} {result['rps']:>9} {result['p50_ms']:>9} "
+              f"{result['p99_ms']:>9} {result['ok']:>7} "
+              f"{result['rejected']:>6}")
+
+
+if __name__ == '__main__':
+    main()
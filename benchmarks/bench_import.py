@@ -0,0 +1,71 @@
+"""Throughput and peak memory of the streaming import
+
+Imports an NDJSON file of each size with ``import_todos`` reading from
+disk, and creates ``--single`` todos one ``crud.create_todo`` call at a
+time for comparison. Peak memory is measured with tracemalloc.
+
+    python benchmarks/bench_import.py --sizes 10000 100000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+import tracemalloc
+
+import common
+
+
+def write_ndjson(path: str, rows: int, prefix: str):
+    with open(path, 'w') as fd:
+        for i in range(rows):
+            fd.write(json.dumps({'name': f'{prefix}-{i}',
+                                 'description': 'benchmark'}) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--single', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = common.prepare_workdir()
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        from app.crud import create_todo
+        from app.importer import import_todos
+        from app.internal.db import Base, SessionLocal, engine
+        from app.internal.schemas import TodoCreateSchema
+        Base.metadata.create_all(bind=engine)
+
+    print(f"{'mode':<8} {'todos':>8} {'seconds':>8} {'todos/s':>9} "
+          f"{'peak MiB':>9}")
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        for i in range(args.single):
+            create_todo(db, TodoCreateSchema(name=f'single-{i}',
+                                             description='benchmark'), 1)
+    elapsed = time.perf_counter() - started
+    print(f"{'single':<8} {args.single:>8} {elapsed:>8.2f} "
+          f"{args.single / elapsed:>9.0f} {'-':>9}")
+
+    for user_id, size in enumerate(args.sizes, start=2):
+        path = os.path.join(workdir, f'import-{size}.ndjson')
+        write_ndjson(path, size, f'import-{user_id}')
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(path, 'rb', buffering=0) as body:
+            result = import_todos(body, 'ndjson', user_id, args.chunk_size)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert result.inserted == size, result
+        print(f"{'import':<8} {size:>8} {elapsed:>8.2f} "
+              f"{size / elapsed:>9.0f} {peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
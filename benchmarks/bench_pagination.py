@@ -0,0 +1,74 @@
+"""Page latency of offset and keyset (cursor) pagination by page depth
+
+    python benchmarks/bench_pagination.py --pages 10000 --limit 100
+"""
+import argparse
+import statistics
+import time
+
+import common
+
+
+def seed(total: int, owner: int):
+    from sqlalchemy import insert
+    from app.internal.db import Base, engine
+    from app.internal.models import Todo
+
+    Base.metadata.create_all(bind=engine)
+    batch = 50_000
+    with engine.begin() as conn:
+        for start in range(0, total, batch):
+            rows = []
+            for i in range(start, min(start + batch, total)):
+                # interleave a second owner so the owner filter does work
+                rows.append({'name': f'todo-{i}', 'description': 'benchmark',
+                             'done': False, 'owner': owner})
+                rows.append({'name': f'other-{i}', 'description': 'benchmark',
+                             'done': False, 'owner': owner + 1})
+            conn.execute(insert(Todo), rows)
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=10_000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    common.prepare_workdir()
+    common.quiet_engines()
+    from app import crud
+    from app.internal.db import SessionLocal
+
+    owner = 1
+    seed(args.pages * args.limit, owner)
+    with SessionLocal() as db:
+        # ids of the owner's rows in order, the cursor of page n is the id
+        # of the last row of page n - 1
+        first_id = crud.get_todos_for_user(db, 0, 1, owner)[0].id
+        step = 2
+
+        print(f"{'page':>7} {'offset ms':>10} {'cursor ms':>10}")
+        page = 1
+        while page <= args.pages:
+            offset = (page - 1) * args.limit
+            after_id = first_id + (offset - 1) * step if offset else 0
+            offset_ms = timed(lambda: crud.get_todos_for_user(
+                db, offset, args.limit, owner), args.repeat)
+            cursor_ms = timed(lambda: crud.get_todos_for_user_after(
+                db, after_id, args.limit, owner), args.repeat)
+            print(f"{page:>7} {offset_ms:>10.2f} {cursor_ms:>10.2f}")
+            page *= 10
+
+
+if __name__ == '__main__':
+    main()
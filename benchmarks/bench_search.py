@@ -0,0 +1,159 @@
+"""Latency of full-text search against a LIKE scan at 1M todos
+
+Seeds ``--todos`` todos over ``--users`` users with names and descriptions
+drawn from a Zipf-like vocabulary, so there are common and rare words. Each
+query word is searched for one user's first page of 20 results through
+``crud.search_todos`` and with ``name LIKE '%word%' OR description LIKE
+'%word%'`` on the user's todos. Also reports the cost of the index: the
+rebuild time, its size and the insert rate with and without the triggers,
+as one executemany and as multi-row INSERTs like ``crud.create_todos``.
+
+    python benchmarks/bench_search.py --todos 1000000 --users 10
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import random
+import time
+
+import common
+
+
+LIKE_PAGE = """
+    SELECT id, name, description, owner, done FROM todos
+    WHERE owner = :owner
+      AND (name LIKE :pattern OR description LIKE :pattern)
+    ORDER BY id LIMIT :limit
+"""
+
+
+def vocabulary(size: int) -> tuple[list[str], list[float]]:
+    rng = random.Random(1)
+    words = {''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                     for _ in range(rng.randint(4, 9))) for _ in range(size)}
+    words = sorted(words)
+    weights = itertools.accumulate(1 / (rank + 1) for rank in range(len(words)))
+    return words, list(weights)
+
+
+def rows(start: int, count: int, users: int, words, weights):
+    rng = random.Random(start)
+    for i in range(start, start + count):
+        name = rng.choices(words, cum_weights=weights, k=3)
+        yield {'name': f"{' '.join(name)} {i}",
+               'description': ' '.join(
+                   rng.choices(words, cum_weights=weights, k=12)),
+               'done': False, 'owner': i % users + 1}
+
+
+def seed(engine, todos: int, users: int, words, weights):
+    from sqlalchemy import insert, text
+    from app.internal.models import TODO_SEARCH_TRIGGERS, Todo
+
+    with engine.begin() as conn:
+        for trigger in TODO_SEARCH_TRIGGERS:
+            conn.execute(text(f'DROP TRIGGER {trigger}'))
+        for start in range(0, todos, 50000):
+            conn.execute(insert(Todo.__table__),
+                         list(rows(start, min(50000, todos - start), users,
+                                   words, weights)))
+
+
+def insert_rate(engine, count: int, users: int, words, weights,
+                multirow: bool) -> float:
+    """Todos/s of an executemany or of multi-row INSERTs of 500 rows, the
+    rows are deleted again"""
+    from sqlalchemy import func, insert, select
+    from app.internal.models import Todo
+
+    batch = list(rows(0, count, users, words, weights))
+    for row in batch:
+        row['name'] += ' extra'
+    with engine.connect() as conn:
+        last_id = conn.execute(select(func.max(Todo.id))).scalar()
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if multirow:
+            for start in range(0, count, 500):
+                chunk = batch[start:start + 500]
+                conn.exec_driver_sql(
+                    'INSERT INTO todos (name, description, done, owner) '
+                    'VALUES ' + ', '.join(['(?, ?, ?, ?)'] * len(chunk)),
+                    tuple(row[c] for row in chunk
+                          for c in ('name', 'description', 'done', 'owner')))
+        else:
+            conn.execute(insert(Todo.__table__), batch)
+    elapsed = time.perf_counter() - started
+    with engine.begin() as conn:
+        conn.execute(Todo.__table__.delete().where(Todo.id > last_id))
+    return count / elapsed
+
+
+def timed(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--todos', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--words', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    common.prepare_workdir(cache_backend='dogpile.cache.null')
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        from sqlalchemy import text
+        from app.crud import search_todos
+        from app.internal.db import Base, SessionLocal, engine
+        from app.internal.migrations import rebuild_todo_search
+        Base.metadata.create_all(bind=engine)
+
+    words, weights = vocabulary(args.words)
+    started = time.perf_counter()
+    seed(engine, args.todos, args.users, words, weights)
+    print(f"seeded {args.todos} todos in {time.perf_counter() - started:.1f}s")
+
+    before = [insert_rate(engine, 20000, args.users, words, weights, multirow)
+              for multirow in (False, True)]
+    started = time.perf_counter()
+    rebuild_todo_search(engine)
+    print(f"rebuilt the index in {time.perf_counter() - started:.1f}s")
+    with engine.connect() as conn:
+        size = conn.execute(text(
+            "SELECT sum(pgsize) FROM dbstat WHERE name LIKE 'todos_fts%'"
+        )).scalar()
+        table = conn.execute(text(
+            "SELECT sum(pgsize) FROM dbstat WHERE name = 'todos'")).scalar()
+    print(f"index {size / 2 ** 20:.0f} MiB, todos table {table / 2 ** 20:.0f} MiB")
+    after = [insert_rate(engine, 20000, args.users, words, weights, multirow)
+             for multirow in (False, True)]
+    print(f"inserts/s without triggers: executemany {before[0]:.0f}, "
+          f"multi-row {before[1]:.0f}")
+    print(f"inserts/s with triggers: executemany {after[0]:.0f}, "
+          f"multi-row {after[1]:.0f}")
+
+    # most common, middle and rare words, plus a prefix
+    picks = [words[0], words[10], words[len(words) // 2], words[-1],
+             words[0][:3] + '*']
+    print(f"\n{'query':<12} {'fts ms':>8} {'like ms':>9} {'hits':>6}")
+    with SessionLocal() as db:
+        for word in picks:
+            fts = timed(lambda: search_todos(db, word, 20, 1), args.repeat)
+            pattern = f"%{word.rstrip('*')}%"
+            like = timed(lambda: db.execute(text(LIKE_PAGE), {
+                'owner': 1, 'pattern': pattern, 'limit': 20}).all(),
+                args.repeat)
+            hits = len(search_todos(db, word, 20, 1))
+            print(f"{word:<12} {fts:>8.2f} {like:>9.2f} {hits:>6}")
+
+
+if __name__ == '__main__':
+    main()
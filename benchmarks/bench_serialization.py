@@ -0,0 +1,93 @@
+"""Latency of GET /api/todos by page size and serialization path
+
+One user with the largest ``--pages`` worth of todos fetches a page of
+each size through the ASGI app:
+
+    validated  response_model validation, jsonable_encoder, stdlib json
+    fast json  ``fast_read_responses`` with the stdlib encoder
+    orjson     ``fast_read_responses`` with orjson, if installed
+
+The bodies of all paths are compared byte for byte. Runs with the cache
+backend from config.yaml, ``--no-cache`` reads every page from sqlite.
+
+    python benchmarks/bench_serialization.py --pages 100 1000 10000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import statistics
+import time
+
+import common
+
+
+async def fetch_times(client, url: str, headers: dict,
+                      repeat: int) -> tuple[float, bytes]:
+    samples = []
+    body = b''
+    for _ in range(repeat + 1):
+        started = time.perf_counter()
+        status, _, body = await client.request('GET', url, headers=headers)
+        samples.append(time.perf_counter() - started)
+        assert status == 200, status
+    # the first request fills the cache
+    return statistics.median(samples[1:]) * 1000, body
+
+
+async def measure(client, args) -> tuple[list[str], list[tuple]]:
+    from app.internal import config, responses
+
+    _, _, body = await client.request('POST', '/api/auth/login', json_body={
+        'name': 'bench-0', 'raw_password': 'bench'})
+    headers = {'authorization': f"Token {json.loads(body)['auth_token']}"}
+    orjson = responses.orjson
+    modes = [('validated', False, None), ('fast json', True, None)]
+    if orjson is not None:
+        modes.append(('orjson', True, orjson))
+
+    rows = []
+    for size in args.pages:
+        url = f'/api/todos?limit={size}'
+        times, bodies = [], set()
+        for _, fast, encoder in modes:
+            config.fast_read_responses = fast
+            responses.orjson = encoder
+            ms, body = await fetch_times(client, url, headers, args.repeat)
+            times.append(ms)
+            bodies.add(body)
+        assert len(bodies) == 1, "paths returned different bodies"
+        rows.append((size, len(body), times))
+    responses.orjson = orjson
+    return [name for name, _, _ in modes], rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+
+    overrides = {'cache_backend': 'dogpile.cache.null'} if args.no_cache else {}
+    common.prepare_workdir(**overrides)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import suite
+        common.quiet_engines()
+        from app import api
+        from app.internal.db import Base, engine
+        Base.metadata.create_all(bind=engine)
+    suite.seed(1, max(args.pages))
+
+    names, rows = asyncio.run(measure(common.AsgiClient(api), args))
+    print(f"{'page':>6} {'bytes':>9} "
+          + ' '.join(f"{name + ' ms':>13}" for name in names))
+    for size, length, times in rows:
+        print(f"{size:>6} {length:>9} "
+              + ' '.join(f"{ms:>13.2f}" for ms in times))
+
+
+if __name__ == '__main__':
+    main()
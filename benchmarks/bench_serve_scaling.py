@@ -0,0 +1,161 @@
+"""Throughput of ``python -m app serve`` by worker count
+
+Seeds a scratch database once, then for every worker count starts the
+launcher on a free port and drives ``GET /api/todos?limit=20`` over
+keep-alive connections from ``--clients`` load processes for
+``--seconds``. The load processes share the machine with the workers, on
+few cores they compete for it; pin them elsewhere with taskset if there
+are cores to spare. The cache is off for every worker count, with more
+than one worker serve turns the per process memory cache off anyway.
+
+Reports requests per second and the efficiency per worker, the speedup
+over one worker divided by the worker count; 1.0 is linear scaling.
+
+    python benchmarks/bench_serve_scaling.py --seconds 10 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import common
+
+
+PATH = '/api/todos?limit=20'
+
+
+async def connection(port: int, request: bytes, deadline: float) -> tuple:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    done = errors = 0
+    while time.perf_counter() < deadline:
+        writer.write(request)
+        head = await reader.readuntil(b'\r\n\r\n')
+        headers = dict(line.split(b': ', 1) for line in
+                       head.rstrip(b'\r\n').split(b'\r\n')[1:])
+        await reader.readexactly(int(headers[b'content-length']))
+        done += 1
+        if not head.startswith(b'HTTP/1.1 200'):
+            errors += 1
+    writer.close()
+    return done, errors
+
+
+def load(port: int, token: str, connections: int, seconds: float) -> tuple:
+    """Requests and errors of ``connections`` clients during ``seconds``"""
+    request = (f'GET {PATH} HTTP/1.1\r\nhost: 127.0.0.1\r\n'
+               f'authorization: Token {token}\r\n\r\n').encode()
+
+    async def run():
+        deadline = time.perf_counter() + seconds
+        return await asyncio.gather(*(connection(port, request, deadline)
+                                      for _ in range(connections)))
+
+    results = asyncio.run(run())
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def seed(workdir: str) -> str:
+    """Migrate and seed the scratch database, auth token of a user"""
+    subprocess.run([sys.executable, '-m', 'app', 'migrate'], cwd=workdir,
+                   env={**os.environ, 'PYTHONPATH': common.REPO_ROOT,
+                        'TODO_CONFIG': 'config.yaml'},
+                   check=True, capture_output=True)
+    import suite
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        from app import crud
+        from app.internal import auth
+        from app.internal.db import SessionLocal, dispose_engines
+        from app.internal.hashing import hashing_executor
+        suite.seed(10, 100)
+    with SessionLocal() as db:
+        token = auth.generate_auth_token(
+            crud.get_user_by_username(db, 'bench-0'))
+    asyncio.run(dispose_engines())
+    hashing_executor.shutdown()
+    return token
+
+
+def measure(args, workdir: str, token: str, workers: int,
+            pool: concurrent.futures.Executor) -> tuple:
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'app', 'serve', '--port', '0',
+         '--workers', str(workers)],
+        cwd=workdir, env={**os.environ, 'PYTHONPATH': common.REPO_ROOT,
+                          'TODO_CONFIG': 'config.yaml'},
+        stderr=subprocess.PIPE, text=True)
+    try:
+        started = 0
+        port = None
+        while started < workers:
+            line = server.stderr.readline()
+            if not line:
+                raise RuntimeError(f"serve exited with {server.wait()}")
+            if 'listening on' in line:
+                port = int(line.rsplit(':', 1)[1])
+            elif 'started worker' in line:
+                started += 1
+        # the workers' request logs would fill the pipe and block them
+        threading.Thread(target=server.stderr.read, daemon=True).start()
+        # every worker answers before the clock starts
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{port}{PATH}',
+            headers={'authorization': f'Token {token}'})
+        for _ in range(workers * 20):
+            urllib.request.urlopen(request, timeout=30).read()
+        results = list(pool.map(
+            load, [port] * args.clients, [token] * args.clients,
+            [args.connections] * args.clients,
+            [args.seconds] * args.clients))
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    requests = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    return requests / args.seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help="worker counts, default powers of two up to "
+                             "the cpu count")
+    parser.add_argument('--clients', type=int, default=None,
+                        help="load processes, default the cpu count")
+    parser.add_argument('--connections', type=int, default=16,
+                        help="keep-alive connections per load process")
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or sorted(
+        {min(1 << i, cpus) for i in range(cpus.bit_length() + 1)})
+    args.clients = args.clients or cpus
+    workdir = common.prepare_workdir(cache_backend='dogpile.cache.null')
+    token = seed(workdir)
+
+    print(f"GET {PATH}, {args.clients} clients x {args.connections} "
+          f"connections, {args.seconds:g}s, {cpus} cpus")
+    print(f"{'workers':<10} {'req/s':>9} {'errors':>7} {'speedup':>9} "
+          f"{'efficiency':>11}")
+    single = None
+    with concurrent.futures.ProcessPoolExecutor(
+            args.clients,
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        for n in workers:
+            rate, errors = measure(args, workdir, token, n, pool)
+            single = single or rate
+            print(f"{n:<10} {rate:>9.1f} {errors:>7} {rate / single:>9.2f} "
+                  f"{rate / single / n:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
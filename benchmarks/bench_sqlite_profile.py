@@ -0,0 +1,134 @@
+"""Concurrent read/write throughput of the old and new sqlite settings
+
+"old" opens a connection per session in rollback journal mode with
+synchronous=FULL, as before the pool and sqlite_* settings existed. "new"
+is the default config: a pool and WAL with synchronous=NORMAL. The cache
+is off so every read reaches sqlite. Each mode runs in its own process
+because the settings are read when the app is imported.
+
+    python benchmarks/bench_sqlite_profile.py --readers 8 --writers 2 --seconds 5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import common
+
+
+MODES = {
+    'old': {'database_pool_size': 0, 'sqlite_journal_mode': 'delete',
+            'sqlite_synchronous': 'full', 'sqlite_cache_size': None,
+            'sqlite_mmap_size': None, 'sqlite_busy_timeout': None},
+    'new': {},
+}
+
+
+def seed(todos: int):
+    from app import crud
+    from app.internal.db import Base, SessionLocal, engine
+    from app.internal.schemas import TodoCreateSchema
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        crud.create_todos(db, [TodoCreateSchema(name=f'todo-{i}',
+                                                description='benchmark')
+                               for i in range(todos)], 1)
+
+
+def measure(args) -> dict:
+    from sqlalchemy.exc import OperationalError
+    from app import crud
+    from app.internal.db import SessionLocal
+    from app.internal.schemas import TodoUpdateSchema
+
+    stop = time.perf_counter() + args.seconds
+    read_latencies, write_latencies = [], []
+    errors = 0
+
+    def reader():
+        nonlocal errors
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                with SessionLocal() as db:
+                    crud.get_todos_for_user(
+                        db, random.randrange(args.todos), 20, 1)
+            except OperationalError:
+                errors += 1
+                continue
+            read_latencies.append(time.perf_counter() - start)
+
+    def writer():
+        nonlocal errors
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                with SessionLocal() as db:
+                    crud.update_todo_by_id(
+                        db, random.randrange(1, args.todos + 1),
+                        TodoUpdateSchema(done=random.random() < 0.5), 1)
+            except OperationalError:
+                errors += 1
+                continue
+            write_latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'reads_per_s': round(len(read_latencies) / args.seconds, 1),
+        'writes_per_s': round(len(write_latencies) / args.seconds, 1),
+        'read_p99_ms': round(common.percentile(read_latencies, 99) * 1000, 2),
+        'write_p99_ms': round(common.percentile(write_latencies, 99) * 1000, 2),
+        'errors': errors,
+    }
+
+
+def worker(args):
+    common.prepare_workdir(cache_backend='dogpile.cache.null',
+                           **MODES[args.mode])
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        seed(args.todos)
+        result = measure(args)
+    result['mode'] = args.mode
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--todos', type=int, default=1000)
+    parser.add_argument('--mode', choices=list(MODES))
+    args = parser.parse_args()
+    if args.mode:
+        return worker(args)
+
+    print(f"{'mode':<5} {'reads/s':>9} {'writes/s':>9} {'read p99':>9} "
+          f"{'write p99':>10} {'errors':>7}")
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--readers', str(args.readers), '--writers', str(args.writers),
+             '--seconds', str(args.seconds), '--todos', str(args.todos)],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(f"{mode:<5} {result['reads_per_s']:>9} "
+              f"{result['writes_per_s']:>9} {result['read_p99_ms']:>9} "
+              f"{result['write_p99_ms']:>10} {result['errors']:>7}")
+
+
+if __name__ == '__main__':
+    main()
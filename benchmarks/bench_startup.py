@@ -0,0 +1,115 @@
+"""Import and startup cost of the app, per fresh interpreter
+
+Every run is a new process in a scratch directory, like a worker booting:
+
+    import app          milliseconds, config.yaml reads and sqlite
+                        connections while importing
+    startup             the startup handlers (engines, schema check)
+    first request       GET /api/todos after startup
+
+``--baseline REV`` runs the same against the app of a git revision,
+e.g. the parent of the change that made the import lazy. Both trees get
+a migrated database first; the baseline creates its tables on import.
+
+    python benchmarks/bench_startup.py --runs 20 --baseline HEAD~1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+import common
+
+
+# runs in the scratch directory, the app tree is argv[1]
+CHILD = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+counts = {'config_reads': 0, 'sqlite_connects': 0}
+
+def audit(event, args):
+    if event == 'open' and str(args[0]).endswith('config.yaml'):
+        counts['config_reads'] += 1
+    elif event == 'sqlite3.connect':
+        counts['sqlite_connects'] += 1
+sys.addaudithook(audit)
+
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+import_counts = dict(counts)
+from starlette.testclient import TestClient
+client = TestClient(app.api)
+before_startup = time.perf_counter()
+client.__enter__()
+started_up = time.perf_counter()
+assert client.get('/api/todos').status_code == 401
+answered = time.perf_counter()
+client.__exit__(None, None, None)
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'startup_ms': (started_up - before_startup) * 1000,
+    'first_request_ms': (answered - started_up) * 1000,
+    'import_config_reads': import_counts['config_reads'],
+    'import_sqlite_connects': import_counts['sqlite_connects'],
+}))
+"""
+
+
+def checkout(rev: str) -> str:
+    """Directory with the tree of ``rev``"""
+    tree = tempfile.mkdtemp(prefix='todo-bench-tree-')
+    archive = subprocess.run(['git', '-C', common.REPO_ROOT, 'archive', rev],
+                             check=True, capture_output=True).stdout
+    with tempfile.TemporaryFile() as archive_fd:
+        archive_fd.write(archive)
+        archive_fd.seek(0)
+        with tarfile.open(fileobj=archive_fd) as tar:
+            tar.extractall(tree)
+    return tree
+
+
+def measure(tree: str, runs: int) -> dict:
+    workdir = common.prepare_workdir()
+    # fails in trees without the command, their import creates the tables
+    subprocess.run([sys.executable, '-m', 'app', 'migrate'], cwd=workdir,
+                   env={**os.environ, 'PYTHONPATH': tree}, check=False,
+                   capture_output=True)
+    samples = []
+    # the first run compiles the tree and creates what's missing
+    for _ in range(runs + 1):
+        output = subprocess.run([sys.executable, '-c', CHILD, tree],
+                                cwd=workdir, check=True, capture_output=True,
+                                text=True).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    samples = samples[1:]
+    return {key: statistics.median(sample[key] for sample in samples)
+            for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--baseline', default=None,
+                        help="git revision to compare with")
+    args = parser.parse_args()
+
+    results = [('current', measure(common.REPO_ROOT, args.runs))]
+    if args.baseline:
+        results.append((args.baseline,
+                        measure(checkout(args.baseline), args.runs)))
+
+    keys = list(results[0][1])
+    print(f"{'median of ' + str(args.runs):<24}"
+          + ''.join(f"{name:>14}" for name, _ in results))
+    for key in keys:
+        print(f"{key:<24}" + ''.join(f"{result[key]:>14.1f}"
+                                     for _, result in results))
+
+
+if __name__ == '__main__':
+    main()
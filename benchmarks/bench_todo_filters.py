@@ -0,0 +1,108 @@
+"""Latency of filtered and sorted todo listings
+
+Seeds ``--todos`` todos for one user (one in ``--done-every`` done) and as
+many for a second one. For each filter the first page is fetched with
+``crud.list_todos_for_user``, with the (owner, done, ...) indexes and after
+dropping them, and compared with what a client had to do before: page
+through every todo with the id cursor and filter itself.
+
+    python benchmarks/bench_todo_filters.py --todos 200000
+"""
+import argparse
+import statistics
+import time
+
+import common
+
+
+def seed(total: int, done_every: int):
+    from sqlalchemy import insert
+    from app.internal.db import Base, engine
+    from app.internal.models import Todo
+
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for start in range(0, total, 50_000):
+            rows = []
+            for i in range(start, min(start + 50_000, total)):
+                done = i % done_every == 0
+                rows.append({'name': f'todo-{i:07}', 'description': '',
+                             'done': done, 'owner': 1})
+                rows.append({'name': f'todo-{i:07}', 'description': '',
+                             'done': done, 'owner': 2})
+            conn.execute(insert(Todo), rows)
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def client_side(db, crud, limit: int, keep) -> list:
+    """First ``limit`` matching todos, paging through all of them"""
+    found, after_id = [], 0
+    while len(found) < limit:
+        page = crud.get_todos_for_user_after(db, after_id, 100, 1)
+        if not page:
+            break
+        found += [todo for todo in page if keep(todo)]
+        after_id = page[-1].id
+    return found[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--todos', type=int, default=200_000)
+    parser.add_argument('--done-every', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    common.prepare_workdir(cache_backend='dogpile.cache.null')
+    common.quiet_engines()
+    from sqlalchemy import text
+    from app import crud
+    from app.internal.db import SessionLocal, engine
+    from app.internal.schemas import SortOrder, TodoSortField
+
+    seed(args.todos, args.done_every)
+    prefix = f'todo-{args.todos // 2:07}'[:-2]
+    cases = [
+        ('done', {'done': True}, lambda t: t.done),
+        ('open, by name desc', {'done': False, 'sort': TodoSortField.name,
+                                'order': SortOrder.desc}, lambda t: not t.done),
+        (f'prefix {prefix}', {'name_prefix': prefix},
+         lambda t: t.name.startswith(prefix)),
+        ('done + prefix', {'done': True, 'name_prefix': prefix},
+         lambda t: t.done and t.name.startswith(prefix)),
+    ]
+
+    def indexed():
+        return [timed(lambda: crud.list_todos_for_user(
+            db, 1, args.limit, **kwargs), args.repeat)
+            for _, kwargs, _ in cases]
+
+    with SessionLocal() as db:
+        with_indexes = indexed()
+        client = [timed(lambda: client_side(db, crud, args.limit, keep),
+                        args.repeat) for _, _, keep in cases]
+    with engine.begin() as conn:
+        for index in ('ix_todos_owner_done_id', 'ix_todos_owner_done_name'):
+            conn.execute(text(f'DROP INDEX {index}'))
+    with SessionLocal() as db:
+        without_indexes = indexed()
+
+    print(f"{'filter':<22} {'indexed ms':>11} {'no done idx ms':>15} "
+          f"{'client ms':>10}")
+    rows = zip(cases, with_indexes, without_indexes, client)
+    for (name, _, _), indexed_ms, scan_ms, client_ms in rows:
+        print(f"{name:<22} {indexed_ms:>11.2f} {scan_ms:>15.2f} "
+              f"{client_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
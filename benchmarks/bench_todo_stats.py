@@ -0,0 +1,188 @@
+"""Todo counts from todo_stats against counting todos, and the write cost
+
+Reads, ``--users`` users with ``--todos`` todos each:
+
+    GET /api/todos/stats        against paging through GET /api/todos
+    GET /api/admin/todos/stats  against counting every user's todos
+
+Writes, crud calls of one user with the todo_stats update and with it
+replaced by a no-op, best microseconds per todo of ``--rounds`` rounds:
+
+    create_todo, update_todo_by_id (done), delete_todo_by_id,
+    create_todos / update_todos / delete_todos of 100 todos
+
+Reads run with the null cache backend, the counts are never cached.
+
+    python benchmarks/bench_todo_stats.py --users 100 --todos 1000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import time
+
+import common
+
+
+async def time_requests(client, fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def measure_reads(client, args) -> list[tuple[str, float]]:
+    async def login(name: str) -> dict:
+        _, _, body = await client.request('POST', '/api/auth/login', json_body={
+            'name': name, 'raw_password': 'bench'})
+        return {'authorization': f"Token {json.loads(body)['auth_token']}"}
+
+    headers = await login('bench-0')
+    admin_headers = await login('bench-admin')
+
+    async def stats():
+        status, _, body = await client.request('GET', '/api/todos/stats',
+                                               headers=headers)
+        assert status == 200, status
+        return json.loads(body)
+
+    async def page_through():
+        url, done, total = '/api/todos?limit=1000', 0, 0
+        while url:
+            _, response_headers, body = await client.request(
+                'GET', url, headers=headers)
+            todos = json.loads(body)
+            total += len(todos)
+            done += sum(todo['done'] for todo in todos)
+            cursor = response_headers.get('x-next-cursor')
+            url = cursor and f'/api/todos?limit=1000&cursor={cursor}'
+        return {'total': total, 'done': done, 'open': total - done}
+
+    async def admin_stats():
+        status, _, _ = await client.request('GET', '/api/admin/todos/stats',
+                                            headers=admin_headers)
+        assert status == 200, status
+
+    assert await stats() == await page_through()
+    return [
+        ('GET /api/todos/stats', await time_requests(client, stats,
+                                                     args.repeat)),
+        ('page through GET /api/todos',
+         await time_requests(client, page_through, max(args.repeat // 10, 1))),
+        ('GET /api/admin/todos/stats',
+         await time_requests(client, admin_stats, args.repeat)),
+    ]
+
+
+def count_all_todos() -> float:
+    from app.internal.db import engine
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        conn.exec_driver_sql(
+            "SELECT count(*), count(*) FILTER (WHERE done) FROM todos").all()
+    return (time.perf_counter() - started) * 1000
+
+
+def measure_writes(args) -> list[tuple[str, float, float]]:
+    from app import crud
+    from app.internal.db import SessionLocal
+    from app.internal.schemas import TodoBatchUpdateSchema, TodoCreateSchema
+    from app.internal.schemas import TodoUpdateSchema
+
+    counter = itertools.count()
+    add_to_todo_stats = crud._add_to_todo_stats
+    rows = []
+    with SessionLocal() as db:
+        user_id = crud.get_user_by_username(db, 'bench-0').id
+
+        def create():
+            return [crud.create_todo(db, TodoCreateSchema(
+                name=f'write-{next(counter)}', description=''), user_id).id
+                for _ in range(args.writes)]
+
+        def create_batches():
+            return [todo.id for _ in range(args.writes // 100)
+                    for todo in crud.create_todos(db, [
+                        TodoCreateSchema(name=f'write-{next(counter)}',
+                                         description='')
+                        for _ in range(100)], user_id)]
+
+        def update(ids):
+            for id in ids:
+                crud.update_todo_by_id(db, id, TodoUpdateSchema(done=True),
+                                       user_id)
+
+        def delete(ids):
+            for id in ids:
+                crud.delete_todo_by_id(db, id, user_id)
+
+        def update_batches(ids):
+            for start in range(0, len(ids), 100):
+                crud.update_todos(db, [TodoBatchUpdateSchema(id=id, done=True)
+                                       for id in ids[start:start + 100]],
+                                  user_id)
+
+        def delete_batches(ids):
+            for start in range(0, len(ids), 100):
+                crud.delete_todos(db, ids[start:start + 100], user_id)
+
+        # (name, untimed setup returning todo ids, timed calls)
+        cases = [
+            ('create_todo', list, lambda ids: create()),
+            ('update_todo_by_id done', create, update),
+            ('delete_todo_by_id', create, delete),
+            ('create_todos 100', list, lambda ids: create_batches()),
+            ('update_todos 100 done', create_batches, update_batches),
+            ('delete_todos 100', create_batches, delete_batches),
+        ]
+        # alternates both variants, commit times vary a lot between runs
+        for name, setup, run in cases:
+            times = {True: [], False: []}
+            for maintained in [True, False] * args.rounds:
+                crud._add_to_todo_stats = add_to_todo_stats if maintained \
+                    else lambda *args: None
+                ids = setup()
+                started = time.perf_counter()
+                run(ids)
+                times[maintained].append((time.perf_counter() - started)
+                                         / args.writes * 1e6)
+            rows.append((name, min(times[True]), min(times[False])))
+        crud._add_to_todo_stats = add_to_todo_stats
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--todos', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--writes', type=int, default=1000,
+                        help="todos written per write case and round")
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    common.prepare_workdir(cache_backend='dogpile.cache.null')
+    with contextlib.redirect_stdout(io.StringIO()):
+        import suite
+        common.quiet_engines()
+        from app import api
+        from app.internal.db import Base, engine
+        Base.metadata.create_all(bind=engine)
+    suite.seed(args.users, args.todos)
+
+    reads = asyncio.run(measure_reads(common.AsgiClient(api), args))
+    reads.append(('count all todos (no todo_stats)', count_all_todos()))
+    print(f"{'read':<34} {'ms':>9}")
+    for name, ms in reads:
+        print(f"{name:<34} {ms:>9.3f}")
+
+    print(f"\n{'write':<24} {'us/todo':>9} {'no stats':>9}")
+    for name, maintained, skipped in measure_writes(args):
+        print(f"{name:<24} {maintained:>9.1f} {skipped:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Cost of revoking a refresh token family by chain length
+
+Compares the previous per-link walk (a SELECT and a commit for every
+token_child link) with the single UPDATE on family_id.
+
+    python benchmarks/bench_token_family.py --lengths 10 100 1000
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import common
+
+
+def seed(length: int) -> str:
+    """Insert a rotated chain of ``length`` tokens, return its first token"""
+    from sqlalchemy import insert
+    from app.internal.db import engine
+    from app.internal.models import RefreshToken
+
+    tokens = [f'chain-{length}-{i}' for i in range(length)]
+    not_after = datetime.now() + timedelta(days=1)
+    rows = [{'token': token, 'user_id': 1, 'family_id': f'family-{length}',
+             'token_child': tokens[i + 1] if i + 1 < length else None,
+             'active': i + 1 == length, 'not_after': not_after}
+            for i, token in enumerate(tokens)]
+    with engine.begin() as conn:
+        conn.execute(insert(RefreshToken), rows)
+    return tokens[0]
+
+
+def reactivate(length: int):
+    from sqlalchemy import update
+    from app.internal.db import engine
+    from app.internal.models import RefreshToken
+
+    with engine.begin() as conn:
+        conn.execute(update(RefreshToken)
+                     .where(RefreshToken.family_id == f'family-{length}')
+                     .values(active=True))
+
+
+def per_link(db, token) -> int:
+    """The revocation before family_id, one SELECT and commit per link"""
+    from app.internal.models import RefreshToken
+
+    count = 0
+    while token.token_child:
+        token = db.query(RefreshToken)\
+            .filter(RefreshToken.token == token.token_child).first()
+        token.active = False
+        db.commit()
+        count += 1
+    return count
+
+
+def timed(revoke, first: str, length: int, repeat: int) -> float:
+    from app.crud import get_refresh_token
+    from app.internal.db import SessionLocal
+
+    samples = []
+    for _ in range(repeat):
+        reactivate(length)
+        with SessionLocal() as db:
+            token = get_refresh_token(db, first)
+            start = time.perf_counter()
+            revoke(db, token)
+            samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+',
+                        default=[1, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    common.prepare_workdir()
+    common.quiet_engines()
+    from app.crud import deactivate_token_family
+
+    print(f"{'links':>7} {'per link ms':>12} {'family ms':>10}")
+    for length in args.lengths:
+        first = seed(length)
+        per_link_ms = timed(per_link, first, length, args.repeat)
+        family_ms = timed(deactivate_token_family, first, length, args.repeat)
+        print(f"{length:>7} {per_link_ms:>12.2f} {family_ms:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
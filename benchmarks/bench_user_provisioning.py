@@ -0,0 +1,105 @@
+"""Bulk user provisioning throughput by hashing worker count
+
+Every run is a fresh process and database with ``hashing_workers`` set,
+creating ``--users`` users with ``provision_users`` at ``--rounds``
+bcrypt rounds:
+
+    register_user       one user at a time, what repeated
+                        POST /api/admin/users costs
+    provision_users     --workers 1 2 4 ... up to the cpu count
+
+Reports users per second and the efficiency per worker, the speedup over
+one worker divided by the worker count; 1.0 is linear scaling.
+
+    python benchmarks/bench_user_provisioning.py --users 2000 --rounds 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import bcrypt
+
+import common
+
+
+def child(args):
+    common.prepare_workdir(hashing_workers=args.child_workers,
+                           bcrypt_rounds=args.rounds)
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        from app.internal.auth import register_user
+        from app.internal.db import Base, SessionLocal, engine
+        from app.internal.hashing import hashing_executor
+        from app.internal.schemas import UserDTOSchemaAdmin
+        from app.provisioning import provision_users
+        Base.metadata.create_all(bind=engine)
+    # start the pool processes before timing
+    hashing_executor.map(bcrypt.hashpw, [(b'', bcrypt.gensalt(4))] * max(
+        args.child_workers, 1))
+
+    users = [UserDTOSchemaAdmin(name=f'user-{i}', raw_password=f'pw-{i}',
+                                permissions=[1, 2])
+             for i in range(args.users)]
+    started = time.perf_counter()
+    if args.sequential:
+        with SessionLocal() as db:
+            for user in users:
+                register_user(db, user.name, user.raw_password,
+                              user.permissions)
+    else:
+        created = sum(not isinstance(result, Exception)
+                      for _, result in provision_users(enumerate(users)))
+        assert created == args.users, created
+    seconds = time.perf_counter() - started
+    hashing_executor.shutdown()
+    print(json.dumps({'users_per_s': args.users / seconds}))
+
+
+def run(args, workers: int, sequential: bool = False) -> float:
+    command = [sys.executable, os.path.abspath(__file__),
+               '--users', str(args.users), '--rounds', str(args.rounds),
+               '--child-workers', str(workers)]
+    if sequential:
+        command.append('--sequential')
+    output = subprocess.run(command, check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output.splitlines()[-1])['users_per_s']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=10,
+                        help="bcrypt rounds, the app default is 12")
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help="hashing worker counts, default powers of two "
+                             "up to the cpu count")
+    parser.add_argument('--child-workers', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--sequential', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child_workers is not None:
+        return child(args)
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or sorted(
+        {min(1 << i, cpus) for i in range(cpus.bit_length() + 1)})
+    print(f"{args.users} users, bcrypt rounds {args.rounds}, {cpus} cpus")
+    print(f"{'':<24} {'users/s':>9} {'speedup':>9} {'efficiency':>11}")
+    sequential = run(args, 1, sequential=True)
+    print(f"{'register_user':<24} {sequential:>9.1f}")
+    single = None
+    for n in workers:
+        rate = run(args, n)
+        single = single or rate
+        print(f"{f'provision_users {n}':<24} {rate:>9.1f} "
+              f"{rate / single:>9.2f} {rate / single / n:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Admin username prefix search over a large user table
+
+Inserts ``--users`` users named like "Alice123" in random case, then times
+through the ASGI app, ``--limit`` users per page:
+
+    GET /api/admin/users?username_filter=...  first page, and the page
+                                              after ``--deep`` pages
+    unindexed lower(name) LIKE 'prefix%'      what the search costs
+                                              without users.name_lower
+
+for a short prefix with many matches and a long one with few.
+
+    python benchmarks/bench_user_search.py --users 1000000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import statistics
+import time
+import urllib.parse
+
+import common
+
+
+FIRST_NAMES = ['alice', 'albert', 'alicia', 'bob', 'carol', 'dave', 'erin',
+               'frank', 'grace', 'heidi', 'ivan', 'judy', 'mallory', 'oscar',
+               'peggy', 'trent', 'victor', 'walter', 'Åsa', 'zoë']
+
+
+def insert_users(users: int):
+    from app.internal.db import engine
+    from app.internal.schemas import normalize_username
+
+    rng = random.Random(0)
+
+    def name(i: int) -> str:
+        first = rng.choice(FIRST_NAMES)
+        return ''.join(c.upper() if rng.random() < 0.3 else c
+                       for c in first) + str(i)
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        for start in range(0, users, 100_000):
+            names = [name(i) for i in range(start, min(start + 100_000, users))]
+            conn.exec_driver_sql(
+                "INSERT INTO users (name, name_lower, password, permissions, "
+                "permission_mask) VALUES (?, ?, '', '1,2', 3)",
+                [(n, normalize_username(n)) for n in names])
+    return time.perf_counter() - started
+
+
+async def measure(client, args) -> list[tuple[str, str, float, bool]]:
+    _, _, body = await client.request('POST', '/api/auth/login', json_body={
+        'name': 'bench-admin', 'raw_password': 'bench'})
+    headers = {'authorization': f"Token {json.loads(body)['auth_token']}"}
+
+    async def page(prefix: str, cursor: str | None) -> tuple[int, str | None]:
+        url = f'/api/admin/users?limit={args.limit}&username_filter=' \
+            + urllib.parse.quote(prefix)
+        if cursor:
+            url += f'&cursor={cursor}'
+        status, response_headers, body = await client.request(
+            'GET', url, headers=headers)
+        assert status == 200, status
+        return len(json.loads(body)), response_headers.get('x-next-cursor')
+
+    async def median_ms(prefix: str, cursor: str | None) -> float:
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            await page(prefix, cursor)
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples) * 1000
+
+    rows = []
+    for prefix in args.prefixes:
+        rows.append((f'{prefix!r} first page', prefix,
+                     await median_ms(prefix, None), True))
+        cursor, pages = None, 0
+        for pages in range(args.deep):
+            _, next_cursor = await page(prefix, cursor)
+            if not next_cursor:
+                break
+            cursor = next_cursor
+        if cursor:
+            rows.append((f'{prefix!r} page {pages + 1}', prefix,
+                         await median_ms(prefix, cursor), False))
+    return rows
+
+
+def unindexed_ms(prefix: str, limit: int) -> float:
+    from app.internal.db import engine
+
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        conn.exec_driver_sql(
+            "SELECT * FROM users WHERE lower(name) LIKE ? "
+            "ORDER BY lower(name), id LIMIT ?", (prefix.lower() + '%', limit)
+        ).all()
+    return (time.perf_counter() - started) * 1000
+
+
+def count_matches(prefix: str) -> int:
+    from app.internal.db import engine
+    from app.internal.schemas import normalize_username
+
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(
+            "SELECT count(*) FROM users WHERE substr(name_lower, 1, ?) = ?",
+            (len(prefix), normalize_username(prefix))).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--deep', type=int, default=100,
+                        help="pages to follow before timing a deep page")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--prefixes', nargs='+', default=['a', 'ALIC', 'zoë99'])
+    args = parser.parse_args()
+
+    common.prepare_workdir()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import suite
+        common.quiet_engines()
+        from app import api
+        from app.internal.db import Base, engine
+        Base.metadata.create_all(bind=engine)
+    suite.seed(0, 1)
+    seconds = insert_users(args.users)
+    print(f"inserted {args.users} users in {seconds:.1f}s")
+
+    rows = asyncio.run(measure(common.AsgiClient(api), args))
+    print(f"{'search':<24} {'matches':>9} {'ms':>9} {'unindexed ms':>13}")
+    for name, prefix, ms, first in rows:
+        unindexed = f"{unindexed_ms(prefix, args.limit):.2f}" if first else ''
+        print(f"{name:<24} {count_matches(prefix):>9} {ms:>9.2f} "
+              f"{unindexed:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Shared helpers for the benchmark scripts
+
+The app reads ``config.yaml`` and ``jwt_secret.txt`` from the working
+directory when it's imported, so every benchmark process first moves into
+a scratch directory with its own config and sqlite database.
+"""
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import yaml
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare_workdir(**overrides) -> str:
+    """Create a scratch directory with a config for the app and cd into it
+
+    Args:
+        **overrides: config.yaml keys to replace
+
+    Returns:
+        str: path of the scratch directory
+    """
+    with open(os.path.join(REPO_ROOT, 'config.yaml')) as config_fd:
+        config = yaml.safe_load(config_fd)
+    workdir = tempfile.mkdtemp(prefix='todo-bench-')
+    config['database_url'] = f"sqlite:///{workdir}/db.sqlite"
+    config['database_async_url'] = f"sqlite+aiosqlite:///{workdir}/db.sqlite"
+    config['database_echo'] = False
+    config.update(overrides)
+    with open(os.path.join(workdir, 'config.yaml'), 'w') as config_fd:
+        yaml.safe_dump(config, config_fd)
+    with open(os.path.join(workdir, 'jwt_secret.txt'), 'w') as secret_fd:
+        secret_fd.write('benchmark-secret')
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return workdir
+
+
+class AsgiClient:
+    """Minimal in-process HTTP client that calls an ASGI app directly"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str,
+                      headers: dict[str, str] | None = None,
+                      json_body=None,
+                      content: bytes = b'') -> tuple[int, dict[str, str], bytes]:
+        body = content if json_body is None else json.dumps(json_body).encode()
+        raw_headers = [(k.lower().encode(), v.encode())
+                       for k, v in (headers or {}).items()]
+        if json_body is not None:
+            raw_headers.append((b'content-type', b'application/json'))
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': raw_headers,
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                await asyncio.sleep(3600)
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        status = 0
+        response_headers = {}
+        chunks = []
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers.update(
+                    (k.decode(), v.decode()) for k, v in message['headers'])
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+
+        await self.app(scope, receive, send)
+        return status, response_headers, b''.join(chunks)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (ms) of one load run"""
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def run_load(make_request, concurrency: int, total: int) -> dict:
+    """Run ``total`` calls of ``make_request`` with ``concurrency`` in flight
+
+    Args:
+        make_request: coroutine function returning the response status
+        concurrency (int): amount of concurrent callers
+        total (int): amount of requests to issue
+
+    Returns:
+        dict: see ``summarize``
+    """
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            status = await make_request()
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def quiet_engines():
+    """Turn off SQL echo on the app engines so it doesn't skew timings"""
+    from app.internal import db
+    db.engine.echo = False
+    if db.async_engine is not None:
+        db.async_engine.echo = False
+    # echo=True at creation already raised the shared engine logger level
+    logging.getLogger('sqlalchemy.engine.Engine').setLevel(logging.WARNING)
@@ -0,0 +1,713 @@
+"""Load test of every API route and micro-benchmarks of auth and crud
+
+``run`` seeds a scratch sqlite database, drives each route of main_router
+and admin_router through the ASGI app in-process, times the token helpers
+and every public ``app.crud`` function, and writes the results as JSON.
+``compare`` checks a result file against a baseline and exits with status
+1 when something regressed.
+
+    python benchmarks/suite.py run --output baseline.json
+    python benchmarks/suite.py run --output current.json
+    python benchmarks/suite.py compare baseline.json current.json
+
+Routes hashing a password (login, register, admin user writes) and the
+admin export of every todo run ``--slow-requests`` times, the others
+``--requests`` times. Writes feed the deletes, e.g.
+``DELETE /api/todos/{todo_id}`` removes the todos that ``POST /api/todos``
+created.
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import inspect
+import io
+import itertools
+import json
+import platform
+import sys
+import time
+
+import common
+
+
+# metric -> True if higher is better
+METRIC_DIRECTIONS = {'rps': True, 'mean_ms': False, 'p50_ms': False,
+                     'p95_ms': False, 'p99_ms': False}
+
+MAIN_PERMISSIONS = [1, 2]
+ADMIN_PERMISSIONS = [1, 2, 3, 100]
+
+
+def seed(users: int, todos_per_user: int):
+    """Insert ``users`` users with ``todos_per_user`` todos each, plus an admin
+
+    Every user's password is "bench", hashed once.
+    """
+    from sqlalchemy import insert
+    from app.internal.db import Base, SessionLocal, engine
+    from app.internal.hashing import hash_password
+    from app.internal.migrations import rebuild_todo_stats
+    from app.internal.models import Todo, User
+    from app.internal.schemas import normalize_username, permissions_to_mask
+
+    Base.metadata.create_all(bind=engine)
+    password = hash_password('bench')
+
+    def user_row(name: str, permissions: list[int]) -> dict:
+        return {'name': name, 'name_lower': normalize_username(name),
+                'password': password,
+                'permissions': ','.join(map(str, permissions)),
+                'permission_mask': permissions_to_mask(permissions)}
+
+    with SessionLocal() as db:
+        rows = [user_row(f'bench-{i}', MAIN_PERMISSIONS) for i in range(users)]
+        rows.append(user_row('bench-admin', ADMIN_PERMISSIONS))
+        db.execute(insert(User.__table__), rows)
+        user_ids = db.query(User.id).filter(User.name.like('bench-%'))\
+            .order_by(User.id).all()
+        for start in range(0, len(user_ids), 100):
+            db.execute(insert(Todo.__table__), [
+                {'name': f'todo-{i}', 'description': 'benchmark',
+                 'done': False, 'owner': user_id}
+                for (user_id,) in user_ids[start:start + 100]
+                for i in range(todos_per_user)])
+        db.commit()
+    # the inserts above bypass crud
+    rebuild_todo_stats(engine)
+
+
+class RouteScenarios:
+    """Request functions for every route, keyed by "METHOD /path"
+
+    Each function issues one request and returns its status. App errors
+    that escape as exceptions count as status 500.
+    """
+
+    def __init__(self, client: common.AsgiClient):
+        self.client = client
+        self.counter = itertools.count()
+        self.headers = {}
+        self.admin_headers = {}
+        self.todo_ids = []
+        self.user_ids = []
+        # filled by the writes and ``prepare``, drained by the deletes
+        self.created_todos = collections.deque()
+        self.batch_created_todos = collections.deque()
+        self.refresh_tokens = collections.deque()
+        self.created_users = collections.deque()
+
+    async def request(self, method: str, path: str, headers: dict | None = None,
+                      json_body=None, content: bytes = b'') -> tuple[int, object]:
+        try:
+            status, _, body = await self.client.request(
+                method, path, headers=headers, json_body=json_body,
+                content=content)
+        except Exception:
+            return 500, None
+        try:
+            return status, json.loads(body) if body else None
+        except ValueError:
+            return status, body
+
+    async def login(self, name: str) -> dict:
+        status, body = await self.request('POST', '/api/auth/login', json_body={
+            'name': name, 'raw_password': 'bench'})
+        if status != 200:
+            raise RuntimeError(f"login of {name} failed with {status}")
+        return body
+
+    async def prepare(self, refresh_families: int, deletable_users: int):
+        """Log in and create what the token and user delete scenarios use up
+
+        Refresh tokens and deletable users are saved directly, so those
+        scenarios don't depend on the slow login and user insert routes.
+        """
+        from sqlalchemy import insert
+        from app import crud
+        from app.internal.auth import generate_refresh_token
+        from app.internal.db import SessionLocal
+        from app.internal.models import User
+
+        with SessionLocal() as db:
+            user = crud.get_user_by_username(db, 'bench-0')
+            for _ in range(refresh_families):
+                token = generate_refresh_token()
+                crud.save_refresh_token(db, token, user.id,
+                                        crud.new_token_family_id())
+                self.refresh_tokens.append(token)
+            names = [f'deletable-{i}' for i in range(deletable_users)]
+            db.execute(insert(User.__table__), [
+                {'name': name, 'password': user.password,
+                 'permissions': '1,2', 'permission_mask': 3}
+                for name in names])
+            db.commit()
+            self.created_users.extend(
+                user_id for (user_id,) in db.query(User.id)
+                .filter(User.name.like('deletable-%')).order_by(User.id))
+
+        tokens = await self.login('bench-0')
+        self.headers = {'authorization': f"Token {tokens['auth_token']}"}
+        tokens = await self.login('bench-admin')
+        self.admin_headers = {'authorization': f"Token {tokens['auth_token']}"}
+        _, todos = await self.request('GET', '/api/todos?limit=1000',
+                                      headers=self.headers)
+        self.todo_ids = [todo['id'] for todo in todos]
+        _, users = await self.request('GET', '/api/admin/users?limit=1000',
+                                      headers=self.admin_headers)
+        self.user_ids = [user['id'] for user in users]
+
+    def pick(self, items: list, n: int):
+        return items[n % len(items)]
+
+    def scenarios(self) -> list[tuple[str, bool, object]]:
+        """(route, slow, request function) in the order they are run
+
+        Deletes run after the writes that feed them, admin user deletes last.
+        """
+        return [
+            ('GET /api/todos', False, self.list_todos),
+            ('GET /api/todos/{todo_id}', False, self.get_todo),
+            ('GET /api/todos/export', False, self.export_todos),
+            ('GET /api/todos/search', False, self.search_todos),
+            ('GET /api/todos/stats', False, self.todo_stats),
+            ('PUT /api/todos/{todo_id}', False, self.update_todo),
+            ('POST /api/todos', False, self.create_todo),
+            ('DELETE /api/todos/{todo_id}', False, self.delete_todo),
+            ('POST /api/todos/batch', False, self.create_batch),
+            ('PATCH /api/todos/batch', False, self.update_batch),
+            ('DELETE /api/todos/batch', False, self.delete_batch),
+            ('POST /api/todos/import', False, self.import_todos),
+            ('GET /api/secret', False, self.secret),
+            ('POST /api/auth/login', True, self.login_request),
+            ('POST /api/auth/refresh_token', False, self.refresh),
+            ('POST /api/auth/register', True, self.register),
+            ('GET /api/admin/users', False, self.admin_list_users),
+            ('GET /api/admin/users/{user_id}', False, self.admin_get_user),
+            ('GET /api/admin/todos/export', True, self.admin_export_todos),
+            ('GET /api/admin/todos/stats', False, self.admin_todo_stats),
+            ('PUT /api/admin/users/{user_id}', True, self.admin_update_user),
+            ('POST /api/admin/users', True, self.admin_insert_user),
+            ('POST /api/admin/users/bulk', True, self.admin_provision_users),
+            ('DELETE /api/admin/users/{user_id}', False,
+             self.admin_delete_user),
+        ]
+
+    async def list_todos(self):
+        status, _ = await self.request('GET', '/api/todos?limit=20',
+                                       headers=self.headers)
+        return status
+
+    async def get_todo(self):
+        todo_id = self.pick(self.todo_ids, next(self.counter))
+        status, _ = await self.request('GET', f'/api/todos/{todo_id}',
+                                       headers=self.headers)
+        return status
+
+    async def export_todos(self):
+        status, _ = await self.request('GET', '/api/todos/export',
+                                       headers=self.headers)
+        return status
+
+    async def search_todos(self):
+        status, _ = await self.request('GET', '/api/todos/search?q=todo',
+                                       headers=self.headers)
+        return status
+
+    async def todo_stats(self):
+        status, _ = await self.request('GET', '/api/todos/stats',
+                                       headers=self.headers)
+        return status
+
+    async def update_todo(self):
+        n = next(self.counter)
+        status, _ = await self.request(
+            'PUT', f'/api/todos/{self.pick(self.todo_ids, n)}',
+            headers=self.headers, json_body={'done': n % 2 == 0})
+        return status
+
+    async def create_todo(self):
+        status, body = await self.request(
+            'POST', '/api/todos', headers=self.headers,
+            json_body={'name': f'new-{next(self.counter)}',
+                       'description': 'benchmark'})
+        if status == 201:
+            self.created_todos.append(body['id'])
+        return status
+
+    async def delete_todo(self):
+        if not self.created_todos:
+            return 599
+        status, _ = await self.request(
+            'DELETE', f'/api/todos/{self.created_todos.popleft()}',
+            headers=self.headers)
+        return status
+
+    async def create_batch(self):
+        n = next(self.counter)
+        status, body = await self.request(
+            'POST', '/api/todos/batch', headers=self.headers,
+            json_body=[{'name': f'batch-{n}-{i}', 'description': 'benchmark'}
+                       for i in range(10)])
+        if status == 200:
+            self.batch_created_todos.extend(
+                item['todo']['id'] for item in body if item['todo'])
+        return status
+
+    async def update_batch(self):
+        n = next(self.counter)
+        status, _ = await self.request(
+            'PATCH', '/api/todos/batch', headers=self.headers,
+            json_body=[{'id': self.pick(self.todo_ids, n + i),
+                        'done': n % 2 == 0} for i in range(10)])
+        return status
+
+    async def delete_batch(self):
+        ids = [self.batch_created_todos.popleft()
+               for _ in range(min(10, len(self.batch_created_todos)))]
+        if not ids:
+            return 599
+        status, _ = await self.request('DELETE', '/api/todos/batch',
+                                       headers=self.headers, json_body=ids)
+        return status
+
+    async def import_todos(self):
+        n = next(self.counter)
+        body = ''.join(json.dumps({'name': f'import-{n}-{i}',
+                                   'description': 'benchmark'}) + '\n'
+                       for i in range(100))
+        status, _ = await self.request(
+            'POST', '/api/todos/import', content=body.encode(),
+            headers={**self.headers, 'content-type': 'application/x-ndjson'})
+        return status
+
+    async def secret(self):
+        status, _ = await self.request('GET', '/api/secret',
+                                       headers=self.headers)
+        return status
+
+    async def login_request(self):
+        status, _ = await self.request('POST', '/api/auth/login', json_body={
+            'name': 'bench-0', 'raw_password': 'bench'})
+        return status
+
+    async def refresh(self):
+        # every token is used once, its successor goes back in the queue
+        if not self.refresh_tokens:
+            return 599
+        status, body = await self.request(
+            'POST', '/api/auth/refresh_token',
+            json_body={'refresh_token': self.refresh_tokens.popleft()})
+        if status == 200:
+            self.refresh_tokens.append(body['refresh_token'])
+        return status
+
+    async def register(self):
+        status, _ = await self.request('POST', '/api/auth/register', json_body={
+            'name': f'registered-{next(self.counter)}',
+            'raw_password': 'bench'})
+        return status
+
+    async def admin_list_users(self):
+        status, _ = await self.request('GET', '/api/admin/users?limit=20',
+                                       headers=self.admin_headers)
+        return status
+
+    async def admin_get_user(self):
+        user_id = self.pick(self.user_ids, next(self.counter))
+        status, _ = await self.request('GET', f'/api/admin/users/{user_id}',
+                                       headers=self.admin_headers)
+        return status
+
+    async def admin_export_todos(self):
+        status, _ = await self.request('GET', '/api/admin/todos/export',
+                                       headers=self.admin_headers)
+        return status
+
+    async def admin_todo_stats(self):
+        status, _ = await self.request('GET', '/api/admin/todos/stats',
+                                       headers=self.admin_headers)
+        return status
+
+    async def admin_update_user(self):
+        n = next(self.counter) % (len(self.user_ids) - 1)
+        status, _ = await self.request(
+            'PUT', f'/api/admin/users/{self.user_ids[n]}',
+            headers=self.admin_headers,
+            json_body={'name': f'bench-{n}', 'raw_password': 'bench',
+                       'permissions': MAIN_PERMISSIONS})
+        return status
+
+    async def admin_insert_user(self):
+        status, _ = await self.request(
+            'POST', '/api/admin/users', headers=self.admin_headers,
+            json_body={'name': f'inserted-{next(self.counter)}',
+                       'raw_password': 'bench',
+                       'permissions': MAIN_PERMISSIONS})
+        return status
+
+    async def admin_provision_users(self):
+        n = next(self.counter)
+        status, _ = await self.request(
+            'POST', '/api/admin/users/bulk', headers=self.admin_headers,
+            json_body=[{'name': f'provisioned-{n}-{i}',
+                        'raw_password': 'bench',
+                        'permissions': MAIN_PERMISSIONS}
+                       for i in range(10)])
+        return status
+
+    async def admin_delete_user(self):
+        if not self.created_users:
+            return 599
+        status, _ = await self.request(
+            'DELETE', f'/api/admin/users/{self.created_users.popleft()}',
+            headers=self.admin_headers)
+        return status
+
+
+def api_routes() -> set[str]:
+    from app.admin import admin_router
+    from app.main import main_router
+    return {f'{method} {route.path}'
+            for route in main_router.routes + admin_router.routes
+            for method in route.methods}
+
+
+def warn_uncovered(kind: str, names):
+    if names:
+        print(f"warning: no benchmark for {kind}: {', '.join(sorted(names))}",
+              file=sys.stderr)
+
+
+async def run_routes(args) -> dict:
+    from app import api
+    scenarios = RouteScenarios(common.AsgiClient(api))
+    await scenarios.prepare(args.concurrency, args.requests)
+    planned = scenarios.scenarios()
+    warn_uncovered('routes', api_routes() - {route for route, _, _ in planned})
+
+    # warm up the pools and caches on the read path
+    await common.run_load(scenarios.list_todos, 10, 50)
+    results = {}
+    for route, slow, make_request in planned:
+        if args.only and route not in args.only:
+            continue
+        total = args.slow_requests if slow else args.requests
+        results[route] = await common.run_load(
+            make_request, min(args.concurrency, total), total)
+        print(f"{route:<36} {results[route]['rps']:>9} "
+              f"{results[route]['p50_ms']:>9} {results[route]['p95_ms']:>9} "
+              f"{results[route]['p99_ms']:>9} {results[route]['errors']:>7}",
+              file=sys.stderr)
+    return results
+
+
+def time_calls(fn, iterations: int) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return common.summarize(latencies, time.perf_counter() - started)
+
+
+def micro_cases(db) -> list[tuple[str, object]]:
+    """(name, no argument callable) for the auth helpers and crud functions
+
+    Calls that consume something (deletes, token rotation) take it from
+    what the calls before them created.
+    """
+    from starlette.requests import Request
+    from app import crud
+    from app.internal import auth
+    from app.internal.schemas import TodoBatchUpdateSchema, TodoCreateSchema
+    from app.internal.schemas import TodoUpdateSchema, UserInsertSchema
+    from app.internal.schemas import TodoSortField
+
+    counter = itertools.count()
+    user = crud.get_user_by_username(db, 'bench-0')
+    user_id = user.id
+    password = user.password
+    todo_ids = [todo.id for todo in crud.get_todos_for_user(db, 0, 1000,
+                                                            user_id)]
+    created_todos = collections.deque()
+    batch_created_todos = collections.deque()
+    created_users = collections.deque()
+    saved_tokens = collections.deque()
+    family_id = crud.new_token_family_id()
+    token = auth.generate_auth_token(user)
+    request = Request({'type': 'http', 'headers': [
+        (b'authorization', f'Token {token}'.encode())]})
+
+    def verify_uncached():
+        auth.verified_token_cache.clear()
+        auth.verify_auth_token(request)
+
+    def create_todo():
+        created_todos.append(crud.create_todo(db, TodoCreateSchema(
+            name=f'micro-{next(counter)}', description='benchmark'),
+            user_id).id)
+
+    def create_todos():
+        n = next(counter)
+        batch_created_todos.extend(result.id for result in crud.create_todos(
+            db, [TodoCreateSchema(name=f'micro-batch-{n}-{i}',
+                                  description='benchmark')
+                 for i in range(10)], user_id))
+
+    def update_todos():
+        n = next(counter)
+        crud.update_todos(db, [TodoBatchUpdateSchema(
+            id=todo_ids[(n + i) % len(todo_ids)], done=n % 2 == 0)
+            for i in range(10)], user_id)
+
+    def delete_todos():
+        crud.delete_todos(db, [batch_created_todos.popleft() for _ in range(
+            min(10, len(batch_created_todos)))], user_id)
+
+    def insert_user():
+        created_users.append(crud.insert_user(db, UserInsertSchema(
+            name=f'micro-user-{next(counter)}', password=password,
+            permissions=MAIN_PERMISSIONS)).id)
+
+    def create_users():
+        n = next(counter)
+        created_users.extend(result.id for result in crud.create_users(
+            db, [UserInsertSchema(name=f'micro-users-{n}-{i}',
+                                  password=password,
+                                  permissions=MAIN_PERMISSIONS)
+                 for i in range(10)]))
+
+    def save_refresh_token():
+        saved_tokens.append(crud.save_refresh_token(
+            db, auth.generate_refresh_token(), user_id, family_id).token)
+
+    def add_child_refresh_token():
+        parent = crud.get_refresh_token(db, saved_tokens.popleft())
+        child = crud.get_refresh_token(db, saved_tokens[0])
+        crud.add_child_refresh_token(db, parent, child)
+
+    def deactivate_token_family():
+        crud.deactivate_token_family(
+            db, crud.get_refresh_token(db, saved_tokens[0]))
+
+    middle = todo_ids[len(todo_ids) // 2]
+    return [
+        ('auth.generate_auth_token', lambda: auth.generate_auth_token(user)),
+        ('auth.verify_auth_token', lambda: auth.verify_auth_token(request)),
+        ('auth.verify_auth_token uncached', verify_uncached),
+        ('crud.get_todo_list_version',
+         lambda: crud.get_todo_list_version(db, user_id)),
+        ('crud.get_todo_stats', lambda: crud.get_todo_stats(db, user_id)),
+        ('crud.get_all_todo_stats', lambda: crud.get_all_todo_stats(db)),
+        ('crud.get_todos', lambda: crud.get_todos(db, 0, 20)),
+        ('crud.get_todos_for_user',
+         lambda: crud.get_todos_for_user(db, 0, 20, user_id)),
+        ('crud.get_todos_for_user_after',
+         lambda: crud.get_todos_for_user_after(db, middle, 20, user_id)),
+        ('crud.list_todo_rows_for_user',
+         lambda: crud.list_todo_rows_for_user(db, user_id, 100)),
+        ('crud.list_todos_for_user',
+         lambda: crud.list_todos_for_user(db, user_id, 20, done=False,
+                                          name_prefix='todo-1',
+                                          sort=TodoSortField.name)),
+        ('crud.iter_todos',
+         lambda: sum(len(rows) for rows in crud.iter_todos(db, user_id, 1000))),
+        ('crud.todo_search_expression',
+         lambda: crud.todo_search_expression('buy "milk" tom*')),
+        ('crud.search_todo_rows',
+         lambda: crud.search_todo_rows(db, 'todo', 20, user_id)),
+        ('crud.search_todos',
+         lambda: crud.search_todos(db, 'todo', 20, user_id)),
+        ('crud.create_todo', create_todo),
+        ('crud.get_todo_by_id',
+         lambda: crud.get_todo_by_id(
+             db, todo_ids[next(counter) % len(todo_ids)], user_id)),
+        ('crud.todo_name_exists_for_user',
+         lambda: crud.todo_name_exists_for_user(db, 'todo-0', user_id)),
+        ('crud.get_todo_by_name',
+         lambda: crud.get_todo_by_name(db, 'todo-0', user_id)),
+        ('crud.update_todo_by_id',
+         lambda: crud.update_todo_by_id(db, middle, TodoUpdateSchema(
+             done=next(counter) % 2 == 0), user_id)),
+        ('crud.delete_todo_by_id',
+         lambda: created_todos and crud.delete_todo_by_id(
+             db, created_todos.popleft(), user_id)),
+        ('crud.create_todos', create_todos),
+        ('crud.update_todos', update_todos),
+        ('crud.delete_todos', delete_todos),
+        ('crud.get_user_by_username',
+         lambda: crud.get_user_by_username(db, 'bench-0')),
+        ('crud.get_user_by_id', lambda: crud.get_user_by_id(db, user_id)),
+        ('crud.list_users', lambda: crud.list_users(db, 0, 20)),
+        ('crud.list_users_after',
+         lambda: crud.list_users_after(db, user_id, 20)),
+        ('crud.insert_user', insert_user),
+        ('crud.taken_user_names',
+         lambda: crud.taken_user_names(db, ['bench-0', 'bench-admin', 'x'])),
+        ('crud.create_users', create_users),
+        ('crud.update_user',
+         lambda: created_users and crud.update_user(
+             db, created_users[0], UserInsertSchema(
+                 name=f'micro-renamed-{next(counter)}', password=password,
+                 permissions=MAIN_PERMISSIONS))),
+        ('crud.delete_user',
+         lambda: created_users and crud.delete_user(db, created_users.popleft())),
+        ('crud.new_token_family_id', crud.new_token_family_id),
+        ('crud.save_refresh_token', save_refresh_token),
+        ('crud.refresh_token_used',
+         lambda: crud.refresh_token_used(db, saved_tokens[-1])),
+        ('crud.get_refresh_token',
+         lambda: crud.get_refresh_token(db, saved_tokens[-1])),
+        ('crud.disable_token',
+         lambda: crud.disable_token(db, saved_tokens[-1])),
+        ('crud.add_child_refresh_token',
+         lambda: len(saved_tokens) > 1 and add_child_refresh_token()),
+        ('crud.deactivate_token_family', deactivate_token_family),
+        ('crud.assign_token_families',
+         lambda: crud.assign_token_families(db)),
+        ('crud.delete_expired_refresh_tokens',
+         lambda: crud.delete_expired_refresh_tokens(
+             db, datetime.datetime.now(), 500)),
+    ]
+
+
+def run_micro(args) -> dict:
+    from app import crud
+    from app.internal.db import SessionLocal
+
+    results = {}
+    with SessionLocal() as db:
+        cases = micro_cases(db)
+        public = {name for name, fn in inspect.getmembers(crud, inspect.isfunction)
+                  if fn.__module__ == crud.__name__ and not name.startswith('_')}
+        warn_uncovered('crud functions',
+                       public - {name.split('.', 1)[1].split()[0]
+                                 for name, _ in cases if name.startswith('crud.')})
+        for name, fn in cases:
+            if args.only and name not in args.only:
+                continue
+            results[name] = time_calls(fn, args.iterations)
+            print(f"{name:<36} {results[name]['rps']:>9} "
+                  f"{results[name]['p50_ms']:>9} {results[name]['p95_ms']:>9} "
+                  f"{results[name]['p99_ms']:>9}", file=sys.stderr)
+    return results
+
+
+def run(args):
+    common.prepare_workdir(database_async=args.mode == 'async')
+    with contextlib.redirect_stdout(io.StringIO()):
+        common.quiet_engines()
+        seed(args.users, args.todos)
+        print(f"{'':<36} {'per s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'errors':>7}", file=sys.stderr)
+        routes = asyncio.run(run_routes(args))
+        micro = run_micro(args)
+    result = {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'mode': args.mode,
+            'users': args.users,
+            'todos': args.todos,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'slow_requests': args.slow_requests,
+            'iterations': args.iterations,
+        },
+        'routes': routes,
+        'micro': micro,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_fd:
+            output_fd.write(output + '\n')
+    else:
+        print(output)
+
+
+def regressions(baseline: dict, current: dict, threshold: float,
+                metrics=('rps', 'p50_ms', 'p95_ms')) -> list[str]:
+    """Lines describing every metric that got worse by more than threshold
+
+    Throughput regresses when it drops below (1 - threshold) of the
+    baseline, latencies when they grow beyond (1 + threshold). New errors
+    are always a regression.
+    """
+    found = []
+    for section in ('routes', 'micro'):
+        for name, before in baseline.get(section, {}).items():
+            after = current.get(section, {}).get(name)
+            if after is None:
+                found.append(f"{name}: missing from the current results")
+                continue
+            for metric in metrics:
+                higher_is_better = METRIC_DIRECTIONS[metric]
+                old, new = before[metric], after[metric]
+                worse = new < old * (1 - threshold) if higher_is_better \
+                    else new > old * (1 + threshold)
+                if worse:
+                    change = (new - old) / old * 100 if old else float('inf')
+                    found.append(f"{name}: {metric} {old} -> {new} "
+                                 f"({change:+.1f}%)")
+            if after.get('errors', 0) > before.get('errors', 0):
+                found.append(f"{name}: errors {before.get('errors', 0)} -> "
+                             f"{after['errors']}")
+    return found
+
+
+def compare(args):
+    with open(args.baseline) as baseline_fd:
+        baseline = json.load(baseline_fd)
+    with open(args.current) as current_fd:
+        current = json.load(current_fd)
+    found = regressions(baseline, current, args.threshold, args.metrics)
+    for line in found:
+        print(f"REGRESSION {line}")
+    if found:
+        sys.exit(1)
+    print(f"no regressions beyond {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--users', type=int, default=1000)
+    run_parser.add_argument('--todos', type=int, default=100,
+                            help="todos per user")
+    run_parser.add_argument('--concurrency', type=int, default=20)
+    run_parser.add_argument('--requests', type=int, default=1000,
+                            help="requests per route")
+    run_parser.add_argument('--slow-requests', type=int, default=20,
+                            help="requests per route that hashes a password")
+    run_parser.add_argument('--iterations', type=int, default=200,
+                            help="calls per micro-benchmark")
+    run_parser.add_argument('--mode', choices=['sync', 'async'],
+                            default='sync')
+    run_parser.add_argument('--only', nargs='+',
+                            help="routes or micro-benchmarks to run")
+    run_parser.add_argument('--output', help="JSON file, default stdout")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser(
+        'compare', help="compare results against a baseline")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="tolerated relative change")
+    compare_parser.add_argument('--metrics', nargs='+',
+                                choices=list(METRIC_DIRECTIONS),
+                                default=['rps', 'p50_ms', 'p95_ms'])
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
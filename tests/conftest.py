@@ -0,0 +1,5 @@
+import os
+
+
+# the app reads its settings file on first use, before any test runs
+os.environ.setdefault('TODO_CONFIG', 'test-config.yaml')
@@ -0,0 +1,106 @@
+import fastapi
+import pytest
+import sqlalchemy
+from starlette.testclient import TestClient
+
+from app.admin import admin_router
+from app.crud import insert_user, search_users
+from app.internal import config
+from app.internal.auth import verify_auth_token
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.hashing import hashing_executor
+from app.internal.schemas import UserInsertSchema
+
+
+NAMES = ['alice', 'Bob', 'ALBERT', 'Alice', 'al', 'alicia', 'Ålesund']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(hashing_executor, 'workers', 0)
+    monkeypatch.setattr(config, 'bcrypt_rounds', 4)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        for name in NAMES:
+            insert_user(db, UserInsertSchema(name=name, password='',
+                                             permissions=[1]))
+    app = fastapi.FastAPI()
+    app.include_router(admin_router)
+    app.dependency_overrides[verify_auth_token] = lambda: {'sub': 1, 'perm': -1}
+    yield TestClient(app)
+    Base.metadata.drop_all(bind=engine)
+
+
+def page_through(client, url: str) -> list[str]:
+    names, cursor = [], None
+    while True:
+        response = client.get(url + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        names += [user['name'] for user in response.json()]
+        cursor = response.headers.get('x-next-cursor')
+        if not cursor:
+            return names
+
+
+def test_prefix_search_ignores_case(client):
+    assert page_through(client, '/api/admin/users?username_filter=AL&limit=2') \
+        == ['al', 'ALBERT', 'alice', 'Alice', 'alicia']
+    assert page_through(client, '/api/admin/users?username_filter=ålE') == \
+        ['Ålesund']
+    assert page_through(client, '/api/admin/users?username_filter=bob') == ['Bob']
+    assert page_through(client, '/api/admin/users?username_filter=x') == []
+    assert client.get('/api/admin/users?username_filter=a&cursor=WzFd')\
+        .status_code == 400
+
+
+def test_limit_is_capped(client, monkeypatch):
+    monkeypatch.setattr(config, 'admin_users_max_limit', 3)
+    response = client.get('/api/admin/users?limit=100')
+    assert len(response.json()) == 3 and 'x-next-cursor' in response.headers
+    assert len(page_through(client, '/api/admin/users?limit=100')) == 7
+
+
+def test_search_uses_the_index(client):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        with SessionLocal() as db:
+            search_users(db, 'Al', 20, after=('albert', 3))
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', capture)
+    statement, parameters = statements[-1]
+
+    with engine.connect() as conn:
+        plan = [row[3] for row in conn.exec_driver_sql(
+            f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    assert plan == ['SEARCH users USING INDEX ix_users_name_lower_id '
+                    '(name_lower>? AND name_lower<?)'], plan
+
+
+def test_user_writes(client):
+    created = client.post('/api/admin/users', json={
+        'name': 'Carol', 'raw_password': 'secret', 'permissions': [1]})
+    assert created.status_code == 200
+    user_id = created.json()['id']
+    assert client.post('/api/admin/users', json={
+        'name': 'Carol', 'raw_password': 'x', 'permissions': [1]}
+    ).status_code == 400
+
+    updated = client.put(f'/api/admin/users/{user_id}', json={
+        'name': 'Caroline', 'raw_password': '', 'permissions': [1, 2]})
+    assert updated.status_code == 200
+    assert updated.json()['password'] == created.json()['password']
+    assert updated.json()['permissions'] == [1, 2]
+    assert page_through(client, '/api/admin/users?username_filter=caro') == \
+        ['Caroline']
+    assert client.put(f'/api/admin/users/{user_id}', json={
+        'name': 'alice', 'raw_password': '', 'permissions': [1]}
+    ).status_code == 400
+    assert client.put('/api/admin/users/999', json={
+        'name': 'x', 'raw_password': '', 'permissions': [1]}).status_code == 404
+
+    assert client.delete(f'/api/admin/users/{user_id}').status_code == 200
+    assert client.delete(f'/api/admin/users/{user_id}').status_code == 400
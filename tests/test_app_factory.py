@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP = """
+import os
+from starlette.testclient import TestClient
+import app
+import app.internal.db as db
+
+api = app.api
+assert db._engine is None, "import created the engine"
+assert not os.path.exists(DB_FILE), "import touched the database"
+try:
+    with TestClient(app.create_app()):
+        pass
+except RuntimeError as e:
+    print(e)
+
+from app.internal.migrations import migrate
+list(migrate(db.get_engine()))
+with TestClient(api) as client:
+    print(client.get('/api/todos').status_code)
+"""
+
+
+def test_import_is_side_effect_free(tmp_path):
+    db_file = tmp_path / 'db.sqlite'
+    settings = tmp_path / 'config.yaml'
+    with open(os.path.join(REPO_ROOT, 'test-config.yaml')) as test_config:
+        settings.write_text(test_config.read().replace(
+            'test.sqlite', str(db_file)))
+    result = subprocess.run(
+        [sys.executable, '-c', f"DB_FILE = {str(db_file)!r}\n" + STARTUP],
+        cwd=REPO_ROOT, env={**os.environ, 'TODO_CONFIG': str(settings)},
+        capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == [
+        "the database has no tables, run `python -m app migrate`", '401']
+
+
+CONFIGURED = """
+import asyncio
+import app
+from app.internal import auth, cache, db, hashing, reaper
+
+api = app.create_app(SETTINGS)
+print(type(cache.region.backend).__name__, hashing.hashing_executor.workers,
+      auth.verified_token_cache.maxsize,
+      reaper.refresh_token_reaper.interval)
+
+
+async def session_type():
+    db.init_engines()
+    sessions = db.get_session()
+    session = await sessions.__anext__()
+    await sessions.aclose()
+    return type(session).__name__
+
+
+print(asyncio.run(session_type()))
+"""
+
+
+def test_app_follows_its_settings_file(tmp_path):
+    settings = tmp_path / 'other.yaml'
+    with open(os.path.join(REPO_ROOT, 'test-config.yaml')) as test_config:
+        settings.write_text(
+            test_config.read().replace('test.sqlite', str(tmp_path / 'db'))
+            .replace('database_async: false', 'database_async: true')
+            .replace('dogpile.cache.memory', 'dogpile.cache.null')
+            + 'hashing_workers: 2\nauth_token_cache_size: 7\n'
+              'token_reaper_interval: 0\n')
+    # TODO_CONFIG is never read
+    result = subprocess.run(
+        [sys.executable, '-c', f"SETTINGS = {str(settings)!r}\n" + CONFIGURED],
+        cwd=REPO_ROOT, env={**os.environ, 'TODO_CONFIG': 'missing.yaml'},
+        capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == ['NullBackend 2 7 0', 'AsyncSession']
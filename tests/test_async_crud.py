@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import pytest
+
+from app import acrud
+from app.internal import config
+from app.internal.cache import invalidate, user_scope
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.schemas import TodoCreateSchema, TodoUpdateSchema
+
+pytest.importorskip("aiosqlite")
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+
+async def _todo_roundtrip(db, user_id: int):
+    todo = await acrud.create_todo(
+        db, TodoCreateSchema(name='async', description='async'), user_id)
+    assert todo.id > 0
+    assert not todo.done
+
+    todos = await acrud.get_todos_for_user(db, 0, 100, user_id)
+    assert [t.name for t in todos] == ['async']
+
+    todo = await acrud.update_todo_by_id(db, todo.id,
+                                         TodoUpdateSchema(done=True), user_id)
+    assert todo.done
+
+    assert await acrud.delete_todo_by_id(db, todo.id, user_id) == 1
+    assert not await acrud.get_todo_by_id(db, todo.id, user_id)
+
+
+class TestAsyncCrud:
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine)
+
+    def teardown_class(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def test_sync_session(self):
+        async def run():
+            with SessionLocal() as db:
+                await _todo_roundtrip(db, 1)
+        asyncio.run(run())
+
+    def test_async_session(self):
+        async def run():
+            async_engine = create_async_engine(config.database_async_url)
+            AsyncSessionLocal = sessionmaker(bind=async_engine,
+                                             class_=AsyncSession,
+                                             expire_on_commit=False)
+            async with AsyncSessionLocal() as db:
+                await _todo_roundtrip(db, 1)
+            await async_engine.dispose()
+        asyncio.run(run())
+
+    def test_async_concurrent_cache_misses(self):
+        async def run():
+            async_engine = create_async_engine(config.database_async_url)
+            AsyncSessionLocal = sessionmaker(bind=async_engine,
+                                             class_=AsyncSession,
+                                             expire_on_commit=False)
+
+            async def read():
+                async with AsyncSessionLocal() as db:
+                    return await acrud.get_todos_for_user(db, 0, 100, 2)
+
+            async with AsyncSessionLocal() as db:
+                await acrud.create_todo(
+                    db, TodoCreateSchema(name='miss', description=''), 2)
+            invalidate(user_scope(2))
+            results.extend(await asyncio.gather(*(read() for _ in range(5))))
+            await async_engine.dispose()
+
+        # readers missing the same key must not block the loop thread on
+        # each other, run in a thread so a deadlock fails instead of hanging
+        results = []
+        thread = threading.Thread(target=asyncio.run, args=(run(),), daemon=True)
+        thread.start()
+        thread.join(timeout=30)
+        assert not thread.is_alive()
+        assert [[t.name for t in r] for r in results] == [['miss']] * 5
@@ -0,0 +1,138 @@
+import datetime
+import time
+import jwt
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.internal import config
+from app.internal.auth import VerifiedTokenCache, verify_auth_token
+from app.internal.auth import require_permissions
+from app.internal.schemas import UserPermissionsEnum, mask_to_permissions
+from app.internal.schemas import permissions_to_mask
+from app.internal.auth import verified_token_cache
+
+
+def make_request(authorization: str) -> Request:
+    return Request({
+        'type': 'http',
+        'headers': [(b'authorization', authorization.encode())],
+    })
+
+
+def assert_rejected(authorization: str, status_code: int, detail: str):
+    with pytest.raises(HTTPException) as exc_info:
+        verify_auth_token(make_request(authorization))
+    assert exc_info.value.status_code == status_code
+    assert exc_info.value.detail == detail
+
+
+def make_token(**claims) -> str:
+    now = datetime.datetime.now()
+    payload = {
+        'sub': 1,
+        'iat': now,
+        'exp': now + datetime.timedelta(minutes=3),
+        'permissions': [1, 2],
+    }
+    payload.update(claims)
+    return jwt.encode(payload, key=config.jwt_encode_key,
+                      algorithm=config.jwt_algorithm)
+
+
+class TestVerifyAuthToken:
+    def setup_method(self):
+        verified_token_cache.clear()
+
+    def test_cached_after_first_decode(self):
+        token = make_token()
+        hits = verified_token_cache.hits
+
+        first = verify_auth_token(make_request(f"Token {token}"))
+        second = verify_auth_token(make_request(f"Token {token}"))
+
+        assert first == second
+        assert first['sub'] == 1
+        assert verified_token_cache.hits == hits + 1
+
+    def test_cached_claims_are_copies(self):
+        token = make_token()
+        claims = verify_auth_token(make_request(f"Token {token}"))
+        claims['permissions'].append(100)
+        claims['sub'] = 2
+
+        cached = verify_auth_token(make_request(f"Token {token}"))
+        cached['permissions'].append(100)
+        again = verify_auth_token(make_request(f"Token {token}"))
+        assert again['sub'] == 1 and again['permissions'] == [1, 2]
+
+    def test_expired_token(self):
+        now = datetime.datetime.now()
+        token = make_token(iat=now - datetime.timedelta(minutes=5),
+                           exp=now - datetime.timedelta(minutes=1))
+        for _ in range(2):
+            assert_rejected(f"Token {token}", 401, "Token Expired")
+        assert verified_token_cache.stats()['size'] == 0
+
+    def test_invalid_tokens(self):
+        token = make_token()
+        verify_auth_token(make_request(f"Token {token}"))
+
+        assert_rejected(f"Token {token[:-2]}", 403, "Invalid Token")
+        assert_rejected(f"Bearer {token}", 401, "No Token")
+        assert_rejected("Token", 401, "No Token")
+
+
+class TestVerifiedTokenCache:
+    def test_lru_eviction(self):
+        cache = VerifiedTokenCache(maxsize=2)
+        exp = int(datetime.datetime.now().timestamp()) + 60
+        cache.put('a', {'exp': exp})
+        cache.put('b', {'exp': exp})
+        assert cache.get('a')
+        cache.put('c', {'exp': exp})
+
+        assert cache.get('b') is None
+        assert cache.get('a') and cache.get('c')
+        assert cache.stats() == {'hits': 3, 'misses': 1,
+                                 'size': 2, 'maxsize': 2}
+
+    def test_entries_expire_with_token(self):
+        cache = VerifiedTokenCache(maxsize=2)
+        cache.put('a', {'exp': int(time.time()) - 1})
+        assert cache.get('a') is None
+        assert cache.stats()['size'] == 0
+
+    def test_disabled(self):
+        cache = VerifiedTokenCache(maxsize=0)
+        cache.put('a', {'exp': 2 ** 40})
+        assert cache.get('a') is None
+
+
+class TestRequirePermissions:
+    def setup_method(self):
+        verified_token_cache.clear()
+
+    def check(self, token: str, *permissions: UserPermissionsEnum) -> dict:
+        claims = verify_auth_token(make_request(f"Token {token}"))
+        return require_permissions(*permissions)(claims)
+
+    def test_mask_roundtrip(self):
+        permissions = [UserPermissionsEnum.personal_read,
+                       UserPermissionsEnum.admin]
+        assert permissions_to_mask(permissions) == 0b1001
+        assert mask_to_permissions(0b1001) == permissions
+
+    def test_bitmask_claim(self):
+        token = make_token(perm=0b11, permissions=None)
+        assert self.check(token, UserPermissionsEnum.personal_read,
+                          UserPermissionsEnum.personal_write)['sub'] == 1
+        with pytest.raises(HTTPException) as exc_info:
+            self.check(token, UserPermissionsEnum.admin)
+        assert exc_info.value.status_code == 403
+
+    def test_legacy_list_claim(self):
+        token = make_token(permissions=[1, 100])
+        assert self.check(token, UserPermissionsEnum.admin)['perm'] == 0b1001
+        with pytest.raises(HTTPException):
+            self.check(token, UserPermissionsEnum.personal_write)
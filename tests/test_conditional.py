@@ -0,0 +1,100 @@
+import fastapi
+import pytest
+import sqlalchemy
+from starlette.testclient import TestClient
+
+from app.crud import StaleVersionError, create_todo, delete_todo_by_id
+from app.crud import get_todo_by_id, get_todo_list_version, update_todos
+from app.internal.auth import verify_auth_token
+from app.internal.cache import invalidate_all
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.schemas import TodoBatchUpdateSchema, TodoCreateSchema
+from app.main import main_router
+
+
+@pytest.fixture
+def client():
+    Base.metadata.create_all(bind=engine)
+    invalidate_all()
+    app = fastapi.FastAPI()
+    app.include_router(main_router)
+    app.dependency_overrides[verify_auth_token] = lambda: {'sub': 1, 'perm': -1}
+    yield TestClient(app)
+    Base.metadata.drop_all(bind=engine)
+    invalidate_all()
+
+
+def test_versions_follow_writes(client):
+    with SessionLocal() as db:
+        first = create_todo(db, TodoCreateSchema(name='a', description=''), 1)
+        second = create_todo(db, TodoCreateSchema(name='b', description=''), 1)
+        create_todo(db, TodoCreateSchema(name='a', description=''), 2)
+        assert (first.version, second.version) == (1, 2)
+        assert get_todo_list_version(db, 1) == 2
+
+        updated = update_todos(db, [TodoBatchUpdateSchema(id=first.id,
+                                                          done=True)], 1)
+        assert updated[0].version == get_todo_list_version(db, 1) == 3
+        with pytest.raises(StaleVersionError):
+            delete_todo_by_id(db, first.id, 1, versions=[1])
+        assert delete_todo_by_id(db, first.id, 1, versions=[3]) == 1
+        assert get_todo_list_version(db, 1) == 4
+        assert get_todo_list_version(db, 2) == 1
+
+
+def test_list_not_modified_without_reading_todos(client):
+    client.post('/api/todos', json={'name': 'a', 'description': ''})
+    etag = client.get('/api/todos').headers['etag']
+    invalidate_all()
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get('/api/todos?done=false',
+                              headers={'If-None-Match': f'W/{etag}'})
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', capture)
+
+    assert response.status_code == 304 and response.content == b''
+    assert response.headers['etag'] == etag
+    assert statements and not any('FROM todos' in s for s in statements)
+
+    client.post('/api/todos', json={'name': 'b', 'description': ''})
+    response = client.get('/api/todos', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and len(response.json()) == 2
+    assert client.get('/api/todos/search?q=b', headers={
+        'If-None-Match': response.headers['etag']}).status_code == 304
+
+
+def test_if_match(client):
+    created = client.post('/api/todos', json={'name': 'a', 'description': ''})
+    url = created.headers['location']
+    etag = created.headers['etag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    updated = client.put(url, json={'done': True}, headers={'If-Match': etag})
+    assert updated.status_code == 200 and updated.headers['etag'] != etag
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
+
+    assert client.put(url, json={'done': False},
+                      headers={'If-Match': etag}).status_code == 412
+    assert client.delete(url, headers={'If-Match': etag}).status_code == 412
+    assert client.delete(url, headers={
+        'If-Match': f"{etag}, {updated.headers['etag']}"}).status_code == 200
+    assert client.delete(url, headers={'If-Match': '*'}).status_code == 404
+
+
+def test_other_users_todos_are_not_found(client):
+    with SessionLocal() as db:
+        theirs = create_todo(db, TodoCreateSchema(name='a', description=''), 2)
+    url = f'/api/todos/{theirs.id}'
+    assert client.get(url).status_code == 404
+    assert client.put(url, json={'done': True}).status_code == 404
+    assert client.put(url, json={}).status_code == 404
+    assert client.delete(url).status_code == 404
+    assert client.delete(url, headers={'If-Match': '*'}).status_code == 404
+    with SessionLocal() as db:
+        assert get_todo_list_version(db, 2) == 1
+        assert get_todo_by_id(db, theirs.id, 2) == theirs
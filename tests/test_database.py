@@ -1,16 +1,31 @@
 import bcrypt
 import pytest
+from datetime import datetime, timedelta
 from sqlite3 import IntegrityError
 
 from app.internal.config import Config
 from app.crud import create_todo, delete_todo_by_id, delete_user
 from app.crud import get_todo_by_name, list_users, update_user
 from app.crud import get_todos_for_user, insert_user, get_user_by_username
+from app.crud import get_todos_for_user_after, list_users_after
+from app.crud import create_todos, update_todos, delete_todos
 from app.crud import get_todos, update_todo_by_id, get_user_by_id
+from app.crud import get_todo_by_id, get_todo_stats
 from app.internal.schemas import TodoCreateSchema, UserInsertSchema
 from app.internal.schemas import UserPermissionsEnum, TodoUpdateSchema
+from app.internal.schemas import TodoBatchUpdateSchema
 from app.internal.db import engine, Base, SessionLocal
-from app.internal.auth import bcrypt_password
+from app.internal.cache import LRUDict, cache_stats, invalidate_all
+from app.internal.cache import get_region
+from app.internal.models import RefreshToken, Todo
+from app.crud import get_refresh_token, save_refresh_token
+from app.crud import add_child_refresh_token, deactivate_token_family
+from app.crud import assign_token_families, delete_expired_refresh_tokens
+from app.internal.auth import bcrypt_password, register_user
+from app.internal.auth import authenticate_user_password, generate_new_token_pair
+from app.internal.schemas import TokenRefreshRequest
+from fastapi import HTTPException
+from sqlalchemy import event, select
 
 
 TEST_TODO = TodoCreateSchema(
@@ -84,6 +99,29 @@ class TestTodos:
             todos = get_todos_for_user(db, offset=0, limit=100, user_id=0)
             assert len(todos) == 0
 
+    def test_get_todos_for_user_after(self):
+        with SessionLocal() as db:
+            user_id = self._base_user.id
+            todo = TodoCreateSchema(
+                name='test_page',
+                description='test_page',
+            )
+            create_todo(db, todo, user_id)  # type: ignore
+            first, second = get_todos_for_user(db, offset=0, limit=2,
+                                               user_id=user_id)  # type: ignore
+
+            todos = get_todos_for_user_after(db, after_id=0, limit=1,
+                                             user_id=user_id)  # type: ignore
+            assert [t.id for t in todos] == [first.id]
+
+            todos = get_todos_for_user_after(db, after_id=first.id, limit=100,
+                                             user_id=user_id)  # type: ignore
+            assert [t.id for t in todos] == [second.id]
+
+            todos = get_todos_for_user_after(db, after_id=first.id, limit=100,
+                                             user_id=0)
+            assert len(todos) == 0
+
     def test_get_todo_by_name(self):
         with SessionLocal() as db:
             user_id = self._base_user.id
@@ -107,23 +145,192 @@ class TestTodos:
 
             # set todo.done to true
             update = TodoUpdateSchema(done=True)  # type: ignore
-            todo = update_todo_by_id(db, todo.id, update)  # type: ignore
+            todo = update_todo_by_id(db, todo.id, update, user_id)  # type: ignore
 
             # check todo.done == true
             assert todo.done
 
+    def test_update_todo_by_id_existing_name(self):
+        with SessionLocal() as db:
+            user_id = self._base_user.id
+            todo = get_todo_by_name(db, 'test_update', user_id)  # type: ignore
+            update = TodoUpdateSchema(name='test')  # type: ignore
+            with pytest.raises(IntegrityError,
+                               match="^Todo name exists in the user scope$"):
+                update_todo_by_id(db, todo.id, update, user_id)  # type: ignore
+
+            assert not update_todo_by_id(db, 0, update, user_id)
+
     def test_delete_todo_by_id(self):
         with SessionLocal() as db:
             user_id = self._base_user.id
             todo = get_todo_by_name(db, 'test', user_id)  # type: ignore
             assert todo
 
-            deleted = delete_todo_by_id(db, todo.id)  # type: ignore
+            deleted = delete_todo_by_id(db, todo.id, user_id)  # type: ignore
             assert deleted == 1
 
             todo = get_todo_by_name(db, 'test', user_id)  # type: ignore
             assert not todo
 
+    def test_single_todo_writes_dont_read(self):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement.split()[0].upper())
+        with SessionLocal() as db:
+            user_id = self._base_user.id
+            stats = get_todo_stats(db, user_id)
+            event.listen(engine, 'before_cursor_execute', capture)
+            try:
+                todo = create_todo(db, TodoCreateSchema(name='once',
+                                                        description=''),
+                                   user_id)
+                created = list(statements)
+                statements.clear()
+                todo = update_todo_by_id(db, todo.id, TodoUpdateSchema(
+                    name='twice', done=True), user_id)
+                updated = list(statements)
+                statements.clear()
+                assert delete_todo_by_id(db, todo.id, user_id) == 1
+                deleted = list(statements)
+            finally:
+                event.remove(engine, 'before_cursor_execute', capture)
+            assert (todo.name, todo.done) == ('twice', True)
+            assert get_todo_stats(db, user_id) == stats
+        # version bump, the write, todo_stats
+        assert created == ['INSERT', 'INSERT', 'INSERT']
+        assert updated == ['INSERT', 'INSERT', 'UPDATE']
+        assert deleted == ['INSERT', 'DELETE', 'INSERT']
+
+
+class TestTodoBatches:
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine)
+        self._user_id = 1
+
+    def teardown_class(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def test_create_todos(self):
+        with SessionLocal() as db:
+            create_todo(db, TodoCreateSchema(name='a', description='a'),
+                        self._user_id)
+            results = create_todos(db, [
+                TodoCreateSchema(name='a', description='exists'),
+                TodoCreateSchema(name='b', description='b'),
+                TodoCreateSchema(name='b', description='repeated'),
+                TodoCreateSchema(name='c', description='c'),
+            ], self._user_id)
+
+            assert isinstance(results[0], IntegrityError)
+            assert results[1].name == 'b' and results[1].id > 0
+            assert isinstance(results[2], IntegrityError)
+            assert results[3].name == 'c' and results[3].id > 0
+            assert get_todo_by_name(db, 'b', self._user_id).description == 'b'
+
+    def test_update_todos(self):
+        with SessionLocal() as db:
+            a = get_todo_by_name(db, 'a', self._user_id)
+            b = get_todo_by_name(db, 'b', self._user_id)
+            results = update_todos(db, [
+                TodoBatchUpdateSchema(id=a.id, name='b'),
+                TodoBatchUpdateSchema(id=b.id, name='z', done=True),
+                TodoBatchUpdateSchema(id=a.id, name='b'),
+                TodoBatchUpdateSchema(id=a.id, done=True),
+                TodoBatchUpdateSchema(id=0, done=True),
+            ], self._user_id)
+
+            assert isinstance(results[0], IntegrityError)
+            assert results[1].name == 'z' and results[1].done
+            assert results[2].name == 'b'
+            assert results[3].done
+            assert isinstance(results[4], LookupError)
+            assert get_todo_by_name(db, 'b', self._user_id).id == a.id
+
+            # renames chained through the batch apply in item order
+            c = get_todo_by_name(db, 'c', self._user_id)
+            results = update_todos(db, [
+                TodoBatchUpdateSchema(id=a.id, name='x'),
+                TodoBatchUpdateSchema(id=c.id, name='b'),
+                TodoBatchUpdateSchema(id=a.id, name='c'),
+            ], self._user_id)
+            assert [r.name for r in results] == ['x', 'b', 'c']
+            assert get_todo_by_name(db, 'c', self._user_id).id == a.id
+
+            # another user's todos can't be touched
+            results = update_todos(db, [TodoBatchUpdateSchema(id=a.id)], 0)
+            assert isinstance(results[0], LookupError)
+
+    def test_delete_todos(self):
+        with SessionLocal() as db:
+            todos = get_todos_for_user(db, 0, 100, self._user_id)
+            ids = [t.id for t in todos]
+            results = delete_todos(db, [ids[0], ids[0], 0], self._user_id)
+
+            assert results[0] == ids[0]
+            assert isinstance(results[1], LookupError)
+            assert isinstance(results[2], LookupError)
+            remaining = get_todos_for_user(db, 0, 100, self._user_id)
+            assert [t.id for t in remaining] == ids[1:]
+
+
+class TestTodoCache:
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine)
+        invalidate_all()
+        self._user_id = 1
+
+    def teardown_class(self):
+        Base.metadata.drop_all(bind=engine)
+        invalidate_all()
+
+    def test_reads_are_cached(self):
+        with SessionLocal() as db:
+            todo = create_todo(db, TEST_TODO, self._user_id)
+            assert get_todo_by_id(db, todo.id, self._user_id).name == 'test'
+            assert len(get_todos_for_user(db, 0, 100, self._user_id)) == 1
+
+            # a write behind the cache's back stays invisible
+            db.query(Todo).filter(Todo.id == todo.id).update({'name': 'raw'})
+            db.commit()
+            hits = cache_stats.hits
+            assert get_todo_by_id(db, todo.id, self._user_id).name == 'test'
+            assert get_todos_for_user(db, 0, 100, self._user_id)[0].name == 'test'
+            assert cache_stats.hits == hits + 2
+
+    def test_writes_invalidate(self):
+        with SessionLocal() as db:
+            todo = get_todos_for_user(db, 0, 100, self._user_id)[0]
+            update_todo_by_id(db, todo.id, TodoUpdateSchema(done=True),
+                              self._user_id)
+            assert get_todo_by_id(db, todo.id, self._user_id).name == 'raw'
+            assert get_todos_for_user(db, 0, 100, self._user_id)[0].done
+
+            created = create_todos(
+                db, [TodoCreateSchema(name='b', description='b')],
+                self._user_id)
+            assert len(get_todos_for_user(db, 0, 100, self._user_id)) == 2
+
+            update_todos(db, [TodoBatchUpdateSchema(id=created[0].id, name='c')],
+                         self._user_id)
+            assert get_todo_by_id(db, created[0].id, self._user_id).name == 'c'
+
+            delete_todo_by_id(db, todo.id, self._user_id)
+            assert get_todo_by_id(db, todo.id, self._user_id) is None
+            delete_todos(db, [created[0].id], self._user_id)
+            assert get_todo_by_id(db, created[0].id, self._user_id) is None
+            assert get_todos_for_user(db, 0, 100, self._user_id) == []
+
+    def test_memory_backend_bounded(self):
+        assert isinstance(get_region().backend._cache, LRUDict)
+        cache_dict = LRUDict(2)
+        cache_dict['a'] = 1
+        cache_dict['b'] = 2
+        assert cache_dict.get('a') == 1
+        cache_dict['c'] = 3
+        assert list(cache_dict) == ['a', 'c']
+
 
 class TestUsers:
     def setup_class(self):
@@ -166,6 +373,13 @@ class TestUsers:
             users = list_users(db, 0, 100)
         assert len(users) == 1
 
+    def test_list_users_after(self):
+        with SessionLocal() as db:
+            user = get_user_by_username(db, 'test')
+            users = list_users_after(db, 0, 100)
+            assert [u.id for u in users] == [user.id]
+            assert list_users_after(db, user.id, 100) == []  # type: ignore
+
     def test_update_user(self):
         with SessionLocal() as db:
             user = get_user_by_username(db, 'test')
@@ -185,3 +399,95 @@ class TestUsers:
 
         assert deleted == 1
         assert not user
+
+
+class TestRefreshTokens:
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            register_user(db, 'test', 'test', [UserPermissionsEnum.personal_read])
+
+    def teardown_class(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def legacy_chain(self, db, length: int) -> list[str]:
+        tokens = [f'{id(self)}-{length}-{i}' for i in range(length)]
+        parent = save_refresh_token(db, tokens[0], 1, None)
+        for token in tokens[1:]:
+            child = save_refresh_token(db, token, 1, None)
+            add_child_refresh_token(db, parent, child)
+            parent = child
+        return tokens
+
+    def test_reuse_revokes_family(self):
+        with SessionLocal() as db:
+            first = authenticate_user_password(db, 'test', 'test')
+            other = authenticate_user_password(db, 'test', 'test')
+            second = generate_new_token_pair(
+                db, TokenRefreshRequest(refresh_token=first.refresh_token))
+            third = generate_new_token_pair(
+                db, TokenRefreshRequest(refresh_token=second.refresh_token))
+
+            family = [get_refresh_token(db, t.refresh_token)
+                      for t in (first, second, third)]
+            assert len({t.family_id for t in family}) == 1
+            assert get_refresh_token(db, other.refresh_token).family_id \
+                != family[0].family_id
+
+            with pytest.raises(HTTPException) as exc_info:
+                generate_new_token_pair(
+                    db, TokenRefreshRequest(refresh_token=first.refresh_token))
+            assert exc_info.value.status_code == 403
+            db.expire_all()
+            assert not get_refresh_token(db, third.refresh_token).active
+            assert get_refresh_token(db, other.refresh_token).active
+
+    def test_legacy_chain_revoked(self):
+        with SessionLocal() as db:
+            tokens = self.legacy_chain(db, 5)
+            assert deactivate_token_family(
+                db, get_refresh_token(db, tokens[2])) == 1
+            db.expire_all()
+            assert not get_refresh_token(db, tokens[-1]).active
+
+    def test_assign_token_families(self):
+        with SessionLocal() as db:
+            chains = [self.legacy_chain(db, n) for n in (1, 3, 7)]
+            assert assign_token_families(db, batch_size=2) >= 11
+            db.expire_all()
+            families = [{get_refresh_token(db, t).family_id for t in chain}
+                        for chain in chains]
+            assert all(len(f) == 1 and None not in f for f in families)
+            assert len(set.union(*families)) == 3
+
+            # a token rotated from a legacy token during the migration
+            orphan = save_refresh_token(db, 'orphan', 1, None)
+            add_child_refresh_token(db, get_refresh_token(db, chains[2][-1]),
+                                    orphan)
+            assert assign_token_families(db) == 1
+            assert get_refresh_token(db, 'orphan').family_id in families[2]
+
+    def test_delete_expired_refresh_tokens(self):
+        now = datetime.now()
+        expired, live = now - timedelta(hours=1), now + timedelta(hours=1)
+        tokens = {
+            'reap-a1': ('reap-a', expired), 'reap-a2': ('reap-a', expired),
+            'reap-a3': ('reap-a', expired), 'reap-b1': ('reap-b', expired),
+            'reap-b2': ('reap-b', live), 'reap-legacy': (None, expired),
+        }
+        with SessionLocal() as db:
+            for token, (family_id, not_after) in tokens.items():
+                db.add(RefreshToken(token=token, user_id=1, active=False,
+                                    family_id=family_id, not_after=not_after))
+            db.commit()
+
+            deleted, after = 0, ''
+            while after is not None:
+                batch_deleted, after = delete_expired_refresh_tokens(
+                    db, now, 2, after)
+                deleted += batch_deleted
+            assert deleted == 3
+            remaining = set(db.execute(
+                select(RefreshToken.token)
+                .where(RefreshToken.token.like('reap-%'))).scalars())
+            assert remaining == {'reap-b1', 'reap-b2', 'reap-legacy'}
@@ -0,0 +1,46 @@
+import gzip
+import json
+
+from app.crud import create_todos, iter_todos
+from app.export import todo_export_chunks
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.schemas import TodoCreateSchema, TodoSchema
+
+
+class TestTodoExport:
+    def setup_class(self):
+        Base.metadata.create_all(bind=engine)
+        with SessionLocal() as db:
+            create_todos(db, [TodoCreateSchema(name=f'a{i}', description='a')
+                              for i in range(25)], 1)
+            create_todos(db, [TodoCreateSchema(name='b', description='b')], 2)
+
+    def teardown_class(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def test_iter_todos_batches(self):
+        with SessionLocal() as db:
+            batches = list(iter_todos(db, 1, 10))
+            everything = [row for rows in iter_todos(db, None, 100)
+                          for row in rows]
+
+        assert [len(rows) for rows in batches] == [10, 10, 5]
+        ids = [row['id'] for rows in batches for row in rows]
+        assert ids == sorted(ids)
+        assert len(everything) == 26
+
+    def test_export_lines_match_todo_schema(self):
+        chunks = list(todo_export_chunks(1, batch_size=10))
+        lines = b''.join(chunks).decode().splitlines()
+
+        assert len(chunks) == 3
+        assert len(lines) == 25
+        todo = json.loads(lines[0])
+        assert list(todo) == list(TodoSchema.__fields__)
+        assert TodoSchema(**todo).name == 'a0'
+
+    def test_gzip_export(self):
+        plain = b''.join(todo_export_chunks(None))
+        compressed = b''.join(todo_export_chunks(None, gzip=True))
+        assert gzip.decompress(compressed) == plain
+        assert len(plain.splitlines()) == 26
@@ -0,0 +1,93 @@
+import gzip
+import io
+import json
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.crud import create_todo, get_todos_for_user
+from app.importer import import_todos, import_todos_from_request
+from app.internal.cache import invalidate_all
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.schemas import TodoCreateSchema
+
+
+def ndjson(*rows) -> bytes:
+    return ''.join((r if isinstance(r, str) else json.dumps(r)) + '\n'
+                   for r in rows).encode()
+
+
+def names(user_id: int) -> list[str]:
+    with SessionLocal() as db:
+        return [t.name for t in get_todos_for_user(db, 0, 1000, user_id)]
+
+
+class TestTodoImport:
+    def setup_method(self):
+        Base.metadata.create_all(bind=engine)
+        invalidate_all()
+
+    def teardown_method(self):
+        Base.metadata.drop_all(bind=engine)
+        invalidate_all()
+
+    def test_ndjson_import(self):
+        with SessionLocal() as db:
+            create_todo(db, TodoCreateSchema(name='taken', description='x'), 1)
+        body = ndjson({'name': 'a', 'description': 'a'},
+                      {'name': 'taken', 'description': 'x'},
+                      '',
+                      '{"name": broken',
+                      {'name': 'b'},
+                      {'name': 'a', 'description': 'repeated'},
+                      {'name': 'c', 'description': 'c'})
+
+        result = import_todos(io.BytesIO(body), 'ndjson', 1, chunk_size=2)
+
+        assert (result.inserted, result.duplicates, result.errors) == (2, 2, 2)
+        assert [(e.line, e.error.split(':')[0]) for e in result.error_details] \
+            == [(4, 'invalid JSON'), (5, 'description')]
+        assert sorted(names(1)) == ['a', 'c', 'taken']
+
+    def test_csv_import(self):
+        body = b'name,description\r\na,"two\r\nlines"\r\nb,b\r\nc\r\n'
+
+        result = import_todos(io.BytesIO(body), 'csv', 2)
+
+        assert (result.inserted, result.duplicates, result.errors) == (2, 0, 1)
+        assert result.error_details[0].line == 5
+        with SessionLocal() as db:
+            todos = get_todos_for_user(db, 0, 10, 2)
+        assert todos[0].description == 'two\r\nlines'
+
+    def test_streamed_gzip_request(self):
+        async def endpoint(request):
+            result = await run_in_threadpool(import_todos_from_request,
+                                             request, 3)
+            return JSONResponse(result.dict())
+
+        client = TestClient(Starlette(routes=[
+            Route('/import', endpoint, methods=['POST'])]))
+        body = gzip.compress(ndjson(*({'name': f'n{i}', 'description': 'd'}
+                                      for i in range(2000))))
+        chunks = (body[i:i + 1000] for i in range(0, len(body), 1000))
+
+        response = client.post('/import', data=chunks, headers={
+            'content-type': 'application/x-ndjson',
+            'content-encoding': 'gzip'})
+
+        assert response.json()['inserted'] == 2000
+        assert len(names(3)) == 1000
+
+    def test_unsupported_media_type(self):
+        async def endpoint(request):
+            await run_in_threadpool(import_todos_from_request, request, 4)
+
+        client = TestClient(Starlette(routes=[
+            Route('/import', endpoint, methods=['POST'])]),
+            raise_server_exceptions=False)
+        response = client.post('/import', data=b'<todos/>',
+                               headers={'content-type': 'application/xml'})
+        assert response.status_code == 415
@@ -0,0 +1,50 @@
+import json
+import logging
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.internal.log import JsonFormatter, RequestIdFilter
+from app.internal.log import RequestLogMiddleware, request_id
+
+
+def make_record(**extra) -> logging.LogRecord:
+    record = logging.LogRecord('app.test', logging.INFO, __file__, 1,
+                               "user %s logged in", ('test',), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_redacts_secrets():
+    token = request_id.set('req-1')
+    try:
+        record = make_record(user_id=1, password='hunter2',
+                             refresh_token='abc', jwt_key='k')
+        RequestIdFilter().filter(record)
+    finally:
+        request_id.reset(token)
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry['msg'] == "user test logged in"
+    assert entry['request_id'] == 'req-1'
+    assert entry['user_id'] == 1
+    assert {entry[k] for k in ('password', 'refresh_token', 'jwt_key')} == \
+        {'[redacted]'}
+
+
+def test_middleware_request_id(caplog):
+    async def echo_id(request):
+        return PlainTextResponse(request_id.get())
+
+    app = RequestLogMiddleware(Starlette(routes=[Route('/id', echo_id)]))
+    client = TestClient(app)
+    with caplog.at_level(logging.INFO, logger='app.access'):
+        response = client.get('/id', headers={'X-Request-ID': 'abc'})
+        generated = client.get('/id')
+
+    assert response.text == response.headers['x-request-id'] == 'abc'
+    assert len(generated.text) == 32
+    assert generated.headers['x-request-id'] == generated.text
+    access = [r for r in caplog.records if r.name == 'app.access']
+    assert [(r.path, r.status) for r in access] == [('/id', 200)] * 2
@@ -0,0 +1,89 @@
+import itertools
+import types
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import StaticPool
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.internal import metrics
+
+
+def test_middleware_records_route_status_and_sql():
+    engine = create_engine('sqlite://', future=True)
+    metrics.instrument_engine(engine)
+
+    def query(request):
+        with engine.connect() as conn:
+            for _ in range(3):
+                conn.execute(text('SELECT 1'))
+        return PlainTextResponse(request.path_params['name'])
+
+    app = Starlette(routes=[Route('/query/{name}', query)])
+    app.add_middleware(metrics.MetricsMiddleware)
+    client = TestClient(app)
+    client.get('/query/a')
+    client.get('/query/b')
+    client.get('/missing')
+
+    output = metrics.render()
+    labels = 'method="GET",route="/query/{name}"'
+    assert f'app_requests_total{{{labels},status="200"}} 2' in output
+    assert 'app_requests_total{method="GET",route="unmatched",status="404"} 1' \
+        in output
+    assert f'app_request_duration_seconds_count{{{labels}}} 2' in output
+    assert f'app_request_sql_statements_sum{{{labels}}} 6' in output
+    assert f'app_request_sql_statements_bucket{{{labels},le="2"}} 0' in output
+    assert f'app_request_sql_statements_bucket{{{labels},le="3"}} 2' in output
+
+
+def test_statements_outside_requests_are_not_counted():
+    engine = create_engine('sqlite://', future=True)
+    metrics.instrument_engine(engine)
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+    assert metrics.request_sql_stats.get() is None
+
+
+def test_failed_statements_are_timed(monkeypatch):
+    # every clock read is one second later
+    monkeypatch.setattr(metrics, 'time', types.SimpleNamespace(
+        perf_counter=itertools.count().__next__))
+    # one connection, shared with the threadpool the routes run in
+    engine = create_engine('sqlite://', future=True, poolclass=StaticPool,
+                           connect_args={'check_same_thread': False})
+    metrics.instrument_engine(engine)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE names (name TEXT UNIQUE)'))
+        conn.execute(text("INSERT INTO names VALUES ('a')"))
+
+    def insert(request):
+        with engine.connect() as conn:
+            try:
+                conn.execute(text("INSERT INTO names VALUES ('a')"))
+            except IntegrityError:
+                return PlainTextResponse('conflict', status_code=409)
+        return PlainTextResponse('created')
+
+    def select(request):
+        with engine.connect() as conn:
+            conn.execute(text('SELECT name FROM names'))
+        return PlainTextResponse('ok')
+
+    app = Starlette(routes=[Route('/timed/insert', insert, methods=['POST']),
+                            Route('/timed/select', select)])
+    app.add_middleware(metrics.MetricsMiddleware)
+    client = TestClient(app)
+    for _ in range(3):
+        assert client.post('/timed/insert').status_code == 409
+    assert client.get('/timed/select').status_code == 200
+
+    output = metrics.render()
+    insert_labels = 'method="POST",route="/timed/insert"'
+    select_labels = 'method="GET",route="/timed/select"'
+    assert f'app_request_sql_statements_sum{{{insert_labels}}} 3' in output
+    assert f'app_request_sql_seconds_sum{{{insert_labels}}} 3' in output
+    assert f'app_request_sql_seconds_sum{{{select_labels}}} 1' in output
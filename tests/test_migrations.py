@@ -0,0 +1,120 @@
+import pytest
+import sqlalchemy
+
+from app.internal.migrations import add_missing_columns, add_todo_indexes
+from app.internal.migrations import backfill_permission_masks, check_schema
+from app.internal.migrations import backfill_todo_versions, rebuild_todo_search
+from app.internal.migrations import backfill_user_names, rebuild_todo_stats
+from app.internal.migrations import SCHEMA_VERSION, migrate, schema_version
+from app.internal.models import RefreshToken, Todo, User
+
+
+# tables as created before the owner/name indexes, todo versions and token
+# families
+OLD_SCHEMA = [
+    "CREATE TABLE todos (id INTEGER PRIMARY KEY, name VARCHAR, "
+    "description VARCHAR, done BOOLEAN, owner INTEGER)",
+    "CREATE TABLE refresh_tokens (token TEXT PRIMARY KEY, user_id INTEGER, "
+    "token_child TEXT, not_after DATETIME, active BOOLEAN)",
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR, "
+    "password VARCHAR, permissions VARCHAR)",
+    "INSERT INTO todos (name, owner) VALUES ('a', 1), ('a', 1), ('a', 2)",
+    "INSERT INTO users (name, permissions) VALUES ('a', '1,2'), ('Ä', '100')",
+]
+
+
+@pytest.fixture
+def old_engine():
+    engine = sqlalchemy.create_engine('sqlite://')
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA:
+            conn.execute(sqlalchemy.text(statement))
+    return engine
+
+
+def test_upgrade_old_schema(old_engine):
+    with pytest.raises(RuntimeError, match='migrate-todo-indexes'):
+        check_schema(old_engine)
+    with pytest.raises(ValueError, match='1 todo names are duplicated'):
+        add_todo_indexes(old_engine)
+
+    with old_engine.begin() as conn:
+        conn.execute(sqlalchemy.text(
+            "UPDATE todos SET name = 'b' WHERE id = 2"))
+    assert 'uq_todos_owner_name' in add_todo_indexes(old_engine)
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        with old_engine.begin() as conn:
+            conn.execute(sqlalchemy.text(
+                "INSERT INTO todos (name, owner) VALUES ('a', 1)"))
+
+    with pytest.raises(RuntimeError, match='migrate-todo-versions'):
+        check_schema(old_engine)
+    assert add_missing_columns(old_engine, Todo.__table__) == ['version']
+    assert backfill_todo_versions(old_engine, batch_size=2) == 3
+
+    with pytest.raises(RuntimeError, match='migrate-token-families'):
+        check_schema(old_engine)
+    assert add_missing_columns(old_engine, RefreshToken.__table__) == ['family_id']
+
+    with pytest.raises(RuntimeError, match='migrate-permission-masks'):
+        check_schema(old_engine)
+    assert add_missing_columns(old_engine, User.__table__) == [
+        'name_lower', 'permission_mask']
+    assert backfill_permission_masks(old_engine, batch_size=1) == 2
+    with old_engine.connect() as conn:
+        masks = conn.execute(sqlalchemy.text(
+            "SELECT permission_mask FROM users ORDER BY id")).scalars().all()
+    assert masks == [0b11, 0b1000]
+
+    with pytest.raises(RuntimeError, match='migrate-user-names'):
+        check_schema(old_engine)
+    assert backfill_user_names(old_engine, batch_size=1) == 2
+    with old_engine.connect() as conn:
+        names = conn.execute(sqlalchemy.text(
+            "SELECT name_lower FROM users ORDER BY id")).scalars().all()
+    assert names == ['a', 'ä']
+
+    with pytest.raises(RuntimeError, match='rebuild-todo-search'):
+        check_schema(old_engine)
+    assert rebuild_todo_search(old_engine) == 3
+    with old_engine.connect() as conn:
+        found = conn.execute(sqlalchemy.text(
+            "SELECT rowid FROM todos_fts WHERE todos_fts MATCH 'b'"
+        )).scalars().all()
+    assert found == [2]
+
+    with pytest.raises(RuntimeError, match='rebuild-todo-stats'):
+        check_schema(old_engine)
+    assert rebuild_todo_stats(old_engine) == 2
+    with old_engine.connect() as conn:
+        counts = conn.execute(sqlalchemy.text(
+            "SELECT owner, total FROM todo_stats ORDER BY owner")).all()
+    assert counts == [(0, 3), (1, 2), (2, 1)]
+    check_schema(old_engine)
+
+
+def test_migrate(old_engine):
+    with pytest.raises(ValueError, match='1 todo names are duplicated'):
+        list(migrate(old_engine))
+    assert schema_version(old_engine) is None
+
+    with old_engine.begin() as conn:
+        conn.execute(sqlalchemy.text(
+            "UPDATE todos SET name = 'b' WHERE id = 2"))
+    assert [version for version, _ in migrate(old_engine)] == \
+        list(range(1, SCHEMA_VERSION + 1))
+    check_schema(old_engine)
+    assert list(migrate(old_engine)) == []
+    with old_engine.connect() as conn:
+        assert conn.execute(sqlalchemy.text(
+            "SELECT owner, total FROM todo_stats ORDER BY owner")).all() == \
+            [(0, 3), (1, 2), (2, 1)]
+
+
+def test_migrate_new_database():
+    engine = sqlalchemy.create_engine('sqlite://')
+    with pytest.raises(RuntimeError, match='python -m app migrate'):
+        check_schema(engine)
+    assert len(list(migrate(engine))) == SCHEMA_VERSION
+    assert schema_version(engine) == SCHEMA_VERSION
+    check_schema(engine)
@@ -0,0 +1,130 @@
+import io
+from sqlite3 import IntegrityError
+import fastapi
+import pytest
+from starlette.testclient import TestClient
+
+from app import provisioning
+from app.admin import admin_router
+from app.crud import get_user_by_username, insert_user
+from app.internal import config, hashing
+from app.internal.auth import verify_auth_token
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.hashing import HashingExecutor, check_password
+from app.internal.schemas import UserDTOSchemaAdmin, UserInsertSchema
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Passwords hashed by provisioning"""
+    monkeypatch.setattr(hashing.hashing_executor, 'workers', 0)
+    monkeypatch.setattr(config, 'bcrypt_rounds', 4)
+    passwords = []
+    hash_passwords = provisioning.hash_passwords
+
+    def spy(chunk):
+        passwords.extend(chunk)
+        return hash_passwords(chunk)
+    monkeypatch.setattr(provisioning, 'hash_passwords', spy)
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        insert_user(db, UserInsertSchema(name='taken', password='',
+                                         permissions=[1]))
+    yield passwords
+    Base.metadata.drop_all(bind=engine)
+
+
+def user(name: str, password: str = 'pw') -> UserDTOSchemaAdmin:
+    return UserDTOSchemaAdmin(name=name, raw_password=password,
+                              permissions=[1, 2])
+
+
+def test_conflicts_are_not_hashed(hashed):
+    users = [user('a', 'pa'), user('taken', 'pt'), user('b', 'pb'),
+             user('a', 'pa2'), user('c', 'pc')]
+    results = list(provisioning.provision_users(enumerate(users),
+                                                chunk_size=2))
+
+    assert [key for key, _ in results] == [0, 1, 2, 3, 4]
+    assert [getattr(r, 'name', None) for _, r in results] == \
+        ['a', None, 'b', None, 'c']
+    assert [str(r) for _, r in results if isinstance(r, IntegrityError)] \
+        == ["Username already in use"] * 2
+    assert hashed == ['pa', 'pb', 'pc']
+    with SessionLocal() as db:
+        created = get_user_by_username(db, 'a')
+        assert check_password('pa', created.password)
+        assert created.name_lower == 'a' and created.permissions == [1, 2]
+
+
+def test_file_reports_invalid_rows(hashed):
+    text = io.StringIO('name,raw_password,permissions\n'
+                       'd,pd,1 2\n'
+                       'taken,x,1\n'
+                       'e,pe,7\n'
+                       'f,pf,\n')
+    results = list(provisioning.provision_users_from_file(text, 'csv'))
+
+    assert [line for line, _ in results] == [4, 2, 3, 5]
+    assert isinstance(results[0][1], ValueError)
+    assert 'permissions' in str(results[0][1])
+    assert [getattr(r, 'name', None) for _, r in results[1:]] == \
+        ['d', None, 'f']
+
+
+def test_bulk_endpoint(hashed, monkeypatch):
+    app = fastapi.FastAPI()
+    app.include_router(admin_router)
+    app.dependency_overrides[verify_auth_token] = lambda: {'sub': 1, 'perm': -1}
+    client = TestClient(app)
+    body = [{'name': name, 'raw_password': 'pw', 'permissions': [1]}
+            for name in ('x', 'taken', 'y', 'x')]
+
+    response = client.post('/api/admin/users/bulk', json=body)
+    assert response.status_code == 200
+    assert [(r['status'], r['user'] and r['user']['name'], r['error'])
+            for r in response.json()] == [
+        (201, 'x', None), (400, None, "Username already in use"),
+        (201, 'y', None), (400, None, "Username already in use")]
+
+    monkeypatch.setattr(config, 'provision_max_items', 3)
+    assert client.post('/api/admin/users/bulk', json=body).status_code == 413
+
+
+def test_bulk_endpoint_reports_a_lost_chunk(hashed, monkeypatch):
+    app = fastapi.FastAPI()
+    app.include_router(admin_router)
+    app.dependency_overrides[verify_auth_token] = lambda: {'sub': 1, 'perm': -1}
+    monkeypatch.setattr(config, 'provision_chunk_size', 2)
+    create_users = provisioning.crud.create_users
+    calls = []
+
+    def create_users_racing(db, users, retry=True):
+        calls.append(users)
+        if len(calls) == 2:
+            # names of the second chunk were taken again on the retry
+            raise IntegrityError("Username already in use")
+        return create_users(db, users, retry)
+    monkeypatch.setattr(provisioning.crud, 'create_users',
+                        create_users_racing)
+    body = [{'name': name, 'raw_password': 'pw', 'permissions': [1]}
+            for name in ('p', 'q', 'r', 's', 't')]
+
+    response = TestClient(app).post('/api/admin/users/bulk', json=body)
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json()] == [201, 201, 409, 409, 201]
+    with SessionLocal() as db:
+        assert get_user_by_username(db, 's') is None
+        assert get_user_by_username(db, 't').name == 't'
+
+
+def test_map_keeps_order_and_leaves_queue_slots():
+    executor = HashingExecutor(2, 2)
+    try:
+        assert executor.map(pow, [(2, i) for i in range(10)]) == \
+            [2 ** i for i in range(10)]
+        # map holds at most ``workers`` slots, single calls get the others
+        assert executor.run(pow, 3, 2) == 9
+    finally:
+        executor.shutdown()
@@ -0,0 +1,61 @@
+import fastapi
+import pytest
+from fastapi.responses import JSONResponse
+from starlette.testclient import TestClient
+
+from app.internal import config, responses
+from app.internal.auth import verify_auth_token
+from app.internal.cache import invalidate_all
+from app.internal.db import engine, Base
+from app.main import main_router
+
+
+TRICKY = ''.join(chr(i) for i in range(0x80)) + 'é€😀 ﻿\U0010ffff'
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def encoder(request, monkeypatch):
+    if request.param == 'json':
+        monkeypatch.setattr(responses, 'orjson', None)
+    elif responses.orjson is None:
+        pytest.skip("orjson is not installed")
+
+
+def test_dumps_matches_json_response(encoder):
+    content = [{'id': 2 ** 62, 'name': TRICKY, 'done': True, 'x': None}, -1]
+    assert responses.dumps(content) == JSONResponse(content).body
+
+
+@pytest.fixture
+def client(monkeypatch):
+    Base.metadata.create_all(bind=engine)
+    invalidate_all()
+    app = fastapi.FastAPI()
+    app.include_router(main_router)
+    app.dependency_overrides[verify_auth_token] = lambda: {'sub': 1, 'perm': -1}
+    client = TestClient(app)
+    for i, name in enumerate(['milk', 'milk "2"', TRICKY, 'bread']):
+        client.post('/api/todos', json={'name': name, 'description': f'milk {i}'})
+    client.put('/api/todos/2', json={'done': True})
+    yield client
+    Base.metadata.drop_all(bind=engine)
+    invalidate_all()
+
+
+@pytest.mark.parametrize('url', [
+    '/api/todos?limit=2',
+    '/api/todos?limit=2&sort=name&order=desc',
+    '/api/todos?done=false&limit=2',
+    '/api/todos/search?q=milk&limit=2',
+])
+def test_fast_responses_are_byte_identical(client, encoder, monkeypatch, url):
+    monkeypatch.setattr(config, 'fast_read_responses', False)
+    validated = client.get(url)
+    invalidate_all()
+    monkeypatch.setattr(config, 'fast_read_responses', True)
+    fast = client.get(url)
+
+    assert fast.status_code == validated.status_code == 200
+    assert len(fast.json()) == 2
+    assert fast.content == validated.content
+    assert fast.headers == validated.headers
@@ -0,0 +1,83 @@
+from app.crud import create_todos, delete_todo_by_id, search_todos
+from app.crud import todo_search_expression, update_todo_by_id
+from app.internal.cache import invalidate_all
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.schemas import TodoCreateSchema, TodoUpdateSchema
+
+
+def names(results) -> list[str]:
+    return [todo.name for _, todo in results]
+
+
+class TestTodoSearch:
+    def setup_method(self):
+        Base.metadata.create_all(bind=engine)
+        invalidate_all()
+        with SessionLocal() as db:
+            self.todos = create_todos(db, [
+                TodoCreateSchema(name='buy milk', description='at the shop'),
+                TodoCreateSchema(name='call mom', description='about milk'),
+                TodoCreateSchema(name='milkshake', description='strawberry'),
+                TodoCreateSchema(name='taxes', description='before april'),
+            ], 1)
+            create_todos(db, [
+                TodoCreateSchema(name='buy milk', description='other user'),
+            ], 2)
+
+    def teardown_method(self):
+        Base.metadata.drop_all(bind=engine)
+        invalidate_all()
+
+    def test_expression_quotes_words(self):
+        assert todo_search_expression('buy "milk') == '"buy" """milk"'
+        assert todo_search_expression('milk* OR') == '"milk"* "OR"'
+        assert todo_search_expression(' * ') == ''
+
+    def test_ranked_and_scoped_to_owner(self):
+        with SessionLocal() as db:
+            results = search_todos(db, 'milk', 10, 1)
+            assert names(results) == ['buy milk', 'call mom']
+            assert all(todo.owner == 1 for _, todo in results)
+            assert [todo.version for _, todo in results] == [1, 1]
+            # name matches weigh more than description matches
+            prefixed = names(search_todos(db, 'milk*', 10, 1))
+            assert sorted(prefixed[:2]) == ['buy milk', 'milkshake']
+            assert prefixed[2] == 'call mom'
+            assert names(search_todos(db, 'buy milk', 10, 2)) == ['buy milk']
+            assert search_todos(db, 'april milk', 10, 1) == []
+            assert search_todos(db, '"', 10, 1) == []
+
+    def test_pages(self):
+        with SessionLocal() as db:
+            everything = search_todos(db, 'milk*', 10, 1)
+            first = search_todos(db, 'milk*', 2, 1)
+            second = search_todos(db, 'milk*', 2, 1, offset=2)
+        assert names(first + second) == names(everything)
+        assert len(second) == 1
+
+    def test_pages_survive_other_users_writes(self):
+        with SessionLocal() as db:
+            create_todos(db, [TodoCreateSchema(name=f'milk {i}',
+                                               description='x ' * i)
+                              for i in range(6)], 3)
+            everything = search_todos(db, 'milk', 10, 3)
+            first = search_todos(db, 'milk', 3, 3)
+            # moves every rank, a rank cursor skipped todos after this
+            create_todos(db, [TodoCreateSchema(name=f'milk {i}',
+                                               description='milk ' * 30)
+                              for i in range(40)], 2)
+            second = search_todos(db, 'milk', 10, 3, offset=3)
+        assert names(first + second) == names(everything)
+
+    def test_index_follows_writes(self):
+        buy_milk, call_mom = self.todos[0], self.todos[1]
+        with SessionLocal() as db:
+            update_todo_by_id(db, buy_milk.id,
+                              TodoUpdateSchema(name='buy bread'), 1)
+            delete_todo_by_id(db, call_mom.id, 1)
+            update_todo_by_id(db, self.todos[3].id, TodoUpdateSchema(done=True),
+                              1)
+
+            assert names(search_todos(db, 'milk', 10, 1)) == []
+            assert names(search_todos(db, 'bread', 10, 1)) == ['buy bread']
+            assert names(search_todos(db, 'april', 10, 1)) == ['taxes']
@@ -0,0 +1,162 @@
+import http.client
+import json
+import os
+import queue
+import re
+import signal
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import app.internal.db as db
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = {**os.environ, 'PYTHONPATH': REPO_ROOT, 'TODO_CONFIG': 'config.yaml'}
+
+
+class Launcher:
+    """``python -m app serve`` in the background, its log lines in a queue"""
+
+    def __init__(self, workdir, workers):
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'app', 'serve', '--port', '0',
+             '--workers', str(workers), '--graceful-timeout', '5'],
+            cwd=workdir, env=ENV, stderr=subprocess.PIPE, text=True)
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stderr:
+            if line.startswith('[serve'):
+                self.lines.put(line.split('] ', 1)[1].strip())
+
+    def wait_for(self, prefix: str, count: int = 1) -> list[str]:
+        found = []
+        while len(found) < count:
+            line = self.lines.get(timeout=30)
+            if line.startswith(prefix):
+                found.append(line)
+        return found
+
+    def signal(self, sig: int):
+        self.process.send_signal(sig)
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    with open(os.path.join(REPO_ROOT, 'test-config.yaml')) as test_config:
+        (tmp_path / 'config.yaml').write_text(test_config.read().replace(
+            'test.sqlite', str(tmp_path / 'db.sqlite')))
+    (tmp_path / 'jwt_secret.txt').write_text('secret')
+    return tmp_path
+
+
+def get_status(port: int) -> int:
+    try:
+        urllib.request.urlopen(f'http://127.0.0.1:{port}/api/todos',
+                               timeout=10)
+    except urllib.error.HTTPError as e:
+        return e.code
+    return 200
+
+
+def call(conn: http.client.HTTPConnection, method: str, path: str,
+         body=None, token: str | None = None):
+    headers = {'authorization': f'Token {token}'} if token else {}
+    conn.request(method, path, body and json.dumps(body), headers)
+    response = conn.getresponse()
+    data = response.read()
+    assert response.status < 300, data
+    return json.loads(data) if path != '/metrics' else data.decode()
+
+
+def worker_connections(port: int) -> list[http.client.HTTPConnection]:
+    """Keep-alive connections to two different workers"""
+    connections = {}
+    for _ in range(200):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        # the first scrape of a worker may come before any series
+        call(conn, 'GET', '/metrics')
+        worker = re.search(r'worker="(\d+)"', call(conn, 'GET', '/metrics'))
+        connections.setdefault(worker[1], conn)
+        if len(connections) == 2:
+            return list(connections.values())
+    raise AssertionError("every connection went to the same worker")
+
+
+def test_serve_refuses_unmigrated_database(workdir):
+    launcher = Launcher(workdir, 2)
+    assert launcher.process.wait(timeout=60) == 1
+    launcher.wait_for('worker failed to start')
+
+
+def test_serve_scale_reload_and_stop(workdir):
+    subprocess.run([sys.executable, '-m', 'app', 'migrate'], cwd=workdir,
+                   env=ENV, check=True, capture_output=True)
+    launcher = Launcher(workdir, 2)
+    try:
+        port = int(launcher.wait_for('listening on')[0].rsplit(':', 1)[1])
+        launcher.wait_for('started worker', 2)
+        assert get_status(port) == 401
+
+        launcher.signal(signal.SIGTTIN)
+        launcher.wait_for('started worker')
+        launcher.signal(signal.SIGTTOU)
+        launcher.wait_for('worker', 1)
+
+        # the new generation takes over, the socket never closes
+        launcher.signal(signal.SIGHUP)
+        launcher.wait_for('reloading')
+        launcher.wait_for('started worker', 2)
+        launcher.wait_for('worker', 2)
+        assert get_status(port) == 401
+
+        launcher.signal(signal.SIGTERM)
+        assert launcher.process.wait(timeout=60) == 0
+        launcher.wait_for('stopped')
+    finally:
+        launcher.process.kill()
+
+
+def test_workers_see_each_others_writes(workdir):
+    with open(workdir / 'config.yaml', 'a') as settings:
+        settings.write('metrics_enabled: true\nbcrypt_rounds: 4\n')
+    subprocess.run([sys.executable, '-m', 'app', 'migrate'], cwd=workdir,
+                   env=ENV, check=True, capture_output=True)
+    launcher = Launcher(workdir, 2)
+    try:
+        launcher.wait_for('dogpile.cache.memory is per process')
+        port = int(launcher.wait_for('listening on')[0].rsplit(':', 1)[1])
+        launcher.wait_for('started worker', 2)
+        writer, reader = worker_connections(port)
+        user = {'name': 'u', 'raw_password': 'pw'}
+        call(writer, 'POST', '/api/auth/register', user)
+        token = call(writer, 'POST', '/api/auth/login', user)['auth_token']
+
+        assert call(reader, 'GET', '/api/todos', token=token) == []
+        call(writer, 'POST', '/api/todos',
+             {'name': 'milk', 'description': ''}, token)
+        todos = call(reader, 'GET', '/api/todos', token=token)
+        assert [todo['name'] for todo in todos] == ['milk']
+    finally:
+        launcher.process.kill()
+
+
+def test_fork_forgets_engines():
+    engine = db.get_engine()
+    with engine.connect():
+        pass
+    pid = os.fork()
+    if pid == 0:
+        # the child's engine is a new one, the inherited pool is left alone
+        os._exit(0 if db._engine is None and db.get_engine() is not engine
+                 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert db._engine is engine
+    assert engine.pool.checkedin() == 1
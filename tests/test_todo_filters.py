@@ -0,0 +1,90 @@
+import itertools
+import pytest
+import sqlalchemy
+
+from app.crud import create_todos, list_todos_for_user, update_todo_by_id
+from app.internal.cache import invalidate_all
+from app.internal.db import engine, Base, SessionLocal
+from app.internal.schemas import SortOrder, TodoCreateSchema, TodoSortField
+from app.internal.schemas import TodoUpdateSchema
+
+
+NAMES = ['apple', 'apricot', 'banana', 'ab\U0010ffff', 'cherry', 'avocado']
+
+
+def names(todos) -> list[str]:
+    return [todo.name for todo in todos]
+
+
+class TestTodoFilters:
+    def setup_method(self):
+        Base.metadata.create_all(bind=engine)
+        invalidate_all()
+        with SessionLocal() as db:
+            todos = create_todos(db, [TodoCreateSchema(name=n, description='')
+                                      for n in NAMES], 1)
+            create_todos(db, [TodoCreateSchema(name='apple', description='')], 2)
+            for todo in todos[::2]:
+                update_todo_by_id(db, todo.id, TodoUpdateSchema(done=True), 1)
+
+    def teardown_method(self):
+        Base.metadata.drop_all(bind=engine)
+        invalidate_all()
+
+    def test_filters_and_sort(self):
+        with SessionLocal() as db:
+            assert names(list_todos_for_user(db, 1, 10, done=False)) == \
+                ['apricot', 'ab\U0010ffff', 'avocado']
+            assert names(list_todos_for_user(
+                db, 1, 10, name_prefix='ap', sort=TodoSortField.name)) == \
+                ['apple', 'apricot']
+            assert names(list_todos_for_user(
+                db, 1, 10, name_prefix='ab\U0010ffff')) == ['ab\U0010ffff']
+            assert names(list_todos_for_user(
+                db, 1, 10, done=True, name_prefix='a', sort=TodoSortField.name,
+                order=SortOrder.desc)) == ['apple']
+
+    def test_keyset_pages_follow_the_sort(self):
+        with SessionLocal() as db:
+            first = list_todos_for_user(db, 1, 2, sort=TodoSortField.name,
+                                        order=SortOrder.desc)
+            second = list_todos_for_user(db, 1, 2, after=first[-1].name,
+                                         sort=TodoSortField.name,
+                                         order=SortOrder.desc)
+        assert names(first + second) == ['cherry', 'banana', 'avocado',
+                                         'apricot']
+
+
+@pytest.fixture
+def statements():
+    Base.metadata.create_all(bind=engine)
+    invalidate_all()
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', capture)
+    yield captured
+    sqlalchemy.event.remove(engine, 'before_cursor_execute', capture)
+    Base.metadata.drop_all(bind=engine)
+    invalidate_all()
+
+
+@pytest.mark.parametrize('done,name_prefix,sort,order,paged', list(
+    itertools.product([None, True], [None, 'ap'], list(TodoSortField),
+                      list(SortOrder), [False, True])))
+def test_every_combination_uses_an_index(statements, done, name_prefix, sort,
+                                         order, paged):
+    after = ('apple' if sort == TodoSortField.name else 1) if paged else None
+    with SessionLocal() as db:
+        list_todos_for_user(db, 1, 20, after=after, done=done,
+                            name_prefix=name_prefix, sort=sort, order=order)
+    statement, parameters = statements[-1]
+
+    with engine.connect() as conn:
+        plan = [row[3] for row in conn.exec_driver_sql(
+            f'EXPLAIN QUERY PLAN {statement}', parameters)]
+    todos_steps = [step for step in plan if 'todos' in step]
+    assert todos_steps and all(
+        step.startswith('SEARCH todos USING ') and 'INDEX' in step
+        for step in todos_steps), plan
@@ -0,0 +1,94 @@
+import fastapi
+import pytest
+import sqlalchemy
+from starlette.testclient import TestClient
+
+from app.admin import admin_router
+from app.internal.auth import verify_auth_token
+from app.internal.cache import invalidate_all
+from app.internal.db import engine, Base
+from app.internal.migrations import rebuild_todo_stats, todo_stats_drift
+from app.internal.models import ALL_USERS
+from app.main import main_router
+
+
+@pytest.fixture
+def client():
+    Base.metadata.create_all(bind=engine)
+    invalidate_all()
+    app = fastapi.FastAPI()
+    app.include_router(main_router)
+    app.include_router(admin_router)
+    token = {'sub': 1, 'perm': -1}
+    app.dependency_overrides[verify_auth_token] = lambda: token
+    client = TestClient(app)
+    client.token = token
+    yield client
+    Base.metadata.drop_all(bind=engine)
+    invalidate_all()
+
+
+def stats(client) -> tuple[int, int, int]:
+    result = client.get('/api/todos/stats').json()
+    return result['total'], result['done'], result['open']
+
+
+def test_every_write_path_updates_stats(client):
+    assert stats(client) == (0, 0, 0)
+    ids = [client.post('/api/todos', json={'name': name, 'description': ''})
+           .json()['id'] for name in 'abc']
+    client.put(f'/api/todos/{ids[0]}', json={'done': True})
+    client.put(f'/api/todos/{ids[0]}', json={'done': True})
+    client.put(f'/api/todos/{ids[1]}', json={'name': 'b2'})
+    assert stats(client) == (3, 1, 2)
+
+    batch = client.post('/api/todos/batch', json=[
+        {'name': 'd', 'description': ''}, {'name': 'a', 'description': ''},
+        {'name': 'e', 'description': ''}]).json()
+    # the same todo twice in a batch counts once
+    client.patch('/api/todos/batch', json=[
+        {'id': ids[1], 'done': True}, {'id': ids[1], 'done': False},
+        {'id': ids[1], 'done': True}, {'id': ids[2], 'name': 'a'},
+        {'id': 999, 'done': True}])
+    assert stats(client) == (5, 2, 3)
+
+    client.delete(f'/api/todos/{ids[0]}')
+    client.delete('/api/todos/batch',
+                  json=[ids[1], batch[0]['todo']['id'], 999])
+    client.post('/api/todos/import', data=b'{"name": "f", "description": ""}\n')
+    assert stats(client) == (3, 0, 3)
+
+    client.token['sub'] = 2
+    client.post('/api/todos', json={'name': 'a', 'description': ''})
+    assert stats(client) == (1, 0, 1)
+    assert client.get('/api/admin/todos/stats').json() == {
+        'total': 4, 'done': 0, 'open': 4}
+    assert client.get('/api/admin/todos/stats?user_id=1').json()['total'] == 3
+    assert todo_stats_drift(engine) == []
+
+
+def test_failed_writes_leave_stats(client):
+    todo = client.post('/api/todos', json={'name': 'a', 'description': ''})
+    client.post('/api/todos', json={'name': 'b', 'description': ''})
+    url = todo.headers['location']
+    assert client.put(url, json={'done': True, 'name': 'b'}).status_code == 400
+    assert client.put(url, json={'done': True},
+                      headers={'If-Match': '"stale"'}).status_code == 412
+    assert client.delete(url, headers={'If-Match': '"stale"'}).status_code == 412
+    assert client.put('/api/todos/999', json={'done': True}).status_code == 404
+    assert stats(client) == (2, 0, 2)
+    assert todo_stats_drift(engine) == []
+
+
+def test_rebuild_fixes_drift(client):
+    for name in 'ab':
+        client.post('/api/todos', json={'name': name, 'description': ''})
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(
+            "UPDATE todos SET done = 1 WHERE name = 'a'"))
+    assert todo_stats_drift(engine) == [(ALL_USERS, (2, 0), (2, 1)),
+                                        (1, (2, 0), (2, 1))]
+    assert rebuild_todo_stats(engine) == 1
+    assert todo_stats_drift(engine) == []
+    invalidate_all()
+    assert stats(client) == (2, 1, 1)